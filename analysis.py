@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+'''
+Fixed point and linear stability analysis of the BGTCS MFM.
+
+Usage:
+  analysis [options] [<key>=<value>]...
+
+Options:
+  -n --roots N      Number of characteristic roots to list [default: 6]
+  -c --continuous   Refine roots on the continuous delay equation instead of
+                    the Euler scheme integrated by MFM.advance
+  -h --help         Show this screen
+'''
+
+import warnings
+
+import numpy as np
+
+from mfm import MFM
+from kernel import Kernel, sigmoid
+
+def _model(mfm, kwargs):
+    '''
+    Return mfm, or a minimal MFM (single sample) built from kwargs. Changes
+    scheduled at t=0 are applied, as at the start of a run.
+    '''
+    if mfm is None:
+        kwargs = dict(kwargs)
+        kwargs.setdefault('tstop', kwargs.get('dt', 1e-3))
+        kwargs['verbose'] = False
+        mfm = MFM(**kwargs)
+        for t,changes in mfm.params.get('schedule', []):
+            if int(round(t/mfm.params['dt'])) == 0:
+                mfm._apply(changes)
+    return mfm
+
+def fixed_point(mfm=None, x0=None, tol=1e-10, maxiter=50, **kwargs):
+    '''
+    Deterministic steady state of the model, found by Newton's method.
+
+    Parameters
+    ----------
+    mfm : MFM, optional
+        Model to analyse. If None, one is built from kwargs (MFM options,
+        e.g. DD=False).
+    x0 : array_like (20,), optional
+        Initial guess. Defaults to the MFM initial condition.
+    tol : float
+        Convergence tolerance on the Newton step (mV)
+    maxiter : int
+        Maximum number of Newton iterations
+
+    Returns
+    -------
+    x : numpy.array (20,)
+        Steady state, in the layout of MFM.S
+    '''
+    mfm = _model(mfm, kwargs)
+    kernel = Kernel(mfm)
+
+    x = np.array(mfm.S[0] if x0 is None else x0, dtype=np.float64)
+    for _ in range(maxiter):
+        A = kernel.jacobian(x)
+        J = sum(A.values())
+        step = np.linalg.solve(J, kernel.rhs(x, x[kernel.pre]))
+        x -= step
+        if np.max(np.abs(step)) < tol:
+            return x
+    raise RuntimeError('fixed point did not converge in {} iterations'.format(maxiter))
+
+def characteristic_matrix(A, s, dt):
+    '''
+    Characteristic matrix Delta(s) = sI - sum(A[d] exp(-s d dt)) of a
+    linearized delay system, and its derivative with respect to s.
+    '''
+    n = len(A[0])
+    D  = s*np.eye(n, dtype=complex)
+    dD = np.eye(n, dtype=complex)
+    for d,Ad in A.items():
+        E = np.exp(-s*d*dt)
+        D  -= Ad*E
+        dD += Ad*d*dt*E
+    return D, dD
+
+def _euler_roots(A, dt):
+    '''
+    Eigenvalues of the Euler-discretized delay system (the scheme used by
+    MFM.advance), mapped to the s-plane. Only the delayed state columns are
+    carried in the companion matrix, which keeps it small.
+    '''
+    n = len(A[0])
+    # Longest delay at which each state column is read
+    depth = np.zeros(n, dtype=int)
+    for d,Ad in A.items():
+        depth[np.any(Ad != 0, axis=0)] = np.maximum(depth[np.any(Ad != 0, axis=0)], d)
+
+    # Companion state: x(k), then x_c(k-1)..x_c(k-depth[c]) for each column c
+    offset = {}
+    size = n
+    for c in np.flatnonzero(depth):
+        offset[c] = size
+        size += depth[c]
+
+    def index(c, d):
+        return c if d == 0 else offset[c] + d - 1
+
+    M = np.zeros((size,size))
+    M[:n,:n] = np.eye(n)
+    for d,Ad in A.items():
+        for c in np.flatnonzero(np.any(Ad != 0, axis=0)):
+            M[:n,index(c,d)] += dt*Ad[:,c]
+    for c in offset:
+        M[offset[c],c] = 1
+        for d in range(2,depth[c]+1):
+            M[index(c,d),index(c,d-1)] = 1
+
+    z = np.linalg.eigvals(M)
+    z = z[z != 0]
+    return np.log(z)/dt
+
+def characteristic_roots(mfm=None, x=None, n=6, scheme='euler', newton=20, **kwargs):
+    '''
+    Rightmost characteristic roots of the delay-differential system linearized
+    about its fixed point.
+
+    With scheme='euler' the roots are those of the forward Euler
+    discretization with integer step delays that MFM.advance integrates,
+    det((z-1)/dt I - sum(A[d] z^-d)) = 0, mapped to s = log(z)/dt. These
+    predict the growth/decay of the simulated model exactly. With
+    scheme='continuous' they are refined by Newton's method on the continuous
+    characteristic equation det(Delta(s)) = 0; at dt = 1 ms the two differ
+    noticeably in their real parts.
+
+    Parameters
+    ----------
+    mfm : MFM, optional
+        Model to analyse. If None, one is built from kwargs.
+    x : array_like (20,), optional
+        Linearization point. Defaults to fixed_point(mfm).
+    n : int
+        Number of roots to return (with Im(s) >= 0)
+    scheme : str
+        'euler' or 'continuous'
+    newton : int
+        Maximum number of Newton iterations per root (continuous scheme)
+
+    Returns
+    -------
+    roots : numpy.array of complex (1/s)
+        Roots sorted by decreasing real part. Im(s)/(2 pi) is the frequency.
+    '''
+    if scheme not in ('euler','continuous'):
+        raise ValueError("scheme must be 'euler' or 'continuous'")
+
+    mfm = _model(mfm, kwargs)
+    kernel = Kernel(mfm)
+    if x is None:
+        x = fixed_point(mfm)
+    A = kernel.jacobian(x)
+
+    roots = _euler_roots(A, kernel.dt)
+    roots = roots[roots.imag >= 0]
+    roots = roots[np.argsort(-roots.real)]
+
+    if scheme == 'euler':
+        return roots[:n]
+
+    refined = []
+    for s in roots[:2*n]:
+        for _ in range(newton):
+            D, dD = characteristic_matrix(A, s, kernel.dt)
+            # Newton step on det(Delta): det'/det = trace(Delta^-1 Delta')
+            step = 1./np.trace(np.linalg.solve(D, dD))
+            s -= step
+            if abs(step) < 1e-10:
+                break
+        # Several candidates may converge to the same root
+        if s.imag >= -1e-8 and not any(abs(s - r) < 1e-6 for r in refined):
+            refined.append(complex(s.real, abs(s.imag)))
+    roots = np.array(refined)
+    return roots[np.argsort(-roots.real)][:n]
+
+def stability(mfm=None, n=6, scheme='euler', **kwargs):
+    '''
+    Stability of the fixed point and dominant oscillation frequency.
+
+    Parameters
+    ----------
+    mfm : MFM, optional
+        Model to analyse. If None, one is built from kwargs.
+    n : int
+        Number of characteristic roots to report
+    scheme : str
+        'euler' or 'continuous', see characteristic_roots
+
+    Returns
+    -------
+    result : dict
+        fixed_point : numpy.array (20,)
+        roots       : numpy.array of complex, rightmost first
+        stable      : bool, all reported roots have Re(s) < 0
+        frequency   : float (Hz), frequency of the rightmost oscillatory root
+        growth      : float (1/s), real part of that root (<0 is damped)
+    '''
+    mfm = _model(mfm, kwargs)
+    x = fixed_point(mfm)
+    roots = characteristic_roots(mfm, x, n=n, scheme=scheme)
+
+    oscillatory = roots[roots.imag > 0]
+    dominant = oscillatory[0] if len(oscillatory) else np.nan
+    return {'fixed_point' : x,
+            'roots'       : roots,
+            'stable'      : bool(np.all(roots.real < 0)),
+            'frequency'   : np.imag(dominant)/(2*np.pi),
+            'growth'      : np.real(dominant)}
+
+def noise_gain(mfm, x):
+    '''
+    Standard deviation of the per-step noise increment that MFM.advance adds
+    to each population's potential, evaluated at the state x.
+
+    Returns
+    -------
+    b : numpy.array (P,)
+        In the population order of kernel.POPULATIONS
+    '''
+    kernel = Kernel(mfm)
+    s = sigmoid(x[kernel.col],1,kernel.theta)
+    return kernel.noiseAmp*np.sqrt(kernel.dt)*kernel.Q*(1-s)*s
+
+def linear_psd(mfm=None, population='p2', f=None, x=None, scheme='euler', check=True, **kwargs):
+    '''
+    Power spectral density of a population predicted by linearizing the
+    unstimulated model about its fixed point and driving it with the noise
+    terms of MFM.advance.
+
+    The axonal delays enter the transfer function as phase factors
+    exp(-i 2 pi f d dt). The prediction is only meaningful when the fixed point
+    is stable under the chosen scheme (see stability()), which is checked
+    unless check=False; close to instability the peak is sharp and its height
+    is sensitive to the growth rate of the dominant root. Under the Euler
+    scheme the beta oscillation of the default model grows slowly both with
+    and without DD, so the reference spectra of fig_3 come with a warning.
+
+    Parameters
+    ----------
+    mfm : MFM, optional
+        Model to analyse. If None, one is built from kwargs.
+    population : str
+        Key of MFM.struct (e.g. 'p2', 'STN'), or 'phie'
+    f : array_like (Hz), optional
+        Frequency grid. Defaults to 0.25 Hz spacing up to 100 Hz.
+    x : array_like (20,), optional
+        Linearization point. Defaults to fixed_point(mfm).
+    scheme : str
+        'euler' evaluates the transfer function of the discrete scheme
+        integrated by MFM.advance; 'continuous' that of the delay-differential
+        equation.
+    check : bool
+        Warn (RuntimeWarning) if the fixed point is unstable under the
+        scheme, where the simulated model does not settle to the linear
+        response
+
+    Returns
+    -------
+    f : numpy.array (Hz)
+        Frequencies
+    Pxx : numpy.array
+        One-sided PSD (units^2/Hz), comparable to scipy.signal.welch(x, fs)
+    '''
+    if scheme not in ('euler','continuous'):
+        raise ValueError("scheme must be 'euler' or 'continuous'")
+
+    mfm = _model(mfm, kwargs)
+    kernel = Kernel(mfm)
+    if x is None:
+        x = fixed_point(mfm)
+    if f is None:
+        f = np.arange(0.25, 100.25, 0.25)
+    f = np.asarray(f, dtype=np.float64)
+
+    col = mfm.phie if population == 'phie' else mfm.struct[population]
+    if check:
+        root = characteristic_roots(mfm, x, n=1, scheme=scheme)[0]
+        if root.real >= 0:
+            warnings.warn('the fixed point is unstable under the {} scheme (growth {:.3g} 1/s at {:.1f} Hz); '
+                          'the linear PSD does not describe the simulated model'.format(
+                              scheme, root.real, root.imag/(2*np.pi)), RuntimeWarning)
+    A = kernel.jacobian(x)
+    dt = kernel.dt
+    n = kernel.nstate
+
+    # Noise enters each population's potential directly
+    B = np.zeros((n,len(kernel.col)))
+    B[kernel.col,np.arange(len(kernel.col))] = noise_gain(mfm, x)
+
+    s = 2j*np.pi*f
+    if scheme == 'euler':
+        z = np.exp(s*dt)
+        M = (z-1)[:,None,None]*np.eye(n)
+        for d,Ad in A.items():
+            M = M - dt*Ad*(z**-d)[:,None,None]
+    else:
+        # dt*Delta(s): the per-step noise increment is a forcing of 1/dt
+        M = dt*s[:,None,None]*np.eye(n)
+        for d,Ad in A.items():
+            M = M - dt*Ad*np.exp(-s*d*dt)[:,None,None]
+
+    H = np.linalg.solve(M, np.broadcast_to(B, (len(f),n,B.shape[1])))
+    Pxx = 2*dt*np.sum(np.abs(H[:,col,:])**2, axis=-1)
+    return f, Pxx
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+    from mfm import parse_kwargs
+
+    args = docopt(__doc__)
+    mfm = _model(None, parse_kwargs(args['<key>=<value>']))
+    result = stability(mfm, n=int(args['--roots']),
+                       scheme='continuous' if args['--continuous'] else 'euler')
+
+    print('Fixed point\n-----------')
+    print(tabulate([(name, result['fixed_point'][col]) for name,col in sorted(mfm.struct.items(), key=lambda kv: kv[1])],
+                   headers=['Population', 'V (mV)']))
+    print('\nCharacteristic roots\n--------------------')
+    print(tabulate([(s.real, s.imag/(2*np.pi)) for s in result['roots']],
+                   headers=['Re (1/s)', 'f (Hz)'], floatfmt='.3f'))
+    print('\nstable    : {}'.format(result['stable']))
+    print('frequency : {:0.2f} Hz'.format(result['frequency']))
+
+if __name__ == '__main__':
+    main()
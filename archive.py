@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+'''
+Consolidate MFM runs into a single columnar archive.
+
+The archive is a zip (.npz) file holding a params table, the offset of each
+run, the channel names, and one contiguous array per channel with all runs
+concatenated: the state channels of the runs' model in the column order of
+MFM.S (phie, phie_dot, e, e_dot, ..., r, r_dot for the default model), then
+amp, phase and stim. Loading one channel of many runs is a single sequential
+read; uncompressed channels are memory-mapped.
+
+Usage:
+  archive pack [options] <archive> <run>...
+  archive unpack <archive> [<outdir>]
+  archive list <archive>
+
+Runs are given as RunIDs (data/<RunID>.mfm) or paths of saved runs.
+
+Options:
+  -z --compress    Compress channel arrays
+  -h --help        Show this screen
+'''
+
+import os
+import json
+import shutil
+import struct
+import tempfile
+import zipfile
+
+import numpy as np
+
+from mfm import MFM
+from model_spec import BGTCS
+
+MEMORY_CHANNELS = ['amp', 'phase', 'stim']
+
+def state_channels(spec=BGTCS):
+    '''
+    State channels of a model, in the column order of MFM.S.
+    '''
+    return ['phie', 'phie_dot'] + [name + suffix for name in spec.names for suffix in ('', '_dot')]
+
+# Channels of the default model, and of archives packed before the channel
+# names were stored
+STATE_CHANNELS = state_channels()
+CHANNELS = STATE_CHANNELS + MEMORY_CHANNELS
+
+def _fname(run):
+    '''
+    Path of a run given as a RunID or a path.
+    '''
+    try:
+        return 'data/{0:03d}.mfm'.format(int(run))
+    except (TypeError, ValueError):
+        return run
+
+def _jsonable(params):
+    out = {}
+    for key,value in params.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        out[key] = value
+    return out
+
+def pack(archive, runs, compress=False):
+    '''
+    Pack saved runs into one archive.
+
+    Each run is unpickled once and its channels appended to per-channel
+    scratch files, which are then copied into the archive, so memory use does
+    not grow with the number of runs.
+
+    Parameters
+    ----------
+    archive : str
+        Output path (.npz)
+    runs : list of int, str or MFM
+        RunIDs, paths of saved runs, or MFM objects
+    compress : bool
+        Deflate the channel arrays
+
+    Returns
+    -------
+    n : int
+        Number of runs packed
+    '''
+    scratch = tempfile.mkdtemp()
+    try:
+        files, channels = {}, None
+        table, lengths, dtype = [], [], None
+        for run in runs:
+            if isinstance(run, MFM):
+                mfm, source = run, None
+            else:
+                source = _fname(run)
+                mfm = MFM(verbose=False); mfm.load(source)
+
+            if dtype is None:
+                dtype = mfm.S.dtype
+            elif mfm.S.dtype != dtype:
+                raise ValueError('all runs in an archive must use the same precision')
+
+            state = state_channels(getattr(mfm, 'spec', BGTCS))
+            if channels is None:
+                channels = state + MEMORY_CHANNELS
+                files = {key: open(os.path.join(scratch, key), 'wb') for key in channels}
+            elif state + MEMORY_CHANNELS != channels:
+                raise ValueError('all runs in an archive must have the same state variables')
+
+            N = mfm.params['N']
+            for col,key in enumerate(state):
+                files[key].write(np.ascontiguousarray(mfm.S[:N,col]).tobytes())
+            for key in MEMORY_CHANNELS:
+                files[key].write(np.asarray(mfm.memory[key][:N], dtype=dtype).tobytes())
+
+            entry = {'params': _jsonable(mfm.params), 'source': source}
+            if hasattr(mfm, 'stop'):
+                entry['stop'] = _jsonable(mfm.stop)
+            table.append(entry)
+            lengths.append(N)
+        for f in files.values():
+            f.close()
+        if channels is None:
+            channels = CHANNELS
+            for key in channels:
+                open(os.path.join(scratch, key), 'wb').close()
+
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        mode = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(archive, 'w', mode, allowZip64=True) as zf:
+            with zf.open('params.npy', 'w') as f:
+                np.lib.format.write_array(f, np.array(json.dumps(table)))
+            with zf.open('offsets.npy', 'w') as f:
+                np.lib.format.write_array(f, offsets)
+            with zf.open('channels.npy', 'w') as f:
+                np.lib.format.write_array(f, np.array(json.dumps(channels)))
+            for key in channels:
+                with zf.open(key + '.npy', 'w', force_zip64=True) as f:
+                    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype or np.float64)),
+                              'fortran_order': False,
+                              'shape': (int(offsets[-1]),)}
+                    np.lib.format.write_array_header_2_0(f, header)
+                    with open(os.path.join(scratch, key), 'rb') as src:
+                        shutil.copyfileobj(src, f, 1 << 24)
+    finally:
+        shutil.rmtree(scratch)
+    return len(table)
+
+class Archive(object):
+    '''
+    Read access to a packed archive.
+
+    Parameters
+    ----------
+    path : str
+        Archive path
+
+    Attributes
+    ----------
+    table : list of dict
+        Params (and stop info) of each run, with the path it was packed from
+    offsets : numpy.array (R+1,)
+        Run k occupies samples offsets[k]:offsets[k+1] of every channel
+    channels : list of str
+        State channels, in the column order of MFM.S, then MEMORY_CHANNELS
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self._cache = {}
+        self.table = json.loads(str(self._member('params')))
+        self.offsets = np.array(self._member('offsets'))
+        if 'channels.npy' in self._zip.namelist():
+            self.channels = json.loads(str(self._member('channels')))
+        else:
+            self.channels = CHANNELS
+
+    def _member(self, name):
+        '''
+        Array stored in the archive. Uncompressed members are memory-mapped in
+        place, so slicing one run reads only that run; compressed members are
+        inflated once and cached.
+        '''
+        if name in self._cache:
+            return self._cache[name]
+
+        info = self._zip.getinfo(name + '.npy')
+        if info.compress_type == zipfile.ZIP_STORED:
+            with open(self.path, 'rb') as f:
+                # Member data follows the 30 byte local header, file name and extra field
+                f.seek(info.header_offset + 26)
+                n, m = struct.unpack('<HH', f.read(4))
+                f.seek(info.header_offset + 30 + n + m)
+                version = np.lib.format.read_magic(f)
+                if version == (1,0):
+                    shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+                if dtype.hasobject or not shape:
+                    f.seek(info.header_offset + 30 + n + m)
+                    array = np.lib.format.read_array(f)
+                else:
+                    array = np.memmap(self.path, dtype=dtype, mode='r', offset=f.tell(), shape=shape)
+        else:
+            with self._zip.open(info) as f:
+                array = np.lib.format.read_array(f)
+            # Runs hand out views of the cached array
+            array.flags.writeable = False
+        self._cache[name] = array
+        return array
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def params(self):
+        return [entry['params'] for entry in self.table]
+
+    def channel(self, name, runs=None):
+        '''
+        Load one channel.
+
+        Parameters
+        ----------
+        name : str
+            One of channels, e.g. 'p2' or 'amp'
+        runs : iterable of int, optional
+            Runs to return (default: all)
+
+        Returns
+        -------
+        data : list of numpy.array
+            Views of the channel for each run
+        '''
+        if name not in self.channels:
+            raise KeyError('unknown channel {!r}'.format(name))
+        data = self._member(name)
+        if runs is None:
+            runs = range(len(self))
+        return [data[self.offsets[k]:self.offsets[k+1]] for k in runs]
+
+    def run(self, k):
+        '''
+        Rebuild run k as an MFM object. Parameters and recordings are restored;
+        controller state is re-created from the parameters. The memory
+        arrays are read-only views of the archive.
+        '''
+        params = self.table[k]['params']
+        options = {key: params[key] for key in MFM(tstop=1e-3, verbose=False).options if key in params}
+        # A one-step shell, so no full-length arrays are allocated
+        mfm = MFM(**dict(options, tstop=options.get('dt', 1e-3)))
+        mfm.params.update(params)
+
+        run = slice(self.offsets[k], self.offsets[k+1])
+        state = self.channels[:-len(MEMORY_CHANNELS)]
+        mfm.S = np.stack([self._member(key)[run] for key in state], axis=1)
+        mfm.memory = {key: self._member(key)[run] for key in MEMORY_CHANNELS}
+        mfm.i = len(mfm.S) - 1
+        if 'stop' in self.table[k]:
+            mfm.stop = self.table[k]['stop']
+        return mfm
+
+    def close(self):
+        self._cache = {}
+        self._zip.close()
+
+def unpack(archive, outdir='data'):
+    '''
+    Write every run of an archive back to <outdir>/<RunID>.mfm.
+
+    Runs without a RunID are numbered in archive order.
+    '''
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    data = Archive(archive)
+    fnames = []
+    for k in range(len(data)):
+        mfm = data.run(k)
+        runID = mfm.params['RunID'] if mfm.params['RunID'] != -1 else k
+        fnames.append(os.path.join(outdir, '{0:03d}.mfm'.format(runID)))
+        mfm.save(fnames[-1])
+    data.close()
+    return fnames
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+
+    args = docopt(__doc__)
+    if args['pack']:
+        n = pack(args['<archive>'], args['<run>'], compress=args['--compress'])
+        print('Packed {} runs into {}'.format(n, args['<archive>']))
+    elif args['unpack']:
+        fnames = unpack(args['<archive>'], args['<outdir>'] or 'data')
+        print('Unpacked {} runs'.format(len(fnames)))
+    else:
+        data = Archive(args['<archive>'])
+        rows = [(k, entry['source'], entry['params']['tstop'], entry['params']['DD'],
+                 entry['params']['cDBS'], entry['params']['pDBS'], data.offsets[k+1]-data.offsets[k])
+                for k,entry in enumerate(data.table)]
+        print(tabulate(rows, headers=['Run', 'Source', 'tstop', 'DD', 'cDBS', 'pDBS', 'Samples']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+'''
+MFM benchmarks.
+
+Usage:
+  bench [options]
+
+Options:
+  -r --repeat N    Number of repetitions per measurement [default: 5]
+  -h --help        Show this screen
+'''
+
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Per-sample latency budget of a controller step (s)
+STEP_BUDGET = 10e-6
+
+# Simulation core modules, which must stay importable without CLI, tabulation
+# or plotting dependencies
+CORE = ['mfm', 'dbs', 'swift', 'metrics']
+HEAVY = ['docopt', 'tabulate', 'matplotlib', 'scipy', 'sklearn']
+
+_IMPORT_SCRIPT = '''
+import sys, time
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+print(t)
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+def bench_import(module, repeat=5):
+    '''
+    Time the import of a module in fresh interpreters.
+
+    Returns
+    -------
+    t : float (s)
+        Median import time
+    heavy : list of str
+        Heavy dependencies pulled in by the import
+    '''
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', _IMPORT_SCRIPT.format(module=module, heavy=HEAVY)],
+                                      universal_newlines=True).split('\n')
+        times.append(float(out[0]))
+        heavy = [m for m in out[1].split(',') if m]
+    return np.median(times), heavy
+
+def bench_step(repeat=5, tstop=1.0, **kwargs):
+    '''
+    Time MFM.advance.
+
+    Returns
+    -------
+    t : float (s)
+        Median time per step
+    '''
+    from mfm import MFM
+
+    times = []
+    for _ in range(repeat):
+        mfm = MFM(tstop=tstop, verbose=False, **kwargs)
+        t = time.perf_counter()
+        mfm.run()
+        times.append((time.perf_counter() - t) / (mfm.params['N'] - 1))
+    return np.median(times)
+
+def bench_controller(controller, n=20000, method='step'):
+    '''
+    Per-sample latency of a controller, streamed a noisy 29 Hz oscillation.
+
+    Returns
+    -------
+    t : numpy.array (s)
+        Median and 99th percentile time of one call
+    '''
+    x = [float(v) for v in 10*np.sin(2*np.pi*29*np.arange(n)*1e-3) + np.random.RandomState(0).randn(n)]
+    update = getattr(controller, method)
+    clock = time.perf_counter
+    times = np.empty(n)
+    for k in range(n):
+        t = clock()
+        update(x[k])
+        times[k] = clock() - t
+    return np.percentile(times, [50, 99])
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+
+    args = docopt(__doc__)
+    repeat = int(args['--repeat'])
+
+    print('Import time\n-----------')
+    data = []
+    for module in CORE:
+        t, heavy = bench_import(module, repeat)
+        data.append((module, t*1e3, ', '.join(heavy) or '-'))
+    print(tabulate(data, headers=['Module', 'Time (ms)', 'Heavy imports'], floatfmt='.1f'))
+
+    print('\nStep time\n---------')
+    data = []
+    for label, kwargs in [('DD', {}), ('cDBS', {'cDBS': True}), ('pDBS', {'pDBS': True})]:
+        data.append((label, bench_step(repeat, **kwargs)*1e6))
+    print(tabulate(data, headers=['Run', 'Time (us/step)'], floatfmt='.1f'))
+
+    from dbs import cDBS, pDBS
+    from mfm import MFM
+
+    print('\nController latency\n------------------')
+    p = MFM(tstop=1e-3, verbose=False).params
+    new_pDBS = lambda: pDBS(dt=p['dt'], f=p['swift_f'], tau_s=p['swift_tau_s'], tau_f=p['swift_tau_f'],
+                            phase_thr=p['pDBS_phase'], power_thr=p['pDBS_power_thr'])
+    data = []
+    for label, controller, method in [('pDBS.step', new_pDBS(), 'step'),
+                                      ('pDBS.advance', new_pDBS(), 'advance'),
+                                      ('cDBS.step', cDBS(dt=p['dt'], f=p['cDBS_f']), 'step')]:
+        median, p99 = bench_controller(controller, method=method)
+        data.append((label, median*1e6, p99*1e6, 'yes' if p99 <= STEP_BUDGET else 'no'))
+    print(tabulate(data, headers=['Update', 'Median (us)', '99% (us)', 'Within {:.0f} us'.format(STEP_BUDGET*1e6)],
+                   floatfmt='.2f'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+'''
+Catalog of MFM run summaries.
+
+A SQLite file holding the options and summary metrics (metrics.summarize) of
+every catalogued run. Runs are keyed by the options that differ from the MFM
+defaults, so a run that was already simulated can be found instead of being
+simulated again.
+
+Usage:
+  catalog add [options] <run>...
+  catalog list [options]
+
+<run> is a RunID, the path of a saved run, or an archive (.npz).
+
+Options:
+  -c --catalog PATH   Catalog file [default: data/catalog.db]
+  -h --help           Show this screen
+'''
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from mfm import MFM
+
+DEFAULT_PATH = 'data/catalog.db'
+
+# Options that do not change the outcome of a run (seed is stored separately)
+IGNORE = ['verbose', 'RunID', 'seed']
+
+_defaults = None
+
+def defaults():
+    '''Default MFM options'''
+    global _defaults
+    if _defaults is None:
+        _defaults = MFM(tstop=1e-3, verbose=False).options
+    return dict(_defaults)
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+def normalize(options):
+    '''
+    Full options of a run: defaults updated with options, cast like MFM casts
+    its keyword arguments. A schedule (see MFM.schedule) and an initial
+    state x0 are kept as given.
+    Unknown keys raise KeyError.
+    '''
+    full = defaults()
+    for key,value in options.items():
+        if key == 'schedule':
+            if value:
+                full[key] = [[float(t), {k: _plain(v) for k,v in changes.items()}] for t,changes in value]
+            continue
+        if key == 'x0':
+            if value is not None:
+                full[key] = [float(v) for v in value]
+            continue
+        if key not in full:
+            raise KeyError('unknown option {!r}'.format(key))
+        value = _plain(value)
+        if full[key] is not None and value is not None:
+            value = type(full[key])(value)
+        full[key] = value
+    return full
+
+def key(options):
+    '''
+    Catalog key of a set of options: a hash of the options that differ from
+    the defaults (ignoring IGNORE).
+    '''
+    full, base = normalize(options), defaults()
+    diff = {k: v for k,v in full.items() if k not in IGNORE and v != base.get(k)}
+    return hashlib.sha1(json.dumps(diff, sort_keys=True).encode()).hexdigest()
+
+def run_options(mfm):
+    '''Options an MFM object was run with, including its schedule'''
+    options = {k: _plain(mfm.params[k]) for k in defaults() if k in mfm.params}
+    options.update(mfm.params.get('initial', {}))
+    if mfm.params.get('schedule'):
+        options['schedule'] = mfm.params['schedule']
+    if 'x0' in mfm.params:
+        options['x0'] = mfm.params['x0']
+    return options
+
+class Catalog(object):
+    '''
+    Run summary catalog.
+
+    Several runs may share a key (replicates with different seeds); all of
+    them are kept.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file, created if missing
+    '''
+    def __init__(self, path=DEFAULT_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.execute('CREATE TABLE IF NOT EXISTS runs ('
+                         'id INTEGER PRIMARY KEY, key TEXT, seed INTEGER, options TEXT, summary TEXT, '
+                         'source TEXT, created REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS runs_key ON runs (key)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS spectra ('
+                         'id INTEGER PRIMARY KEY, key TEXT, seed INTEGER, burn REAL, nperseg INTEGER, '
+                         'f TEXT, Pxx TEXT, created REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS spectra_key ON spectra (key)')
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def __contains__(self, options):
+        return len(self.get(options, limit=1)) > 0
+
+    def add(self, options, summary, source=None):
+        '''
+        Add the summary of one run.
+
+        Parameters
+        ----------
+        options : dict
+            Options of the run (missing keys take the defaults)
+        summary : dict
+            Summary metrics, as returned by metrics.summarize
+        source : str, optional
+            Where the run is stored, if anywhere
+
+        Returns
+        -------
+        id : int
+            Row id of the entry
+        '''
+        full = normalize(options)
+        summary = {k: _plain(v) for k,v in summary.items()}
+        with self._db:
+            cursor = self._db.execute('INSERT INTO runs (key, seed, options, summary, source, created) VALUES (?,?,?,?,?,?)',
+                                      (key(full), full['seed'], json.dumps(full), json.dumps(summary), source, time.time()))
+        return cursor.lastrowid
+
+    def add_run(self, mfm, source=None, burn=1.0):
+        '''
+        Summarize a finished MFM and add it.
+        '''
+        from metrics import summarize
+        return self.add(run_options(mfm), summarize(mfm, burn), source)
+
+    def get(self, options, limit=-1):
+        '''
+        Summaries of the catalogued runs with these options (oldest first).
+        Without a seed (or with seed=-1) runs with any seed match.
+        '''
+        seed = normalize(options)['seed']
+        if seed == -1:
+            rows = self._db.execute('SELECT summary FROM runs WHERE key=? ORDER BY id LIMIT ?', (key(options), limit))
+        else:
+            rows = self._db.execute('SELECT summary FROM runs WHERE key=? AND seed=? ORDER BY id LIMIT ?',
+                                    (key(options), seed, limit))
+        return [json.loads(row[0]) for row in rows]
+
+    def add_spectrum(self, options, f, Pxx, burn=1.0, nperseg=2048):
+        '''
+        Add the state_target PSD (metrics.psd) of one run.
+
+        Parameters
+        ----------
+        options : dict
+            Options of the run, with its seed
+        f, Pxx : array_like
+            Frequencies and power spectral density
+        burn : float (s)
+            Initial transient excluded from the PSD
+        nperseg : int
+            Welch segment length of the PSD
+        '''
+        full = normalize(options)
+        with self._db:
+            self._db.execute('INSERT INTO spectra (key, seed, burn, nperseg, f, Pxx, created) VALUES (?,?,?,?,?,?,?)',
+                             (key(full), full['seed'], float(burn), int(nperseg),
+                              json.dumps([float(v) for v in f]), json.dumps([float(v) for v in Pxx]), time.time()))
+
+    def get_spectrum(self, options, burn=1.0, nperseg=2048):
+        '''
+        PSD of a catalogued run with these options and seed, or None.
+
+        Returns
+        -------
+        f, Pxx : numpy.array
+        '''
+        full = normalize(options)
+        row = self._db.execute('SELECT f, Pxx FROM spectra WHERE key=? AND seed=? AND burn=? AND nperseg=? '
+                               'ORDER BY id LIMIT 1',
+                               (key(full), full['seed'], float(burn), int(nperseg))).fetchone()
+        if row is None:
+            return None
+        return np.array(json.loads(row[0])), np.array(json.loads(row[1]))
+
+    def entries(self):
+        '''
+        Every catalogued run.
+
+        Returns
+        -------
+        options : list of dict
+            Full options of each run
+        summaries : list of dict
+        '''
+        rows = self._db.execute('SELECT options, summary FROM runs ORDER BY id').fetchall()
+        return [json.loads(row[0]) for row in rows], [json.loads(row[1]) for row in rows]
+
+    def sources(self):
+        '''Sources of the catalogued runs'''
+        return set(row[0] for row in self._db.execute('SELECT source FROM runs WHERE source IS NOT NULL'))
+
+    def index(self, runs):
+        '''
+        Add saved runs (RunIDs or paths of .mfm files) and archives (.npz).
+        Runs whose source is already catalogued are skipped.
+
+        Returns
+        -------
+        n : int
+            Number of runs added
+        '''
+        known = self.sources()
+        n = 0
+        for run in runs:
+            run = str(run)
+            if run.endswith('.npz'):
+                from archive import Archive
+                data = Archive(run)
+                for k in range(len(data)):
+                    source = '{}:{}'.format(run, k)
+                    if source not in known:
+                        self.add_run(data.run(k), source); n += 1
+                data.close()
+            else:
+                try: source = 'data/{0:03d}.mfm'.format(int(run))
+                except ValueError: source = run
+                if source not in known:
+                    mfm = MFM(verbose=False); mfm.load(source)
+                    self.add_run(mfm, source); n += 1
+        return n
+
+    def close(self):
+        self._db.close()
+
+def evaluate(runs, catalog=None, processes=None, chunk=64):
+    '''
+    Summaries of a list of runs, simulating only those not in the catalog.
+
+    Missing runs are simulated in parallel batches (parallel.run_batch) and
+    added to the catalog. Runs without a seed are always simulated.
+
+    Parameters
+    ----------
+    runs : list of dict
+        MFM options of each run
+    catalog : Catalog, optional
+        Cache of summaries (none if not given)
+    processes : int, optional
+        Worker processes of each batch
+    chunk : int
+        Runs per batch (bounds the memory of the batch buffers)
+
+    Returns
+    -------
+    summaries : list of dict
+        Summary of each run (metrics.summarize), in order
+    '''
+    from parallel import run_batch
+    from metrics import summarize
+
+    summaries = [None]*len(runs)
+    missing = []
+    for k,options in enumerate(runs):
+        cached = catalog.get(options, limit=1) if catalog is not None and options.get('seed', -1) != -1 else []
+        if cached:
+            summaries[k] = cached[0]
+        else:
+            missing.append(k)
+
+    for start in range(0, len(missing), chunk):
+        part = missing[start:start+chunk]
+        batch = run_batch([runs[k] for k in part], processes)
+        for k,mfm in zip(part, batch):
+            summaries[k] = summarize(mfm)
+            if catalog is not None:
+                catalog.add(run_options(mfm), summaries[k])
+        del batch
+    return summaries
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+
+    args = docopt(__doc__)
+    catalog = Catalog(args['--catalog'])
+    if args['add']:
+        n = catalog.index(args['<run>'])
+        print('Added {} runs to {} ({} total)'.format(n, catalog.path, len(catalog)))
+    else:
+        keys = ['DD', 'cDBS', 'pDBS', 'tstop', 'seed']
+        metrics = ['beta_freq', 'beta_power', 'stim_rate']
+        rows = [[o[k] for k in keys] + [s[k] for k in metrics] for o,s in zip(*catalog.entries())]
+        print(tabulate(rows, headers=keys+metrics))
+    catalog.close()
+
+if __name__ == '__main__':
+    main()
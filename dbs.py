@@ -1,8 +1,41 @@
+import abc
+import math
+
 import numpy as np
 
 from swift import aswift
 
-class DBS(object):
+class Controller(abc.ABC):
+    '''
+    Base class of stimulation controllers.
+
+    A controller is streamed one sample at a time: step(x) takes the latest
+    sample of the tracked signal and returns the charge (mC) to deliver at
+    this step. step takes a plain float and keeps its state in scalars or
+    preallocated buffers, so it can be called every sample of a simulation
+    or a real-time loop without allocating.
+    process(x) runs it over a whole recording.
+    '''
+    @abc.abstractmethod
+    def step(self, x):
+        '''Advance one sample and return the stimulus charge (mC)'''
+
+    def process(self, x):
+        '''
+        Stream an array of samples through the controller.
+
+        Returns
+        -------
+        stim : numpy.array
+            Charge delivered at each sample (mC)
+        '''
+        x = np.asarray(x, dtype=float).reshape(-1)
+        stim = np.zeros(len(x))
+        for k in range(len(x)):
+            stim[k] = self.step(float(x[k]))
+        return stim
+
+class DBS(Controller):
     def __init__(self, dt=1e-3, stim_amp=1, width=60, tstart=0):
         '''
         Initialize a DBS object
@@ -95,13 +128,21 @@ class cDBS(DBS):
             self._pulse_counter += 1
         return stim * self.charge
 
+    def step(self, x=None):
+        '''Open loop: the sample is ignored'''
+        return self.advance()
+
     @property
     def f(self):
         return self._f
+    @f.setter
+    def f(self,x):
+        self._f = x
+        self._steps_per_pulse = int(round(1./self._f/self._dt))
 
 
 class pDBS(DBS):
-    def __init__(self, f, tau_s, tau_f, phase_thr=0, power_thr=-np.inf, ref_period=0.3, dt=1e-3, stim_amp=1, width=60, tstart=0):
+    def __init__(self, f, tau_s, tau_f, phase_thr=0, power_thr=-np.inf, ref_period=0.3, dt=1e-3, stim_amp=1, width=60, tstart=0, dtype=complex):
         super(pDBS,self).__init__(dt,stim_amp,width,tstart)
 
         self._f          = f
@@ -114,7 +155,8 @@ class pDBS(DBS):
         self._aswift = aswift(tau_s = self.tau_s,
                               tau_f = self.tau_f,
                               f     = self.f,
-                              fs    = 1./self.dt)
+                              fs    = 1./self.dt,
+                              dtype = dtype)
 
         self._X          = 0
         self._amp        = 0
@@ -122,6 +164,15 @@ class pDBS(DBS):
 
         self._shift_phase = 0
         self._last_shift_phase = np.inf
+
+        # The transform is kept in scalars with the coefficients of aswift
+        # (whose state is synced when read, see the aswift property):
+        # Python complex in double precision, numpy scalars of dtype otherwise
+        # (a Python float sample does not promote them)
+        cast = complex if np.dtype(dtype) == np.complex128 else np.dtype(dtype).type
+        self._e_slow, self._e_fast = cast(self._aswift.slow.e[0]), cast(self._aswift.fast.e[0])
+        self._slow = self._fast = cast(0)
+        self._scale = (self.tau_s - self.tau_f) / self.dt
         
         self._update()
 
@@ -129,27 +180,44 @@ class pDBS(DBS):
         self._n_ref = 1/(self.f*self.dt) * self.ref_period
         self._i_ref = self._n_ref
 
-    def advance(self,x):
-        self._X = self.aswift.slide(x)
-        self._amp,self._phase = np.abs(self._X), np.angle(self._X)
-        self._amp /= (self.tau_s - self.tau_f) / self.dt
-        with np.errstate(divide='ignore'):
-            self._amp = 10*np.log10(self._amp**2)
-
-        self._last_shift_phase = self._shift_phase
-        self._shift_phase = (self._phase - self._phase_thr + np.pi) % (2*np.pi) - np.pi
-        
-        stim=False
-        if self._last_shift_phase < 0 <= self._shift_phase:
-        #if self._last_phase - self.phase_thr < 0 <= self._phase - self.phase_thr:
-            if self._i_ref >= self._n_ref:
-                if self._amp >= self._power_thr:
-                    stim=True
-                    self._i_ref = 0
+    def step(self, x):
+        '''
+        Advance one sample and return the stimulus charge (mC).
+
+        The transform and thresholds are computed on Python floats and
+        complex scalars, so a double precision step makes no numpy calls; a
+        complex64 transform only rounds its two recursions. amp and phase are
+        plain floats.
+        '''
+        self._slow = self._e_slow*self._slow + x
+        self._fast = self._e_fast*self._fast + x
+        X = self._slow - self._fast
+        amp = abs(X) / self._scale
+        amp = 10*math.log10(amp*amp) if amp else -math.inf
+        phase = math.atan2(X.imag, X.real)
+        self._X, self._amp, self._phase = X, amp, phase
+
+        last = self._shift_phase
+        shift = (phase - self._phase_thr + math.pi) % (2*math.pi) - math.pi
+        self._last_shift_phase, self._shift_phase = last, shift
 
+        if last < 0 <= shift and self._i_ref >= self._n_ref and amp >= self._power_thr:
+            self._i_ref = 1
+            return self._charge
         self._i_ref += 1
-        
-        return self.charge * stim
+        return 0.
+
+    def advance(self,x):
+        '''
+        Slide the transform over the sample(s) x, then apply the thresholds
+        once and return the stimulus charge (mC). For a single sample this is
+        step.
+        '''
+        x = [float(v) for v in np.asarray(x).reshape(-1)]
+        for v in x[:-1]:
+            self._slow = self._e_slow*self._slow + v
+            self._fast = self._e_fast*self._fast + v
+        return self.step(x[-1])
 
     # Mutable Properties
     #-------------------
@@ -166,6 +234,14 @@ class pDBS(DBS):
     @power_thr.setter
     def power_thr(self,x):
         self._power_thr = x
+
+    @property
+    def ref_period(self):
+        return self._ref_period
+    @ref_period.setter
+    def ref_period(self,x):
+        self._ref_period = x
+        self._n_ref = 1/(self.f*self.dt) * self.ref_period
         
     # Immutable Properties
     #---------------------
@@ -180,14 +256,17 @@ class pDBS(DBS):
         return self._tau_f
     @property
     def aswift(self):
+        '''
+        swift.aswift holding the transform of the samples stepped so far. Its
+        state is copied from pDBS on access; sliding it does not step pDBS.
+        '''
+        self._aswift.slow.Xf[0] = self._slow
+        self._aswift.fast.Xf[0] = self._fast
         return self._aswift
     @property
     def amp(self):
         return self._amp
     @property
-    def ref_period(self):
-        return self._ref_period
-    @property
     def phase(self):
         return self._phase
 
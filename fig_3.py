@@ -1,8 +1,4 @@
 import numpy as np
-import matplotlib as mpl
-import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
-from scipy import signal
 import random
 
 import pickle
@@ -63,6 +59,10 @@ def fig_3():
         return data_dict, data, t, dt
 
     def plot(data, t, dt):
+        import matplotlib.gridspec as gridspec
+        import matplotlib.pyplot as plt
+        from scipy import signal
+
         # Figures
         # Timeseries Figure
         #-----------------------------------------------------------------------
@@ -143,6 +143,8 @@ def fig_3():
     plot(data, t, dt)
 
 def main():
+    import matplotlib.pyplot as plt
+
     random.seed(0)
     fig_3()
     plt.show()
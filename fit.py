@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+'''
+Fit model parameters to a target power spectrum.
+
+The free parameters (connection strengths, thresholds and other attributes
+of MFM._set_MFM_params) are searched within their bounds by the
+cross-entropy method: each generation draws a population of candidates,
+runs them in a parallel batch and refits the sampling distribution to the
+best of them. Candidates are short runs started at their own fixed point
+(analysis.fixed_point), so little of each run is lost to the transient, and
+they all share one noise seed. The state_target PSD of every run is kept in
+the run catalog, so repeated candidates and restarted fits are not run again.
+
+The objective is the mean squared difference of the log PSDs (dB^2) over the
+fitted band. By default only the shape of the spectrum is fitted (both log
+PSDs are centred over the band), as the units of a recording and of the model
+differ; --absolute fits the power as well.
+
+Usage:
+  fit [options] <target> [<key>=<value>]...
+
+<target> is a .npz file with arrays f and Pxx, or a text file (.csv, .txt)
+with columns f and Pxx. <key>=<value> are MFM options of every run, e.g.
+DD=True state_target=p2.
+
+Options:
+  -p --params LIST        Comma separated free parameters, each <name> or
+                          <name>:<low>:<high> (default: all nonzero connection
+                          strengths and firing thresholds)
+  -s --spread S           Relative half-width of the bounds of parameters
+                          given without bounds [default: 0.2]
+  --band LOW,HIGH         Fitted frequency band (Hz) [default: 4,48]
+  --absolute              Fit the absolute power, not only the shape
+  -n --population N       Candidates per generation [default: 32]
+  -g --generations G      Maximum number of generations [default: 20]
+  --elite F               Fraction of each generation that is refitted [default: 0.2]
+  -t --tstop T            Length of each run (s) [default: 5]
+  --burn T                Initial transient excluded from the PSD (s) [default: 0.5]
+  --nperseg N             Welch segment length of the PSDs [default: 512]
+  --cold                  Start every run from the default initial state
+                          instead of its fixed point
+  --seed S                Noise seed of every run [default: 0]
+  --processes N           Worker processes of each batch
+  -o --output PATH        Save the best parameters and fit quality (JSON)
+  -c --catalog PATH       Run catalog [default: data/catalog.db]
+  --no-cache              Do not read or write the run catalog
+  -h --help               Show this screen
+'''
+
+import numpy as np
+
+from mfm import MFM
+
+def load_target(path):
+    '''
+    Target PSD from a .npz file (arrays f and Pxx) or a two column text file.
+
+    Returns
+    -------
+    f, Pxx : numpy.array
+    '''
+    if path.endswith('.npz'):
+        data = np.load(path)
+        return np.asarray(data['f'], dtype=float), np.asarray(data['Pxx'], dtype=float)
+    data = np.loadtxt(path, delimiter=',' if path.endswith('.csv') else None, ndmin=2)
+    return data[:,0], data[:,1]
+
+class SpectrumObjective(object):
+    '''
+    Distance between a model PSD and a target PSD.
+
+    Parameters
+    ----------
+    f, Pxx : array_like
+        Target frequencies (Hz) and PSD
+    band : tuple
+        (low, high) fitted band (Hz)
+    shape : bool
+        Compare the log PSDs centred over the band (spectral shape only)
+    '''
+    def __init__(self, f, Pxx, band=(4., 48.), shape=True):
+        f, Pxx = np.asarray(f, dtype=float), np.asarray(Pxx, dtype=float)
+        mask = (f >= band[0]) & (f <= band[1]) & (Pxx > 0)
+        if not mask.any():
+            raise ValueError('the target has no positive power in the band {}-{} Hz'.format(*band))
+        self.f = f[mask]
+        self.target = 10*np.log10(Pxx[mask])
+        self.band = band
+        self.shape = shape
+
+    def residual(self, f, Pxx):
+        '''Model minus target log PSD (dB) at the target frequencies'''
+        with np.errstate(divide='ignore'):
+            model = np.interp(self.f, f, 10*np.log10(Pxx))
+        r = model - self.target
+        return r - r.mean() if self.shape else r
+
+    def __call__(self, f, Pxx):
+        r = self.residual(f, Pxx)
+        return float(np.mean(r**2)) if np.all(np.isfinite(r)) else np.inf
+
+    def quality(self, f, Pxx):
+        '''
+        Fit quality of a model PSD.
+
+        Returns
+        -------
+        quality : dict
+            rms : root mean square log PSD error (dB)
+            r2  : fraction of the variance of the target log PSD (over the
+                  band) explained by the model
+        '''
+        r = self.residual(f, Pxx)
+        target = self.target - self.target.mean() if self.shape else self.target
+        ss = np.sum((target - target.mean())**2)
+        return {'rms': float(np.sqrt(np.mean(r**2))),
+                'r2' : float(1 - np.sum(r**2)/ss) if ss > 0 else np.nan}
+
+class Fit(object):
+    '''
+    Parameter space, runs and objective of a spectral fit.
+
+    Parameters
+    ----------
+    objective : SpectrumObjective
+    params : list of str, or dict
+        Free model attributes (see mfm.SCHEDULE_MODEL), or {name: (low, high)}.
+        Parameters without bounds (a list, or bounds of None) range over
+        nominal*(1-spread) .. nominal*(1+spread).
+    options : dict, optional
+        MFM options of every run (e.g. DD=True)
+    spread : float
+    tstop, burn : float (s)
+        Length of each run and initial part excluded from its PSD
+    nperseg : int
+        Welch segment length of the PSD; short segments average out more of
+        the noise of short runs
+    warm : bool
+        Start each run at the fixed point of its parameters
+    seed : int
+        Noise seed of every run
+    catalog : catalog.Catalog, optional
+        Cache of run spectra
+    '''
+    def __init__(self, objective, params, options=None, spread=0.2, tstop=5., burn=0.5, nperseg=512,
+                 warm=True, seed=0, catalog=None, processes=None):
+        from mfm import SCHEDULE_MODEL
+
+        self.objective = objective
+        self.options = dict(options or {})
+        self.options.pop('tstop', None)
+        bounds = params if isinstance(params, dict) else dict.fromkeys(params)
+        self.params = list(bounds)
+        for name in self.params:
+            if name not in SCHEDULE_MODEL or name.startswith('tau'):
+                raise ValueError('{!r} is not a continuous model parameter'.format(name))
+
+        mfm = MFM(**dict(self.options, tstop=1e-3, verbose=False))
+        self.nominal = np.array([float(getattr(mfm, name)) for name in self.params])
+        self.lower, self.upper = np.sort([self.nominal*(1-spread), self.nominal*(1+spread)], axis=0)
+        for k,name in enumerate(self.params):
+            if bounds[name] is not None:
+                self.lower[k], self.upper[k] = bounds[name]
+        if np.any(self.upper <= self.lower):
+            raise ValueError('every parameter needs an upper bound above its lower bound')
+
+        self.tstop = tstop
+        self.burn = burn
+        self.nperseg = nperseg
+        self.warm = warm
+        self.seed = seed
+        self.catalog = catalog
+        self.processes = processes
+        self.runs_done = 0
+        self.runs_cached = 0
+
+    @property
+    def k(self):
+        return len(self.params)
+
+    def scale(self, U):
+        '''Map points of the unit hypercube to parameter values'''
+        return self.lower + np.asarray(U)*(self.upper - self.lower)
+
+    def values(self, x):
+        '''Parameter values x (k,) as a dict'''
+        return {name: float(v) for name,v in zip(self.params, x)}
+
+    def _x0(self, values):
+        from analysis import fixed_point
+
+        try:
+            x = fixed_point(**dict(self.options, schedule=[[0., values]]))
+        except (RuntimeError, np.linalg.LinAlgError):
+            return None
+        return [float(v) for v in x] if np.all(np.isfinite(x)) else None
+
+    def runs(self, X):
+        '''MFM options of the runs of parameter sets X (n,k)'''
+        runs = []
+        for x in X:
+            values = self.values(x)
+            run = dict(self.options, tstop=self.tstop, seed=self.seed, verbose=False, schedule=[[0., values]])
+            x0 = self._x0(values) if self.warm else None
+            if x0 is not None:
+                run['x0'] = x0
+            runs.append(run)
+        return runs
+
+    def spectra(self, X, chunk=64):
+        '''
+        state_target PSDs of the runs of parameter sets X (n,k), simulating
+        only those not in the catalog.
+
+        Returns
+        -------
+        spectra : list of (f, Pxx)
+        '''
+        from parallel import run_batch
+        from metrics import psd
+
+        runs = self.runs(X)
+        spectra = [None]*len(runs)
+        missing = []
+        for k,options in enumerate(runs):
+            cached = self.catalog.get_spectrum(options, self.burn, self.nperseg) if self.catalog is not None else None
+            if cached is None:
+                missing.append(k)
+            else:
+                spectra[k] = cached
+        self.runs_cached += len(runs) - len(missing)
+        self.runs_done += len(missing)
+
+        for start in range(0, len(missing), chunk):
+            part = missing[start:start+chunk]
+            batch = run_batch([runs[k] for k in part], self.processes)
+            for k,mfm in zip(part, batch):
+                dt, N = mfm.params['dt'], mfm.params['N']
+                x = mfm.S[int(round(self.burn/dt)):N,mfm.struct[mfm.params['state_target']]]
+                f, Pxx = psd(x, mfm.params['fs'], self.nperseg)
+                spectra[k] = (f, Pxx)
+                if self.catalog is not None:
+                    self.catalog.add_spectrum(runs[k], f, Pxx, self.burn, self.nperseg)
+            del batch
+        return spectra
+
+    def evaluate(self, U):
+        '''Objective at points U (n,k) of the unit hypercube'''
+        return np.array([self.objective(f, Pxx) for f,Pxx in self.spectra(self.scale(U))])
+
+def cem(fit, n=32, generations=20, elite=0.2, smoothing=0.7, tol=1e-3, rng=None, callback=None):
+    '''
+    Minimize the objective of a Fit by the cross-entropy method.
+
+    Each generation samples n points of the unit hypercube from independent
+    normal distributions (clipped to the bounds), evaluates them in one batch,
+    and moves the means and standard deviations towards those of the elite
+    fraction with the lowest objective.
+
+    Parameters
+    ----------
+    fit : Fit
+    n : int
+        Candidates per generation
+    generations : int
+        Maximum number of generations
+    elite : float
+        Fraction of candidates the distribution is refitted to
+    smoothing : float
+        Weight of the elite statistics in each update (1: no memory)
+    tol : float
+        Stop when every standard deviation is below tol (unit hypercube)
+    callback : callable, optional
+        Called as callback(generation, best_loss, sd) after each generation
+
+    Returns
+    -------
+    result : dict
+        x          : best parameter values (k,)
+        params     : best parameters as a dict
+        loss       : objective of the best parameters
+        history    : best objective after each generation
+        generations: number of generations run
+    '''
+    rng = rng or np.random.RandomState(0)
+    mean = (fit.nominal - fit.lower) / (fit.upper - fit.lower)
+    mean = np.clip(mean, 0, 1)
+    sd = np.full(fit.k, 0.25)
+    n_elite = max(2, int(round(elite*n)))
+
+    best_u, best_loss, history = mean.copy(), np.inf, []
+    for g in range(generations):
+        U = np.clip(mean + sd*rng.standard_normal((n,fit.k)), 0, 1)
+        if g == 0:
+            U[0] = mean     # the starting point is always evaluated
+        y = fit.evaluate(U)
+        order = np.argsort(y)
+        if y[order[0]] < best_loss:
+            best_u, best_loss = U[order[0]].copy(), float(y[order[0]])
+        history.append(best_loss)
+
+        top = U[order[:n_elite]]
+        mean = smoothing*top.mean(axis=0) + (1-smoothing)*mean
+        sd = smoothing*top.std(axis=0) + (1-smoothing)*sd
+        if callback is not None:
+            callback(g, best_loss, sd)
+        if np.all(sd < tol):
+            break
+
+    x = fit.scale(best_u)
+    return {'x'          : x,
+            'params'     : fit.values(x),
+            'loss'       : best_loss,
+            'history'    : history,
+            'generations': len(history)}
+
+def _parse_params(text):
+    if not text:
+        return None
+    params = {}
+    for item in text.split(','):
+        parts = item.split(':')
+        params[parts[0]] = (float(parts[1]), float(parts[2])) if len(parts) == 3 else None
+    return params
+
+def main():
+    import json
+    from docopt import docopt
+    from tabulate import tabulate
+    from mfm import parse_kwargs
+    from sensitivity import default_params
+
+    args = docopt(__doc__)
+    options = parse_kwargs(args['<key>=<value>'])
+    params = _parse_params(args['--params']) or default_params(options)
+    band = tuple(float(v) for v in args['--band'].split(','))
+    objective = SpectrumObjective(*load_target(args['<target>']), band=band, shape=not args['--absolute'])
+
+    catalog = None
+    if not args['--no-cache']:
+        from catalog import Catalog
+        catalog = Catalog(args['--catalog'])
+
+    fit = Fit(objective, params, options,
+              spread=float(args['--spread']),
+              tstop=float(args['--tstop']),
+              burn=float(args['--burn']),
+              nperseg=int(args['--nperseg']),
+              warm=not args['--cold'],
+              seed=int(args['--seed']),
+              catalog=catalog,
+              processes=int(args['--processes']) if args['--processes'] else None)
+
+    def report(g, loss, sd):
+        print('generation {:3d}: loss {:.4g} dB^2, max sd {:.3f}'.format(g, loss, sd.max()))
+
+    result = cem(fit, n=int(args['--population']), generations=int(args['--generations']),
+                 elite=float(args['--elite']), callback=report)
+    f, Pxx = fit.spectra(result['x'][None])[0]
+    quality = objective.quality(f, Pxx)
+
+    print()
+    rows = [(name, nominal, value, low, high)
+            for name,nominal,value,low,high in zip(fit.params, fit.nominal, result['x'], fit.lower, fit.upper)]
+    print(tabulate(rows, headers=['Parameter', 'Nominal', 'Best', 'Low', 'High'], floatfmt='.4g'))
+    print('\nFit over {:g}-{:g} Hz: rms error {:.2f} dB, R^2 {:.3f}'.format(band[0], band[1], quality['rms'], quality['r2']))
+    print('{} runs simulated, {} from the catalog'.format(fit.runs_done, fit.runs_cached))
+
+    if args['--output']:
+        with open(args['--output'], 'w') as out:
+            json.dump({'options': options, 'params': result['params'], 'loss': result['loss'],
+                       'rms': quality['rms'], 'r2': quality['r2'], 'band': list(band),
+                       'history': result['history']}, out, indent=2)
+    if catalog is not None:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
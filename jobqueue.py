@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+
+'''
+Sweep queue on a shared filesystem.
+
+A coordinator writes MFM jobs (option overrides with a seed) into a queue
+directory, and any number of workers, on any machine that sees the
+directory, claim and run them. The queue needs no server: each job is a JSON
+file that moves between
+
+  pending/   waiting for a worker
+  running/   claimed; the worker touches the file while the run goes on
+  done/      finished, with the run's summary
+  failed/    out of retries, with the errors
+
+Claims are atomic renames, so a job goes to one worker. A running job whose
+file has not been touched for the lease time (its worker died or lost the
+filesystem) is put back in pending by the next worker or status call, up to
+the retry limit. Each claim carries a token, and a worker only renews the
+lease or completes the job while the running file still holds its token; a
+job is completed (or failed) by renaming its running file away before
+checking the token, so a worker never removes a file claimed since.
+Jobs run at least once; in the rare case a stalled worker recovers after its
+lease expired a job may run twice, with the same seed.
+
+Workers only write job files. The summaries of done jobs are added to the
+run catalog by one process (merge, or jobqueue.evaluate), so the SQLite
+catalog never has writers on several machines.
+
+Usage:
+  jobqueue submit [options] <queue> [<key>=<value>]...
+  jobqueue work [options] <queue>
+  jobqueue merge [options] <queue>
+  jobqueue status <queue>
+
+Options:
+  -f --file PATH       JSON list of option dicts to submit (in addition to
+                       the <key>=<value> options, which apply to all)
+  -n --seeds N         Replicates of each job, with seeds 0..N-1
+  -c --catalog PATH    Run catalog of the results [default: data/catalog.db]
+  --no-cache           Do not skip jobs already in the catalog
+  -p --processes N     Worker processes to start [default: 1]
+  --max-jobs N         Exit after running N jobs
+  --exit-idle          Exit once no job is pending or running
+  --lease T            Lease time of a new queue (s) [default: 120]
+  --retries N          Attempts per job of a new queue [default: 3]
+  -h --help            Show this screen
+'''
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+import numpy as np
+
+STATES = ['pending', 'running', 'done', 'failed']
+
+class Queue(object):
+    '''
+    Job queue in a directory.
+
+    Parameters
+    ----------
+    root : str
+        Queue directory, created if missing
+    lease : float (s)
+        Time after which a running job that has not been touched is
+        considered abandoned. Fixed when the queue is created.
+    retries : int
+        Attempts of each job before it is failed. Fixed when the queue is
+        created.
+
+    Examples
+    --------
+    >>> queue = Queue('/shared/sweep')
+    >>> ids = queue.submit([{'DD': True, 'seed': s} for s in range(100)])
+    >>> queue.wait(ids)
+    >>> summaries = queue.results(ids)
+    '''
+    def __init__(self, root, lease=120., retries=3):
+        self.root = root
+        for name in STATES + ['tmp']:
+            path = os.path.join(root, name)
+            if not os.path.isdir(path):
+                os.makedirs(path, exist_ok=True)
+
+        config = os.path.join(root, 'config.json')
+        if not os.path.exists(config):
+            self._write(config, {'lease': float(lease), 'retries': int(retries)})
+        with open(config) as f:
+            config = json.load(f)
+        self.lease = config['lease']
+        self.retries = config['retries']
+
+    def _path(self, state, job_id):
+        return os.path.join(self.root, state, job_id + '.json')
+
+    def _write(self, path, data):
+        # Write then rename, so readers never see a partial file
+        tmp = os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _read(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def _ids(self, state):
+        return sorted(name[:-5] for name in os.listdir(os.path.join(self.root, state)) if name.endswith('.json'))
+
+    def submit(self, runs, catalog=None):
+        '''
+        Add jobs.
+
+        Parameters
+        ----------
+        runs : list of dict
+            MFM options of each job. Jobs without a seed are given one, so
+            retries and catalog lookups are reproducible.
+        catalog : catalog.Catalog, optional
+            Jobs already in the catalog are not submitted
+
+        Returns
+        -------
+        ids : list of str
+            Job ids, in order (None for jobs found in the catalog)
+        '''
+        batch = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:6]
+        rng = np.random.RandomState()
+        ids = []
+        for k,options in enumerate(runs):
+            options = dict(options)
+            if options.get('seed', -1) == -1:
+                options['seed'] = int(rng.randint(2**31 - 1))
+            if catalog is not None and options in catalog:
+                ids.append(None)
+                continue
+            job_id = '{}-{:06d}'.format(batch, k)
+            self._write(self._path('pending', job_id), {'id': job_id, 'options': options, 'attempts': 0,
+                                                        'errors': [], 'submitted': time.time()})
+            ids.append(job_id)
+        return ids
+
+    def claim(self, worker):
+        '''
+        Claim the oldest pending job.
+
+        Returns
+        -------
+        job : dict or None
+        '''
+        for job_id in self._ids('pending'):
+            src = self._path('pending', job_id)
+            try:
+                # Refresh the mtime first, so the lease starts now; only one
+                # worker's rename succeeds
+                os.utime(src)
+                os.rename(src, self._path('running', job_id))
+            except OSError:
+                continue
+            path = self._path('running', job_id)
+            try:
+                job = self._read(path)
+            except (OSError, ValueError):
+                continue
+            job['attempts'] += 1
+            job['worker'] = worker
+            job['token'] = uuid.uuid4().hex
+            job['claimed'] = time.time()
+            self._write(path, job)
+            return job
+        return None
+
+    def heartbeat(self, job):
+        '''
+        Renew the lease of a running job.
+
+        Returns
+        -------
+        held : bool
+            False if the job is no longer running under this claim
+        '''
+        # A requeued job may have been claimed again by another worker,
+        # whose lease is not ours to renew
+        if not self._owned(job):
+            return False
+        try:
+            os.utime(self._path('running', job['id']))
+            return True
+        except OSError:
+            return False
+
+    def _owned(self, job):
+        try:
+            current = self._read(self._path('running', job['id']))
+        except (OSError, ValueError):
+            return False
+        return current.get('token') == job['token']
+
+    def _reap(self, job):
+        '''
+        Take a running job out of running/ if it still holds this claim.
+
+        The file is renamed away first and its token checked after, as
+        requeue_expired does, so a job that was requeued and claimed by
+        another worker in between is never removed under its new owner: its
+        file is put back.
+
+        Returns
+        -------
+        path : str or None
+            Where the job file now is, or None if the claim was lost
+        '''
+        path = self._path('running', job['id'])
+        reaped = os.path.join(self.root, 'tmp', job['id'] + '.' + uuid.uuid4().hex)
+        try:
+            os.rename(path, reaped)
+        except OSError:
+            return None
+        try:
+            token = self._read(reaped).get('token')
+        except (OSError, ValueError):
+            token = None
+        if token != job['token']:
+            os.rename(reaped, path)
+            return None
+        return reaped
+
+    def complete(self, job, summary):
+        '''
+        Move a running job to done with its summary.
+
+        Returns
+        -------
+        completed : bool
+            False if the claim was lost (the job was requeued)
+        '''
+        reaped = self._reap(job)
+        if reaped is None:
+            return False
+        job = dict(job, summary=summary, finished=time.time())
+        self._write(self._path('done', job['id']), job)
+        try:
+            os.remove(reaped)
+        except OSError:
+            pass
+        return True
+
+    def fail(self, job, error):
+        '''
+        Record an error of a running job, and requeue it if it has attempts left.
+        '''
+        reaped = self._reap(job)
+        if reaped is None:
+            return
+        self._retry(dict(job), error, reaped)
+
+    def _retry(self, job, error, path):
+        job['errors'] = job['errors'] + [error]
+        state = 'failed' if job['attempts'] >= self.retries else 'pending'
+        self._write(self._path(state, job['id']), job)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def requeue_expired(self):
+        '''
+        Requeue (or fail) running jobs whose lease has expired.
+
+        Returns
+        -------
+        n : int
+            Number of jobs requeued or failed
+        '''
+        n = 0
+        now = time.time()
+        for job_id in self._ids('running'):
+            path = self._path('running', job_id)
+            try:
+                if now - os.stat(path).st_mtime <= self.lease:
+                    continue
+                # Take the job out of running atomically, so one caller handles it
+                reaped = os.path.join(self.root, 'tmp', job_id + '.' + uuid.uuid4().hex)
+                os.rename(path, reaped)
+            except OSError:
+                continue
+            try:
+                job = self._read(reaped)
+            except (OSError, ValueError) as e:
+                self._discard(job_id, reaped, e)
+            else:
+                self._retry(job, 'lease expired (worker {})'.format(job.get('worker')), reaped)
+            n += 1
+        return n
+
+    def _discard(self, job_id, path, error):
+        '''Fail a job whose file cannot be read, keeping its contents'''
+        try:
+            with open(path, errors='replace') as f:
+                raw = f.read()
+        except OSError:
+            raw = None
+        job = {'id': job_id, 'options': None, 'attempts': 0, 'raw': raw,
+               'errors': ['unreadable job file ({})'.format(error)]}
+        self._write(self._path('failed', job_id), job)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def status(self):
+        '''Number of jobs in each state'''
+        self.requeue_expired()
+        return {state: len(self._ids(state)) for state in STATES}
+
+    def wait(self, ids, poll=1., timeout=None):
+        '''
+        Block until the jobs are done or failed.
+
+        Returns
+        -------
+        finished : bool
+            False if the timeout expired first
+        '''
+        ids = set(job_id for job_id in ids if job_id is not None)
+        start = time.time()
+        while True:
+            finished = set(self._ids('done')) | set(self._ids('failed'))
+            if ids <= finished:
+                return True
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            self.requeue_expired()
+            time.sleep(poll)
+
+    def results(self, ids):
+        '''
+        Summaries of done jobs (None for jobs that are not done).
+        '''
+        summaries = []
+        for job_id in ids:
+            try:
+                summaries.append(self._read(self._path('done', job_id))['summary'])
+            except (TypeError, OSError, ValueError):
+                summaries.append(None)
+        return summaries
+
+    def failures(self):
+        '''Failed jobs'''
+        return [self._read(self._path('failed', job_id)) for job_id in self._ids('failed')]
+
+    def merge(self, catalog):
+        '''
+        Add the summaries of done jobs to a run catalog.
+
+        Jobs are catalogued with the source <root>:<id>, and jobs whose
+        source is already in the catalog are skipped, so merging again only
+        adds the jobs done since. Jobs the catalog rejects (e.g. options it
+        does not know) are skipped too; their summaries stay in the queue.
+
+        Parameters
+        ----------
+        catalog : catalog.Catalog
+
+        Returns
+        -------
+        n : int
+            Number of jobs added
+        '''
+        known = catalog.sources()
+        n = 0
+        for job_id in self._ids('done'):
+            source = '{}:{}'.format(self.root, job_id)
+            if source in known:
+                continue
+            try:
+                job = self._read(self._path('done', job_id))
+                catalog.add(job['options'], job['summary'], source=source)
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            n += 1
+        return n
+
+def evaluate(runs, queue, catalog=None, poll=1.):
+    '''
+    Summaries of a list of runs, run by the queue's workers.
+
+    Like catalog.evaluate, but the missing runs are submitted to the queue
+    and this call waits for them, then merges the done jobs into the
+    catalog. Runs that fail have a summary of None.
+    '''
+    summaries = [None]*len(runs)
+    missing = []
+    for k,options in enumerate(runs):
+        cached = catalog.get(options, limit=1) if catalog is not None and options.get('seed', -1) != -1 else []
+        if cached:
+            summaries[k] = cached[0]
+        else:
+            missing.append(k)
+
+    ids = queue.submit([runs[k] for k in missing])
+    queue.wait(ids, poll)
+    for k,summary in zip(missing, queue.results(ids)):
+        summaries[k] = summary
+    if catalog is not None:
+        queue.merge(catalog)
+    return summaries
+
+class Worker(object):
+    '''
+    Queue worker.
+
+    Results go to the done job files only; see Queue.merge.
+
+    Parameters
+    ----------
+    queue : Queue
+    poll : float (s)
+        Wait between checks of an empty queue
+    '''
+    def __init__(self, queue, poll=1.):
+        self.queue = queue
+        self.poll = poll
+        self.name = '{}-{}'.format(socket.gethostname(), os.getpid())
+
+    def _run(self, job):
+        from mfm import MFM
+        from metrics import summarize
+
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(self.queue.lease/4.):
+                if not self.queue.heartbeat(job):
+                    return
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+        try:
+            mfm = MFM(**dict(job['options'], verbose=False))
+            mfm.run()
+            return summarize(mfm)
+        finally:
+            stop.set()
+            thread.join()
+
+    def run(self, max_jobs=None, exit_idle=False):
+        '''
+        Claim and run jobs until max_jobs have run, or until the queue is
+        empty with exit_idle. A job that raises, in the run or while its
+        result is written, is failed (or requeued) without stopping the
+        worker.
+
+        Returns
+        -------
+        n : int
+            Number of jobs run
+        '''
+        n = 0
+        while max_jobs is None or n < max_jobs:
+            self.queue.requeue_expired()
+            job = self.queue.claim(self.name)
+            if job is None:
+                if exit_idle and not self.queue._ids('pending') and not self.queue._ids('running'):
+                    break
+                time.sleep(self.poll)
+                continue
+            try:
+                self.queue.complete(job, self._run(job))
+            except Exception as e:
+                try:
+                    self.queue.fail(job, repr(e))
+                except OSError:
+                    pass    # the lease expires and the job is requeued
+            n += 1
+        return n
+
+def _work(root, max_jobs, exit_idle):
+    np.random.seed()
+    Worker(Queue(root)).run(max_jobs, exit_idle)
+
+def main():
+    from docopt import docopt
+
+    args = docopt(__doc__)
+    queue = Queue(args['<queue>'], float(args['--lease']), int(args['--retries']))
+    # Only the coordinator opens the catalog; workers never touch it
+    catalog = None
+    if (args['submit'] and not args['--no-cache']) or args['merge']:
+        from catalog import Catalog
+        catalog = Catalog(args['--catalog'])
+
+    if args['submit']:
+        from mfm import parse_kwargs
+        common = parse_kwargs(args['<key>=<value>'])
+        runs = [{}]
+        if args['--file']:
+            with open(args['--file']) as f:
+                runs = json.load(f)
+        runs = [dict(o, **common) for o in runs]
+        if args['--seeds']:
+            runs = [dict(o, seed=s) for o in runs for s in range(int(args['--seeds']))]
+        ids = queue.submit(runs, catalog)
+        print('Submitted {} jobs ({} already in the catalog)'.format(sum(i is not None for i in ids),
+                                                                    sum(i is None for i in ids)))
+    elif args['work']:
+        import multiprocessing
+        max_jobs = int(args['--max-jobs']) if args['--max-jobs'] else None
+        workers = [multiprocessing.Process(target=_work, args=(queue.root, max_jobs, args['--exit-idle']))
+                   for _ in range(int(args['--processes']))]
+        for w in workers: w.start()
+        for w in workers: w.join()
+    elif args['merge']:
+        print('Added {} jobs to {}'.format(queue.merge(catalog), args['--catalog']))
+    else:
+        from tabulate import tabulate
+        print(tabulate(sorted(queue.status().items(), key=lambda item: STATES.index(item[0])),
+                       headers=['State', 'Jobs']))
+        for job in queue.failures():
+            print('{}: {}'.format(job['id'], job['errors'][-1]))
+    if catalog is not None:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+'''
+Array form of the mean field model equations
+'''
+
+import numpy as np
+
+from model_spec import BGTCS, RATES
+
+# Populations in state order: (name, Q attribute, theta attribute, rate attribute)
+POPULATIONS = BGTCS.populations
+
+# Connections: (post, pre, weight attribute, delay attribute). A pre of 'phie'
+# is the cortical wave field; 'Ve' is the raw excitatory potential (used by
+# the d2 cortical input). All other pre populations enter through their sigmoid.
+EDGES = BGTCS.edges
+
+SIGMA = 3.8     # mV, threshold spread of the sigmoids
+
+def sigmoid(V, Q, theta):
+    return Q/(1+np.exp(-(V-theta)/SIGMA))
+
+class Kernel(object):
+    '''
+    Array form of the MFM equations, or of any model_spec.ModelSpec (see
+    Kernel.compile and ModelSpec.compile).
+
+    The state layout matches MFM.S: column 0/1 are phie and its derivative,
+    and each population's potential and derivative follow at MFM.struct[name]
+    and MFM.struct[name]+1 (ModelSpec.struct for other models).
+
+    Parameters
+    ----------
+    mfm : MFM
+        Model whose parameters (including the DD overrides and scheduled
+        changes) are used
+
+    Attributes
+    ----------
+    col : numpy.array (P,)
+        State column of each population's potential
+    Q, theta : numpy.array (P,)
+        Sigmoid maximum rate and threshold of each population
+    rate : numpy.array (P,)
+        alpha*beta (alpha*gamma for cortex) of each population
+    const : numpy.array (P,)
+        Constant input of each population (phin for s)
+    pre, post : numpy.array (E,)
+        Presynaptic state column and postsynaptic population index of each edge
+    w : numpy.array (E,)
+        Connection strength of each edge
+    delay : numpy.array (E,) of int
+        Axonal delay of each edge (steps)
+    sig : numpy.array (E,) of bool
+        True if the edge passes the presynaptic potential through its sigmoid
+    '''
+    def __init__(self, mfm):
+        spec = getattr(mfm, 'spec', BGTCS)
+        names = list(spec.params) + ['gammasq', 'aPb'] + RATES
+        self._build(spec, {key: getattr(mfm,key) for key in names}, mfm.params['dt'])
+
+    @classmethod
+    def compile(cls, spec, values, dt):
+        '''
+        Kernel of a model_spec.ModelSpec.
+
+        Parameters
+        ----------
+        spec : model_spec.ModelSpec
+        values : dict
+            Parameter values with delays in steps and the rate constants, as
+            returned by spec.resolve
+        dt : float (s)
+        '''
+        kernel = cls.__new__(cls)
+        kernel._build(spec, values, dt)
+        return kernel
+
+    def _build(self, spec, values, dt):
+        self.spec  = spec
+        self.names = spec.names
+        self.dt    = dt
+        self.wave  = self.names.index(spec.wave)
+        self._nstate = spec.nstate
+
+        struct = spec.struct
+        self.col   = np.array([struct[name] for name in self.names])
+        self.Q     = np.array([values[p[1]] for p in spec.populations], dtype=float)
+        self.theta = np.array([values[p[2]] for p in spec.populations], dtype=float)
+        self.rate  = np.array([values[p[3]] for p in spec.populations], dtype=float)
+        self.damp  = float(values['aPb'])
+        self.const = np.zeros(len(self.names))
+        for post,param in spec.inputs.items():
+            self.const[self.names.index(post)] = values[param]
+
+        self.gammasq  = float(values['gammasq'])
+        self.gammae   = float(values['gammae'])
+        self.noiseAmp = float(values['noiseAmp'])
+
+        columns = {'phie': 0}
+        columns.update(struct)
+        columns.update({'V' + name: col for name,col in struct.items()})
+
+        edges = spec.edges
+        self.post  = np.array([self.names.index(e[0]) for e in edges])
+        self.pre   = np.array([columns[e[1]] for e in edges])
+        self.w     = np.array([values[e[2]] for e in edges], dtype=float)
+        self.delay = np.array([values[e[3]] if e[3] else 0 for e in edges], dtype=int)
+        self.sig   = np.array([e[1] in self.names for e in edges], dtype=bool)
+
+        pre_pop = [self.names.index(e[1]) if e[1] in self.names else 0 for e in edges]
+        self.pre_Q     = np.where(self.sig, self.Q[pre_pop], 1.)
+        self.pre_theta = np.where(self.sig, self.theta[pre_pop], 0.)
+
+        # Edges of each population, padded with a zero input (index E). Adding
+        # them one at a time in edge order gives a network node the same
+        # result as MFM bit for bit, which a matrix product does not guarantee
+        groups = [np.flatnonzero(self.post == p) for p in range(len(self.names))]
+        self._groups = np.full((len(self.names),max(1, max(len(g) for g in groups))), len(edges))
+        for p,g in enumerate(groups):
+            self._groups[p,:len(g)] = g
+
+    @classmethod
+    def stack(cls, kernels):
+        '''
+        One kernel for several nodes with different parameters.
+
+        The per-population and per-edge parameters of the result are
+        (nodes, P) and (nodes, E) arrays, so rhs advances a (nodes, nstate) state.
+        The nodes must share dt, the delays and the cortical and dendritic
+        rate constants.
+        '''
+        first = kernels[0]
+        for k in kernels[1:]:
+            if k.names != first.names or not (np.array_equal(k.pre, first.pre) and np.array_equal(k.post, first.post)):
+                raise ValueError('nodes must have the same populations and edges')
+            if (k.dt != first.dt or not np.array_equal(k.delay, first.delay) or
+                (k.gammasq, k.gammae, k.damp) != (first.gammasq, first.gammae, first.damp)):
+                raise ValueError('nodes must share dt, delays and rate constants')
+
+        kernel = cls.__new__(cls)
+        kernel.__dict__.update(first.__dict__)
+        for attr in ('Q', 'theta', 'rate', 'const', 'w', 'pre_Q', 'pre_theta'):
+            setattr(kernel, attr, np.stack([getattr(k, attr) for k in kernels]))
+        kernel.noiseAmp = np.array([k.noiseAmp for k in kernels])[:,None]
+        return kernel
+
+    @property
+    def nstate(self):
+        return self._nstate
+
+    @property
+    def max_delay(self):
+        return int(self.delay.max())
+
+    def inputs(self, xd):
+        '''
+        Synaptic input of each edge.
+
+        Parameters
+        ----------
+        xd : numpy.array (..., E)
+            Delayed presynaptic state of each edge
+        '''
+        return self.w*np.where(self.sig, sigmoid(xd,self.pre_Q,self.pre_theta), xd)
+
+    def rhs(self, x, xd, drive=None):
+        '''
+        Deterministic time derivative of the state.
+
+        Parameters
+        ----------
+        x : numpy.array (..., nstate)
+            Current state
+        xd : numpy.array (..., E)
+            Delayed presynaptic state of each edge
+        drive : numpy.array (..., P), optional
+            External input to each population (mV), e.g. from other nodes
+
+        Returns
+        -------
+        dxdt : numpy.array (..., nstate)
+        '''
+        inputs = self.inputs(xd)
+        inputs = np.concatenate([inputs, np.zeros(inputs.shape[:-1]+(1,))], axis=-1)[...,self._groups]
+        total = inputs[...,0]
+        for k in range(1, inputs.shape[-1]):
+            total = total + inputs[...,k]
+        total = total + self.const
+        if drive is not None:
+            total = total + drive
+
+        # Evaluate in double precision whatever the state dtype; only the
+        # result is rounded to x.dtype (float32 in single precision runs)
+        w = self.wave
+        dxdt = np.empty_like(x)
+        x = np.asarray(x, dtype=float)
+        dxdt[...,0] = x[...,1]
+        dxdt[...,1] = self.gammasq*(sigmoid(x[...,self.col[w]],self.Q[...,w],self.theta[...,w])-x[...,0])-2*self.gammae*x[...,1]
+
+        V, Vdot = x[...,self.col], x[...,self.col+1]
+        dxdt[...,self.col]   = Vdot
+        dxdt[...,self.col+1] = self.rate*(total-V)-self.damp*Vdot
+        return dxdt
+
+    def jacobian(self, x):
+        '''
+        Linearization of rhs about a constant history x.
+
+        Returns
+        -------
+        A : dict
+            {delay (steps): numpy.array (nstate,nstate)} such that the
+            linearized system is dx/dt = sum(A[d] @ x(t - d*dt))
+        '''
+        A = {0: np.zeros((self.nstate,self.nstate))}
+
+        A[0][0,1] = 1
+        w = self.wave
+        s = sigmoid(x[self.col[w]],1,self.theta[w])
+        A[0][1,self.col[w]] = self.gammasq*self.Q[w]*s*(1-s)/SIGMA
+        A[0][1,0] = -self.gammasq
+        A[0][1,1] = -2*self.gammae
+
+        A[0][self.col,self.col+1]   = 1
+        A[0][self.col+1,self.col]   = -self.rate
+        A[0][self.col+1,self.col+1] = -self.damp
+
+        s = sigmoid(x[self.pre],1,self.pre_theta)
+        gain = self.w*np.where(self.sig, self.pre_Q*s*(1-s)/SIGMA, 1.)
+        for e in range(len(self.post)):
+            d = self.delay[e]
+            if d not in A:
+                A[d] = np.zeros((self.nstate,self.nstate))
+            A[d][self.col[self.post[e]]+1,self.pre[e]] += self.rate[self.post[e]]*gain[e]
+        return A
@@ -0,0 +1,109 @@
+'''
+Spectral and stimulation metrics of MFM runs
+'''
+
+import numpy as np
+
+BETA = (13., 30.)   # Hz
+
+# numpy 2 renamed trapz to trapezoid (and later removed trapz)
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+def psd(x, fs, nperseg=2048):
+    '''
+    Welch power spectral density estimate.
+
+    Parameters
+    ----------
+    x : array_like
+        Time series
+    fs : float (Hz)
+        Sampling frequency
+    nperseg : int, optional
+        Segment length, clipped to the length of x
+
+    Returns
+    -------
+    f : numpy.array (Hz)
+        Frequencies
+    Pxx : numpy.array
+        Power spectral density
+    '''
+    from scipy import signal
+
+    x = np.asarray(x, dtype=np.float64)
+    return signal.welch(x, fs, nperseg=min(nperseg, len(x)))
+
+def band_power(f, Pxx, band=BETA):
+    '''
+    Power integrated over a frequency band, in dB.
+    '''
+    mask = (f >= band[0]) & (f <= band[1])
+    with np.errstate(divide='ignore'):
+        return 10*np.log10(_trapezoid(Pxx[mask], f[mask]))
+
+def beta_peak(x, fs, band=BETA, nperseg=2048):
+    '''
+    Peak frequency and band power of the beta oscillation.
+
+    Parameters
+    ----------
+    x : array_like
+        Time series
+    fs : float (Hz)
+        Sampling frequency
+    band : tuple, optional
+        (low, high) band edges (Hz)
+
+    Returns
+    -------
+    f_peak : float (Hz)
+        Frequency of the PSD maximum within band
+    power : float (dB)
+        Power integrated over band
+    '''
+    f, Pxx = psd(x, fs, nperseg)
+    mask = (f >= band[0]) & (f <= band[1])
+    f_peak = f[mask][np.argmax(Pxx[mask])]
+    return f_peak, band_power(f, Pxx, band)
+
+def summarize(mfm, burn=1.0, node=None):
+    '''
+    Summary metrics of a finished run.
+
+    Parameters
+    ----------
+    mfm : MFM or network.Network
+        Finished run
+    burn : float (s)
+        Initial transient excluded from the spectral metrics
+    node : int, optional
+        Node to summarize, for a Network (from its recorded state_target
+        and stim channels)
+
+    Returns
+    -------
+    summary : dict
+        beta_freq  : beta peak frequency of state_target (Hz)
+        beta_power : beta band power of state_target (dB)
+        pulses     : number of stimulation pulses
+        stim_rate  : mean stimulation rate (Hz)
+        charge     : total charge delivered (mC)
+        length     : simulated length (s)
+    '''
+    dt = mfm.params['dt']
+    N = mfm.params['N']
+    if node is None:
+        x = mfm.S[int(burn/dt):N,mfm.struct[mfm.params['state_target']]]
+        stim = mfm.memory['stim'][:N]
+    else:
+        x = mfm.record[mfm.params['state_target']][int(burn/dt):N,node]
+        stim = mfm.record['stim'][:N,node]
+    f_peak, power = beta_peak(x, mfm.params['fs'])
+    pulses = int(np.count_nonzero(stim))
+    return {'beta_freq'  : float(f_peak),
+            'beta_power' : float(power),
+            'pulses'     : pulses,
+            'stim_rate'  : pulses / (N*dt),
+            'charge'     : float(np.sum(stim, dtype=np.float64)),
+            'length'     : N*dt}
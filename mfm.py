@@ -15,39 +15,80 @@ import numpy as np
 import pickle
 import sys
 import os
-from docopt import docopt
-from tabulate import tabulate
 
 from utils import progbar
-from swift import aswift
 
 from dbs import cDBS, pDBS
+from kernel import Kernel, POPULATIONS, EDGES, sigmoid
+from model_spec import BGTCS, ModelSpec, rates
+
+# Options that can be changed during a run with MFM.schedule
+SCHEDULE_OPTIONS = ['DD', 'cDBS', 'cDBS_f', 'cDBS_amp', 'cDBS_width',
+                    'pDBS', 'pDBS_phase', 'pDBS_amp', 'pDBS_width', 'pDBS_power_thr', 'pDBS_ref_period']
+
+# Model attributes that can be changed during a run with MFM.schedule
+SCHEDULE_MODEL = (['phin', 'noiseAmp', 'gammae', 'alpha', 'beta'] +
+                  [attr for pop in POPULATIONS for attr in pop[1:3]] +
+                  [edge[2] for edge in EDGES] + [edge[3] for edge in EDGES if edge[3]])
+
+# DBS object attributes set by the stimulation options
+_STIM_ATTRS = {'cDBS_f'          : ('cDBS', 'f'),
+               'cDBS_amp'        : ('cDBS', 'stim_amp'),
+               'cDBS_width'      : ('cDBS', 'width'),
+               'pDBS_phase'      : ('pDBS', 'phase_thr'),
+               'pDBS_amp'        : ('pDBS', 'stim_amp'),
+               'pDBS_width'      : ('pDBS', 'width'),
+               'pDBS_power_thr'  : ('pDBS', 'power_thr'),
+               'pDBS_ref_period' : ('pDBS', 'ref_period')}
 
 class MFM(object):
+    #Parkinsonian (DD) parameters, replacing the healthy values
+    DD_PARAMS = dict(BGTCS.sets['DD'])
+
     def __init__(self,**kwargs):
         self.t = 0                  #internal time counter
         self.i = 0                  #internal index
 
+        schedule = kwargs.pop('schedule', [])     #[[t, {key: value}], ...], see MFM.schedule
+        x0 = kwargs.pop('x0', None)               #initial state and history (nstate,), e.g. analysis.fixed_point
+        S = kwargs.pop('S', None)                 #array (N,nstate) to record the state into, e.g. shared memory
+        memory = kwargs.pop('memory', None)       #arrays (N,) to record MFM.memory into
         self._load_params(kwargs)
         self._set_MFM_params()
         self._set_DBS()
+        self._compile()
+
+        N = self.params['N']
+        # Recording into given arrays: only the rows the run reads before it
+        # writes them (S[0] and the delay history) are set here
+        self._own_buffers = S is None and memory is None
+        self.S = self._buffer(S, 'S', (N,self.spec.nstate))
+        self.memory = {}
+        for key in ('amp', 'phase', 'stim'):
+            self.memory[key] = self._buffer(None if memory is None else memory[key], 'memory[{!r}]'.format(key), (N,))
+            if memory is not None:
+                self.memory[key][:] = 0
+
+        if x0 is not None:
+            self.params['x0'] = [float(v) for v in x0]
+        self._fill_history()
+        if x0 is not None:
+            self.S[0,:] = self.params['x0']
+        elif self.spec.names == BGTCS.names:
+            self.S[0,:] = [ 43.74102506,  -1.15197439,    6.96276347,  -22.25852135,    7.19671392,
+                           -28.57548512,  17.26916297,  132.89911127,    9.71319243,   67.69191101,
+                            9.57769785,  -21.11198645,    5.33943222,  -22.62375016,    0.54172422,
+                           -22.23467637,   6.76173506,   143.5386694,    7.49756915,   23.59983148]
+        else:
+            self.S[0,:] = 0
 
-        self.S = np.zeros((self.params['N'],20))
-        self.S[0,:] = [ 43.74102506,  -1.15197439,    6.96276347,  -22.25852135,    7.19671392,
-                       -28.57548512,  17.26916297,  132.89911127,    9.71319243,   67.69191101,
-                        9.57769785,  -21.11198645,    5.33943222,  -22.62375016,    0.54172422,
-                       -22.23467637,   6.76173506,   143.5386694,    7.49756915,   23.59983148]
-
-        self.swift = aswift(tau_s = 1./self.params['swift_f'] * self.params['swift_c'],
-                            tau_f = 1./self.params['swift_f'] * self.params['swift_c'] / self.params['swift_s2f'],
-                            f = self.params['swift_f'],
-                            fs = self.params['fs'])
+        if self.params['seed'] >= 0:
+            self._normal = np.random.RandomState(self.params['seed']).normal
+        else:
+            self._normal = np.random.normal
 
-        self.memory = {
-            'amp'   : np.zeros(self.params['N']),
-            'phase' : np.zeros(self.params['N']),
-            'stim'  : np.zeros(self.params['N']),
-        }
+        for t,changes in schedule:
+            self.schedule(t, **changes)
 
     def __str__(self):
         general = ('Run Info\n'+
@@ -85,8 +126,15 @@ class MFM(object):
                   'ref period : {}\n')\
                   .format(*[self.params[key] for key in ['pDBS_phase','pDBS_amp','pDBS_power_thr','pDBS_ref_period']])
         else: pDBS=''
+
+        if self.params.get('schedule'):
+            schedule=('\nSchedule\n'
+                      '--------\n'+
+                      ''.join('{:<8} : {}\n'.format('{} s'.format(t), ', '.join('{}={}'.format(k,v) for k,v in sorted(changes.items())))
+                              for t,changes in self.params['schedule']))
+        else: schedule=''
             
-        return general+SWIFT+cDBS+pDBS
+        return general+SWIFT+cDBS+pDBS+schedule
         
     def _load_params(self,kwargs):
         def process_kwargs(kwargs):
@@ -106,7 +154,12 @@ class MFM(object):
         self.params['stim_start'] = 0.0         # s
         self.params['tstop']      = 50.0        # s
         self.params['RunID']      = -1          
+        self.params['seed']       = -1          # -1 uses the global numpy RNG
+        self.params['precision']  = 'double'    # 'double' or 'single'
                 
+        #Model: path of a model_spec.ModelSpec (JSON), or '' for model_spec.BGTCS
+        self.params['model'] = ''
+
         #DD parameters
         self.params['DD'] = True
 
@@ -135,6 +188,13 @@ class MFM(object):
         self.params['swift_c']      = 10        # unitless - number of cycles per tau
         self.params['swift_s2f']    = 5         # unitless - ratio of tau_s to tau_f
 
+        #Early stopping params (tstop is the maximum length)
+        self.params['stop_metric']  = 'none'    # 'none', 'beta_power' (state_target, dB) or 'stim_rate' (Hz)
+        self.params['stop_window']  = 2.0       # s - length of each metric window
+        self.params['stop_tol']     = 1.0       # 95% CI half-width, in units of the metric (dB or Hz)
+        self.params['stop_min']     = 5         # minimum number of windows
+        self.params['stop_burn']    = 1.0       # s - transient excluded from the metric
+
         self._options = self.params.copy()
         process_kwargs(kwargs)
         
@@ -142,150 +202,61 @@ class MFM(object):
         self.params['N'] = int(np.ceil(self.params['tstop']/self.params['dt']))
         self.params['fs'] = 1./self.params['dt']
 
+        if self.params['precision'] not in ('double','single'):
+            raise ValueError("precision must be 'double' or 'single'")
+        if self.params['stop_metric'] not in ('none','beta_power','stim_rate'):
+            raise ValueError("stop_metric must be 'none', 'beta_power' or 'stim_rate'")
+
         if self.params['swift_tau_s'] is None:
             self.params['swift_tau_s'] = 1./self.params['swift_f'] * self.params['swift_c']
         self.params['swift_tau_f'] = self.params['swift_tau_s'] / self.params['swift_s2f']
                          
     def _set_MFM_params(self):
-        self.phin = 15
-        self.noiseAmp = 0.03
+        #Populations, connection strengths (mVs), sigmoids and axonal delays (steps), see model_spec.BGTCS
+        dt = self.params['dt']
+        self.spec = ModelSpec.load(self.params['model']) if self.params['model'] else BGTCS
+        self.__dict__.update(self.spec.resolve('healthy', dt))
         self.re = 80 #mm
-        self.gammae = 125 #s^-1
-        self.alpha = 160 #s^-1
-        self.beta = 640 #s^-1
-        self.gammasq=self.gammae^2
-        self.alphabeta=self.alpha*self.beta
-        self.aPb = (self.alpha+self.beta)#/alphabeta
-        self.alphagamma=self.alpha*self.gammae
-
-        #Axonal Delays: from second to first (1st population type is postsynaptic)
-        #(ms)
-        self.taues   = int(0.035/self.params['dt'])
-        self.tauis   = int(0.035/self.params['dt'])
-        self.taud1e  = int(0.002/self.params['dt'])
-        self.taud2e  = int(0.002/self.params['dt'])
-        self.taud1s  = int(0.002/self.params['dt'])
-        self.taud2s  = int(0.002/self.params['dt'])
-        self.taup1d1 = int(0.001/self.params['dt'])
-        self.taup1p2 = int(0.001/self.params['dt'])
-        self.taup1ST = int(0.001/self.params['dt'])
-        self.taup2d2 = int(0.001/self.params['dt'])
-        self.taup2ST = int(0.001/self.params['dt'])
-        self.tauSTe  = int(0.001/self.params['dt'])
-        self.tauSTp2 = int(0.001/self.params['dt'])
-        self.tause   = int(0.050/self.params['dt'])
-        self.taure   = int(0.050/self.params['dt'])
-        self.tausp1  = int(0.003/self.params['dt'])
-        self.tausr   = int(0.002/self.params['dt'])
-        self.taurs   = int(0.002/self.params['dt'])
-        self.taud2d1 = int(0.001/self.params['dt'])
+        self.vsn = 0.5
 
         #Threshold spread (mV)
         self.sigmaprime = 3.8
 
-        #Connection strength (mVs)
-        self.vee   =  1.6   #1.6 1.4 is DD
-        self.vie   =  1.6   #1.6 1.4 is DD
-        self.vei   = -1.9   #-1.9-1.6 is DD
-        self.vii   = -1.9   #-1.9 -1.6 is DD
-        self.ves   =  0.4
-        self.vis   =  0.4
-        self.vd1e  =  1.0   #1 #1 is normal, .5 is DD
-        self.vd1d1 = -0.3
-        self.vd1s  =  0.1
-        self.vd2e  =  0.7   #0.7 1.4 is DD
-        self.vd2d2 = -0.3
-        self.vd2s  =  0.05
-        self.vp1d1 = -0.1
-        self.vp1p2 = -0.03
-        self.vp1ST =  0.3
-        self.vp2d2 = -0.3   #-0.3 -0.5 is DD
-        self.vp2p2 = -0.1   #-0.1 -0.07 is DD
-        self.vp2ST =  0.3
-        self.vSTe  =  0.1
-        self.vSTp2 = -0.04
-        self.vse   =  0.8
-        self.vsp1  = -0.03
-        self.vsr   = -0.4
-        self.vsn   =  0.5
-        self.vre   =  0.15
-        self.vrs   =  0.03
-        self.vd2d1 =  0
-
-        #Sigmoids
-        #Maximum Firing Rates (s^-1)
-        self.Qe = 300
-        self.Qi = 300
-        self.Qd1 = 65
-        self.Qd2 = 65
-        self.Qp1 = 250
-        self.Qp2 = 300
-        self.QST = 500
-        self.Qs = 300
-        self.Qr = 500
-
-        #Firing Thresholds (mV)
-        self.thetae = 14
-        self.thetai = 14
-        self.thetad1 = 19
-        self.thetad2 = 19
-        self.thetap1 = 10
-        self.thetap2 = 9     #9 8 is DD
-        self.thetaST = 10    #10 9 is DD
-        self.thetas = 13
-        self.thetar = 13
-
         self.phie     = 0
         self.phie_dot = 1
-        self.Ve       = 2
-        self.Ve_dot   = 3
-        self.Vi       = 4
-        self.Vi_dot   = 5
-        self.Vd1      = 6
-        self.Vd1_dot  = 7
-        self.Vd2      = 8
-        self.Vd2_dot  = 9
-        self.Vp1      = 10
-        self.Vp1_dot  = 11
-        self.Vp2      = 12
-        self.Vp2_dot  = 13
-        self.VST      = 14
-        self.VST_dot  = 15
-        self.Vs       = 16
-        self.Vs_dot   = 17
-        self.Vr       = 18
-        self.Vr_dot   = 19
-
-        self.struct={'e'   :2,
-                     'i'   :4,
-                     'd1'  :6,
-                     'd2'  :8,
-                     'p1'  :10,
-                     'p2'  :12,
-                     'STN' :14,
-                     's'   :16,
-                     'r'   :18}
+
+        #State column of each population's potential (its derivative follows)
+        self.struct = self.spec.struct
+        for key in ('state_target', 'stim_target'):
+            if self.params[key] not in self.struct:
+                raise ValueError('{} {!r} is not a population of the model'.format(key, self.params[key]))
+
+        #Parkinsonian parameters of other models, with delays in steps
+        if self.spec is not BGTCS:
+            sets = self.spec.sets
+            if self.params['DD'] and 'DD' not in sets:
+                raise ValueError('the model has no DD parameter set')
+            DD = self.spec.resolve('DD', dt) if 'DD' in sets else {}
+            self.DD_PARAMS = {key: DD[key] for key in sets.get('DD', {})}
 
         #Set parkinsonian parameters
+        self._healthy = {key: getattr(self,key) for key in self.DD_PARAMS}
         if self.params['DD']:
-            self.vee = 1.4
-            self.vie = 1.4
-            self.vei = -1.6
-            self.vii = -1.6
-            self.vd1e = 0.5
-            self.vd2e = 1.4
-            self.vp2d2 = -0.5
-            self.vp2p2 = -0.07
-            self.thetap2 = 8 
-            self.thetaST = 9 
+            self._set_DD(True)
+
+    def _set_rates(self):
+        self.__dict__.update(rates(self.gammae, self.alpha, self.beta))
+
+    def _set_DD(self, DD):
+        # Parameters set by MFM.schedule keep their scheduled value
+        overrides = getattr(self, '_overrides', ())
+        for key,value in (self.DD_PARAMS if DD else self._healthy).items():
+            if key not in overrides:
+                setattr(self, key, value)
 
     def _set_DBS(self):
         if self.params['cDBS']:
-            self.cDBS = cDBS(dt       = self.params['dt'],
-                             f        = self.params['cDBS_f'],
-                             stim_amp = self.params['cDBS_amp'],
-                             width    = self.params['cDBS_width'],
-                             tstart   = self.params['stim_start'])
+            self.cDBS = self._new_cDBS(self.params['stim_start'])
         else:
             self.cDBS = None
             
@@ -297,82 +268,126 @@ class MFM(object):
                          ref_period = self.params['pDBS_ref_period'],
                          stim_amp   = self.params['pDBS_amp'],
                          width      = self.params['pDBS_width'],
-                         power_thr  = self.params['pDBS_power_thr'])
+                         power_thr  = self.params['pDBS_power_thr'],
+                         dtype      = self.cdtype)
+
+    def _new_cDBS(self, tstart):
+        return cDBS(dt       = self.params['dt'],
+                    f        = self.params['cDBS_f'],
+                    stim_amp = self.params['cDBS_amp'],
+                    width    = self.params['cDBS_width'],
+                    tstart   = tstart)
+
+    def schedule(self, t, **changes):
+        '''
+        Change options or model parameters at time t of the run.
+
+        Changes are applied at the start of the step at t (rounded to dt),
+        before the state at t+dt is computed.
+
+        Parameters
+        ----------
+        t : float (s)
+            Time of the change
+        **changes
+            New values of options in SCHEDULE_OPTIONS (DD toggles all of
+            DD_PARAMS; stimulation settings are passed to the cDBS/pDBS
+            objects) and of model attributes in SCHEDULE_MODEL (any
+            parameter of other models; delays in steps). A scheduled model
+            attribute keeps its value when DD is toggled later. cDBS switched
+            on fires its first pulse at t. cDBS takes precedence over pDBS, so
+            switch cDBS off when switching pDBS on.
+
+        Returns
+        -------
+        self
+
+        Examples
+        --------
+        >>> mfm = MFM(DD=False, tstop=40)
+        >>> mfm.schedule(10, DD=True).schedule(20, cDBS=True).schedule(30, cDBS=False, pDBS=True)
+        >>> mfm.run()
+        '''
+        model = SCHEDULE_MODEL if self.spec is BGTCS else self.spec.params
+        for key in changes:
+            if key not in SCHEDULE_OPTIONS and key not in model:
+                raise ValueError('{!r} cannot be scheduled'.format(key))
+        if self.i > int(round(t/self.params['dt'])):
+            raise ValueError('cannot schedule a change in the past (t={})'.format(t))
+
+        # Options in params hold the values in effect; keep the initial ones
+        initial = self.params.setdefault('initial', {})
+        for key in changes:
+            if key in self.params and key not in initial:
+                initial[key] = self.params[key]
+
+        events = self.params.setdefault('schedule', [])
+        events.append([float(t), dict(changes)])
+        events.sort(key=lambda event: event[0])
+        return self
+
+    def _apply(self, changes):
+        '''
+        Apply one set of scheduled changes.
+        '''
+        changes = dict(changes)
+        if 'DD' in changes:
+            self.params['DD'] = bool(changes.pop('DD'))
+            self._set_DD(self.params['DD'])
+
+        for key,value in changes.items():
+            if key in self.spec.params:
+                setattr(self, key, int(value) if key in self.spec.delays else value)
+                self.__dict__.setdefault('_overrides', set()).add(key)
+                continue
+
+            was_on = self.params['cDBS']
+            self.params[key] = type(self.params[key])(value)
+            if key == 'cDBS' and self.params['cDBS'] and not was_on:
+                self.cDBS = self._new_cDBS(0)
+            elif key in _STIM_ATTRS:
+                name, attr = _STIM_ATTRS[key]
+                if getattr(self, name) is not None:
+                    setattr(getattr(self, name), attr, self.params[key])
+        self._set_rates()
+        self._compile()
+        self._fill_history()
+
+    def _compile(self):
+        '''
+        Array form of the equations with the current parameter values,
+        stepped by advance.
+        '''
+        self._kernel = Kernel(self)
+
+    def _buffer(self, array, name, shape):
+        '''
+        Array given to record into, checked against the run, or a new one.
+        '''
+        if array is None:
+            return np.zeros(shape, dtype=self.dtype)
+        if array.shape != shape or array.dtype != self.dtype:
+            raise ValueError('{} must have shape {} and dtype {}'.format(name, shape, np.dtype(self.dtype)))
+        return array
+
+    def _fill_history(self):
+        '''
+        Set the rows that the delayed terms of the first steps read before
+        they are recorded (the last max(delay) rows of S), at x0 if given and
+        at zero otherwise. Rows set by an earlier call are kept, so a delay
+        lengthened during the run only adds rows.
+        '''
+        N, D = self.params['N'], int(self._kernel.delay.max())
+        filled = getattr(self, '_history', 0)
+        if D > filled and self.i < D:
+            self.S[max(N-D,0):max(N-filled,0)] = self.params.get('x0', 0)
+            self._history = D
 
     def advance(self):
-        def sigmoid(V,Q,theta):
-            return Q/(1+np.exp(-(V-theta)/3.8))
-
         i = self.i
-        
-        dSdt = np.zeros(20)
-
-        dSdt[self.phie]= self.S[i,self.phie_dot]
-        dSdt[self.phie_dot] = self.gammasq*(sigmoid(self.S[i,self.Ve], self.Qe, self.thetae)-\
-                                            self.S[i,self.phie])-2*self.gammae*self.S[i,self.phie_dot]
-
-        dSdt[self.Ve] = self.S[i,self.Ve_dot]
-        dSdt[self.Ve_dot] = self.alphagamma*(self.vee*self.S[i,self.phie]+\
-                                             self.vei*sigmoid(self.S[i,self.Vi],self.Qi, self.thetai)+\
-                                             self.ves*sigmoid(self.S[i-self.taues,self.Vs], self.Qs, self.thetas)-\
-                                             self.S[i,self.Ve])-\
-                            self.aPb*self.S[i,self.Ve_dot]
-
-        dSdt[self.Vi] = self.S[i,self.Vi_dot]
-        dSdt[self.Vi_dot] = self.alphagamma*(self.vii*sigmoid(self.S[i,self.Vi], self.Qi, self.thetai)+\
-                                             self.vie*self.S[i,self.phie]+\
-                                             self.vis*sigmoid(self.S[i-self.tauis,self.Vs], self.Qs, self.thetas)-\
-                                             self.S[i,self.Vi])-\
-                            self.aPb*self.S[i,self.Vi_dot]
-
-        dSdt[self.Vd1] = self.S[i,self.Vd1_dot]
-        dSdt[self.Vd1_dot] = self.alphabeta*(self.vd1e*self.S[i-self.taud1e,self.phie]+\
-                                             self.vd1s*sigmoid(self.S[i-self.taud1s,self.Vs], self.Qs, self.thetas)+\
-                                             self.vd1d1*sigmoid(self.S[i,self.Vd1], self.Qd1, self.thetad1)-\
-                                             self.S[i,self.Vd1])-\
-                            self.aPb*self.S[i,self.Vd1_dot] #Add in SNc
-
-        dSdt[self.Vd2] = self.S[i,self.Vd2_dot]
-        dSdt[self.Vd2_dot] = self.alphabeta*(self.vd2e*self.S[i-self.taud2e, self.Ve]+\
-                                             self.vd2d1*sigmoid(self.S[i-self.taud2d1,self.Vd1], self.Qd1, self.thetad1)+\
-                                             self.vd2s*sigmoid(self.S[i-self.taud2s,self.Vs], self.Qs, self.thetas)+\
-                                             self.vd2d2*sigmoid(self.S[i,self.Vd2], self.Qd2, self.thetad2)-\
-                                             self.S[i,self.Vd2])-\
-                            self.aPb*self.S[i,self.Vd2_dot] #Add in the SNc
-
-        dSdt[self.Vp1] = self.S[i,self.Vp1_dot]
-        dSdt[self.Vp1_dot] = self.alphabeta*(self.vp1d1*sigmoid(self.S[i-self.taup1d1,self.Vd1], self.Qd1, self.thetad1)+\
-                                             self.vp1p2*sigmoid(self.S[i-self.taup1p2,self.Vp2], self.Qp2, self.thetap2)+\
-                                             self.vp1ST*sigmoid(self.S[i-self.taup1ST,self.VST], self.QST, self.thetaST)-\
-                                             self.S[i,self.Vp1])-\
-                            self.aPb*self.S[i,self.Vp1_dot]
-
-        dSdt[self.Vp2] = self.S[i,self.Vp2_dot]
-        dSdt[self.Vp2_dot] = self.alphabeta*(self.vp2d2*sigmoid(self.S[i-self.taup2d2,self.Vd2], self.Qd2, self.thetad2)+\
-                                             self.vp2p2*sigmoid(self.S[i,self.Vp2], self.Qp2, self.thetap2)+\
-                                             self.vp2ST*sigmoid(self.S[i-self.taup2ST,self.VST], self.QST, self.thetaST)-\
-                                             self.S[i,self.Vp2])-\
-                            self.aPb*self.S[i,self.Vp2_dot]
-
-        dSdt[self.VST] = self.S[i,self.VST_dot]
-        dSdt[self.VST_dot] = self.alphabeta*(self.vSTp2*sigmoid(self.S[i-self.tauSTp2,self.Vp2], self.Qp2, self.thetap2)+\
-                                             self.vSTe*self.S[i-self.tauSTe,self.phie]-\
-                                             self.S[i,self.VST])-\
-                            self.aPb*self.S[i,self.VST_dot]
-
-        dSdt[self.Vs] = self.S[i,self.Vs_dot]
-        dSdt[self.Vs_dot] = self.alphabeta*(self.vsp1*sigmoid(self.S[i-self.tausp1,self.Vp1], self.Qp1, self.thetap1)+\
-                                            self.vse*self.S[i-self.tause,self.phie]+\
-                                            self.vsr*sigmoid(self.S[i-self.tausr,self.Vr], self.Qr, self.thetar)+\
-                                            self.phin-\
-                                            self.S[i,self.Vs])-\
-                            self.aPb*self.S[i,self.Vs_dot]
-
-        dSdt[self.Vr] = self.S[i,self.Vr_dot]
-        dSdt[self.Vr_dot] = self.alphabeta*(self.vre*self.S[i-self.taure,self.phie]+\
-                                            self.vrs*sigmoid(self.S[i-self.taurs,self.Vs], self.Qs, self.thetas)-\
-                                            self.S[i,self.Vr])-\
-                            self.aPb*self.S[i,self.Vr_dot]
+        k = self._kernel
+
+        dSdt = k.rhs(self.S[i], self.S[i-k.delay,k.pre])
 
         #DBS
         #====================================================================================
@@ -382,7 +397,7 @@ class MFM(object):
             if cDBS_C != 0: self.memory['stim'][i+1] = cDBS_C
             
         else:
-            pDBS_C = self.pDBS.advance(self.S[i,self.struct[self.params['state_target']]])
+            pDBS_C = self.pDBS.step(float(self.S[i,self.struct[self.params['state_target']]]))
             if self.params['pDBS']:
                 self.S[i,self.struct[self.params['stim_target']]] += pDBS_C/self.params['Cm']
                 if pDBS_C != 0: self.memory['stim'][i+1] = pDBS_C
@@ -396,23 +411,8 @@ class MFM(object):
         
         #Noise
         #====================================================================================
-        self.S[i+1,self.Ve] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qe*(1-sigmoid(self.S[i+1,self.Ve], 1, self.thetae))*sigmoid(self.S[i,self.Ve], 1, self.thetae)
-
-        self.S[i+1,self.Vi] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qi*(1-sigmoid(self.S[i+1,self.Vi], 1, self.thetai))*sigmoid(self.S[i,self.Vi], 1, self.thetai)
-
-        self.S[i+1,self.Vd1] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qd1*(1-sigmoid(self.S[i+1,self.Vd1], 1, self.thetad1))*sigmoid(self.S[i,self.Vd1], 1, self.thetad1)
-        
-        self.S[i+1,self.Vd2] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qd2*(1-sigmoid(self.S[i+1,self.Vd2], 1, self.thetad2))*sigmoid(self.S[i,self.Vd2], 1, self.thetad2)
-        
-        self.S[i+1,self.Vp1] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qp1*(1-sigmoid(self.S[i+1,self.Vp1], 1, self.thetap1))*sigmoid(self.S[i,self.Vp1], 1, self.thetap1)
-        
-        self.S[i+1,self.Vp2] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qp2*(1-sigmoid(self.S[i+1,self.Vp2], 1, self.thetap2))*sigmoid(self.S[i,self.Vp2], 1, self.thetap2)
-        
-        self.S[i+1,self.VST] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.QST*(1-sigmoid(self.S[i+1,self.VST], 1, self.thetaST))*sigmoid(self.S[i,self.VST], 1, self.thetaST)
-        
-        self.S[i+1,self.Vs] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qs*(1-sigmoid(self.S[i+1,self.Vs], 1, self.thetas))*sigmoid(self.S[i,self.Vs], 1, self.thetas)
-        
-        self.S[i+1,self.Vr] += self.noiseAmp*np.random.normal(0,1)*np.sqrt(self.params['dt'])*self.Qr*(1-sigmoid(self.S[i+1,self.Vr], 1, self.thetar))*sigmoid(self.S[i,self.Vr], 1, self.thetar)
+        V0, V1 = self.S[i,k.col], self.S[i+1,k.col]
+        self.S[i+1,k.col] += k.noiseAmp*self._normal(0,1,len(k.col))*np.sqrt(self.params['dt'])*k.Q*(1-sigmoid(V1,1,k.theta))*sigmoid(V0,1,k.theta)
 
         self.i += 1
 
@@ -420,30 +420,72 @@ class MFM(object):
         #if self.params['verbose']: self.progbar = ProgressBar()
         if self.params['verbose']: self.progbar = progbar()
 
+        metric = self.params['stop_metric']
+        window = int(round(self.params['stop_window']/self.params['dt']))
+        burn   = int(round(self.params['stop_burn']/self.params['dt']))
+        values = []
+        self.stop = {'reason' : 'tstop'}
+
+        # Parameters may have been changed since the last compile
+        self._compile()
+        self._fill_history()
+
+        dt = self.params['dt']
+        events = [(int(round(t/dt)), changes) for t,changes in self.params.get('schedule', [])
+                  if int(round(t/dt)) >= self.i]
+
         while self.i < self.params['N'] - 1:
+            while events and events[0][0] <= self.i:
+                self._apply(events.pop(0)[1])
             self.advance()
 
             #if self.params['verbose']: self.progbar.display(float(self.i)/(self.params['N']-2))
             if self.params['verbose']: self.progbar.update(float(self.i)/(self.params['N']-2))
+
+            if metric != 'none' and self.i > burn and (self.i - burn) % window == 0:
+                values.append(self._stop_metric(self.i - window + 1, self.i + 1))
+                self.stop['mean'] = np.mean(values)
+                self.stop['ci'] = 1.96*np.std(values, ddof=1)/np.sqrt(len(values)) if len(values) > 1 else np.inf
+                if len(values) >= self.params['stop_min'] and self.stop['ci'] < self.params['stop_tol']:
+                    self.stop['reason'] = 'converged'
+                    break
         if self.params['verbose']: print()
-        
+
+        self.stop['t'] = self.i * self.params['dt']
+        self.stop['windows'] = len(values)
+        if self.i < self.params['N'] - 1:
+            # Stopped early: keep a copy of the used part, so that the
+            # full-length buffers are freed (given arrays are only sliced)
+            self.params['N'] = self.i + 1
+            copy = np.copy if self._own_buffers else lambda a: a
+            self.S = copy(self.S[:self.params['N']])
+            for key in self.memory:
+                self.memory[key] = copy(self.memory[key][:self.params['N']])
+
+    def _stop_metric(self, start, stop):
+        '''
+        Early stopping metric over samples [start, stop).
+        '''
+        if self.params['stop_metric'] == 'beta_power':
+            from metrics import beta_peak
+            x = self.S[start:stop,self.struct[self.params['state_target']]]
+            return beta_peak(x, self.params['fs'])[1]
+        else:
+            return np.count_nonzero(self.memory['stim'][start:stop]) / ((stop-start)*self.params['dt'])
+
     def save(self,fname=None):
         if fname == None:
             if not os.path.isdir('data'):
                 os.makedirs('data')
             if self.params['RunID'] == -1:
                 try:
-                    ls = os.listdir('data')
+                    taken = set()
+                    for fname in os.listdir('data'):
+                        try: taken.add(int(fname.split('.')[0]))
+                        except: pass
                     lowest_empty = 0
-                    found_empty = False
-                    while not found_empty:
-                        found_empty = True
-                        for fname in ls:
-                            try: fnum = int(fname[:3])
-                            except: fnum = -1
-                            if fnum == lowest_empty:
-                                lowest_empty += 1
-                                found_empty = False
+                    while lowest_empty in taken:
+                        lowest_empty += 1
                     self.params['RunID'] = lowest_empty
                 except:
                     self.params['RunID'] = 0
@@ -457,31 +499,35 @@ class MFM(object):
         
     def plot(self,PSD_seg=0.5):
         from scipy import signal
-        import matplotlib as mpl
         import matplotlib.pyplot as plt
+        from utils import DecimatedLine, StimMarkers
 
-        t = np.arange(self.params['N']) * self.params['dt']
+        dt = self.params['dt']
+        N  = self.params['N']
+        state = self.S[:N,self.struct[self.params['state_target']]]
+        stim  = self.S[:N,self.struct[self.params['stim_target']]]
 
-        x = self.S[:,self.struct[self.params['state_target']]][int(self.i * PSD_seg):]
-        f,Pxx = signal.welch(self.S[:,self.struct[self.params['state_target']]],1/self.params['dt'],nperseg=2048)
+        f,Pxx = signal.welch(state,1/dt,nperseg=2048)
         Pxx = 10*np.log10(Pxx)
 
-        
-        
         fig,ax = plt.subplots()
         ax.plot(f[f<100],Pxx[f<100])
         ax.set_ylabel('PSD (dB/Hz)')
         ax.set_xlabel('Frequency (Hz)')
         plt.tight_layout()
         
-        #if self.params['pDBS']:
+        # Long runs are drawn as min/max envelopes of the visible range, which
+        # are recomputed on zoom
         fig,ax = plt.subplots(4,1,sharex=True)
-        ax[0].plot(t,self.S[:,self.struct[self.params['state_target']]],label='state')
-        ax[0].plot(t,self.S[:,self.struct[self.params['stim_target']]], label='stim')
-        ax[1].plot(t,self.memory['amp'])   #self.pDBS.mem['amp'])
-        ax[2].plot(t,self.memory['phase']) #self.pDBS.mem['phase'])
-        ax[3].vlines(t[self.memory['stim'] > 0], 0, 1)
-        #ax[3].plot(t,self.memory['stim'])  #self.pDBS.mem['stim'])
+        # Keep the decimators alive with the figure (callbacks hold weak references)
+        fig.decimators = [
+            DecimatedLine(ax[0], state, dt, label='state'),
+            DecimatedLine(ax[0], stim, dt, label='stim'),
+            DecimatedLine(ax[1], self.memory['amp'][:N], dt),
+            DecimatedLine(ax[2], self.memory['phase'][:N], dt),
+            StimMarkers(ax[3], np.flatnonzero(self.memory['stim'][:N] > 0), dt, N),
+        ]
+        ax[0].set_xlim(0, N*dt)
 
         ax[0].legend()
         ax[0].set_ylabel('V')
@@ -496,22 +542,41 @@ class MFM(object):
     @property
     def options(self):
         return self._options
-def main():
-    def parse_kwargs(kwargs):
-        args = {}
-        for arg in kwargs:
-            key,value = arg.split('=')
-            if value.lower() == 'false': value = False
-            elif value.lower() == 'true' : value = True
-            else:
-                try: value = int(value)
+
+    @property
+    def dtype(self):
+        '''Real dtype of the state and recordings'''
+        return np.float32 if self.params.get('precision') == 'single' else np.float64
+
+    @property
+    def cdtype(self):
+        '''Complex dtype of the SWIFT state'''
+        return np.complex64 if self.params.get('precision') == 'single' else np.complex128
+
+    @property
+    def swift(self):
+        '''SWIFT transform (swift.aswift) of the state target, as tracked by pDBS'''
+        return self.pDBS.aswift
+
+def parse_kwargs(kwargs):
+    '''Parse a list of <key>=<value> strings into a dict of options'''
+    args = {}
+    for arg in kwargs:
+        key,value = arg.split('=')
+        if value.lower() == 'false': value = False
+        elif value.lower() == 'true' : value = True
+        else:
+            try: value = int(value)
+            except:
+                try: value = float(value)
                 except:
-                    try: value = float(value)
-                    except:
-                        pass
-            args[key] = value
-        return args
+                    pass
+        args[key] = value
+    return args
 
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
 
     args = docopt(__doc__)
     if args['--list']:
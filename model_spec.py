@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+
+'''
+Declarative description of mean field models.
+
+A ModelSpec lists the populations, the connections between them and the
+values of every parameter, plus named parameter sets (e.g. 'DD') that
+override some of the values. It is validated on construction and compiled
+into the array form (kernel.Kernel) that MFM, Network and the analysis tools
+step, so a variant of the model is a few lines of data rather than an edit of
+the equations.
+
+BGTCS is the default model of MFM; its 'model' option takes a saved spec.
+
+Usage:
+  model_spec [options] [<spec>]
+
+<spec> is a JSON file written by ModelSpec.save (default: BGTCS).
+
+Options:
+  -s --set NAME    Parameter set to show [default: healthy]
+  -h --help        Show this screen
+'''
+
+import json
+
+# Rate constants of the populations: cortical (alpha*gammae) and subcortical (alpha*beta)
+RATES = ['alphagamma', 'alphabeta']
+
+def rates(gammae, alpha, beta):
+    '''Derived rate constants (the attributes set by MFM._set_rates)'''
+    # gammae^2 is a bitwise xor (127 for gammae=125), as in the original MFM.
+    # It is kept so that results do not change.
+    return {'gammasq'    : gammae^2,
+            'alphabeta'  : alpha*beta,
+            'aPb'        : alpha+beta,
+            'alphagamma' : alpha*gammae}
+
+class ModelSpec(object):
+    '''
+    Mean field model description.
+
+    Parameters
+    ----------
+    populations : list of tuple
+        (name, Q parameter, theta parameter, rate) in state order. rate is
+        'alphagamma' (cortical) or 'alphabeta'. The state has phie and its
+        derivative in columns 0/1, then the potential and its derivative of
+        each population.
+    edges : list of tuple
+        (post, pre, weight parameter, delay parameter or None). pre is a
+        population (entering through its sigmoid), 'phie' (the cortical wave
+        field) or 'V' + a population name (its raw potential).
+    params : dict
+        Value of every parameter: the Q, theta, weight and delay (s)
+        parameters, gammae, alpha, beta, noiseAmp and the constant inputs
+    inputs : dict, optional
+        Constant input parameter of some populations, e.g. {'s': 'phin'}
+    sets : dict, optional
+        Named parameter sets, each a dict of values overriding params. A
+        'healthy' set with no overrides is always defined.
+    wave : str
+        Population whose firing drives phie
+    name : str
+
+    Examples
+    --------
+    >>> kernel = BGTCS.compile('DD')
+    >>> variant = BGTCS.variant('no hyperdirect', params={'vSTe': 0})
+    >>> variant.compile('DD', noiseAmp=0.05)
+    '''
+    GLOBAL = ['gammae', 'alpha', 'beta', 'noiseAmp']
+
+    def __init__(self, populations, edges, params, inputs=None, sets=None, wave='e', name=''):
+        self.populations = [tuple(p) for p in populations]
+        self.edges = [(e[0], e[1], e[2], e[3] if len(e) > 3 else None) for e in edges]
+        self.params = dict(params)
+        self.inputs = dict(inputs or {})
+        self.sets = {'healthy': {}}
+        self.sets.update({key: dict(value) for key,value in (sets or {}).items()})
+        self.wave = wave
+        self.name = name
+        self.validate()
+
+    def __str__(self):
+        return '{} ({} populations, {} edges, sets: {})'.format(
+            self.name or 'model', len(self.populations), len(self.edges), ', '.join(sorted(self.sets)))
+
+    @property
+    def names(self):
+        return [p[0] for p in self.populations]
+
+    @property
+    def delays(self):
+        '''Delay parameters'''
+        return [e[3] for e in self.edges if e[3]]
+
+    @property
+    def struct(self):
+        '''State column of each population's potential'''
+        return {name: 2 + 2*k for k,name in enumerate(self.names)}
+
+    @property
+    def nstate(self):
+        return 2 + 2*len(self.populations)
+
+    def validate(self):
+        '''Raise ValueError if the description is inconsistent'''
+        names = self.names
+        if len(set(names)) != len(names):
+            raise ValueError('duplicate population names')
+        if self.wave not in names:
+            raise ValueError('wave population {!r} is not a population'.format(self.wave))
+
+        used = list(self.GLOBAL)
+        for name,Q,theta,rate in self.populations:
+            if rate not in RATES:
+                raise ValueError('rate of {!r} must be one of {}'.format(name, RATES))
+            used += [Q, theta]
+        for post,pre,weight,delay in self.edges:
+            if post not in names:
+                raise ValueError('edge {!r}: unknown post population {!r}'.format(weight, post))
+            if pre != 'phie' and pre not in names and not (pre[:1] == 'V' and pre[1:] in names):
+                raise ValueError('edge {!r}: unknown pre population {!r}'.format(weight, pre))
+            used += [weight] + ([delay] if delay else [])
+        for post,value in self.inputs.items():
+            if post not in names:
+                raise ValueError('input {!r}: unknown population {!r}'.format(value, post))
+            used.append(value)
+
+        missing = [key for key in used if key not in self.params]
+        if missing:
+            raise ValueError('missing parameters: {}'.format(', '.join(missing)))
+        for key in used:
+            if not isinstance(self.params[key], (int, float)) or isinstance(self.params[key], bool):
+                raise ValueError('parameter {!r} must be a number'.format(key))
+        for delay in self.delays:
+            if self.params[delay] < 0:
+                raise ValueError('delay {!r} is negative'.format(delay))
+        for name,Q,theta,rate in self.populations:
+            if self.params[Q] <= 0:
+                raise ValueError('maximum firing rate {!r} must be positive'.format(Q))
+        for set_name,overrides in self.sets.items():
+            unknown = [key for key in overrides if key not in self.params]
+            if unknown:
+                raise ValueError('set {!r}: unknown parameters {}'.format(set_name, ', '.join(unknown)))
+
+    def values(self, set='healthy', **overrides):
+        '''Parameter values of a named set, with optional further overrides'''
+        if set not in self.sets:
+            raise KeyError('unknown parameter set {!r}'.format(set))
+        values = dict(self.params)
+        values.update(self.sets[set])
+        for key,value in overrides.items():
+            if key not in values:
+                raise KeyError('unknown parameter {!r}'.format(key))
+            values[key] = value
+        return values
+
+    def resolve(self, set='healthy', dt=1e-3, **overrides):
+        '''
+        Parameter values as the simulation uses them: delays in steps of dt
+        and the derived rate constants added.
+        '''
+        values = self.values(set, **overrides)
+        for delay in self.delays:
+            values[delay] = int(values[delay]/dt)
+        values.update(rates(values['gammae'], values['alpha'], values['beta']))
+        return values
+
+    def compile(self, set='healthy', dt=1e-3, **overrides):
+        '''
+        Array form of the model.
+
+        Parameters
+        ----------
+        set : str
+            Parameter set
+        dt : float (s)
+            Time step (delays are rounded down to whole steps)
+        **overrides
+            Further parameter values
+
+        Returns
+        -------
+        kernel : kernel.Kernel
+        '''
+        from kernel import Kernel
+        return Kernel.compile(self, self.resolve(set, dt, **overrides), dt)
+
+    def variant(self, name=None, params=None, edges=(), remove=(), sets=None):
+        '''
+        Modified copy.
+
+        Parameters
+        ----------
+        name : str, optional
+        params : dict, optional
+            New parameter values (and the values of new parameters)
+        edges : list of tuple
+            Edges to add
+        remove : list of str
+            Weight parameters of edges to remove
+        sets : dict, optional
+            Parameter sets to add or replace
+        '''
+        return ModelSpec(populations=self.populations,
+                         edges=[e for e in self.edges if e[2] not in remove] + list(edges),
+                         params=dict(self.params, **(params or {})),
+                         inputs=self.inputs,
+                         sets=dict(self.sets, **(sets or {})),
+                         wave=self.wave,
+                         name=self.name if name is None else name)
+
+    def to_dict(self):
+        return {'name': self.name, 'wave': self.wave, 'populations': self.populations, 'edges': self.edges,
+                'params': self.params, 'inputs': self.inputs, 'sets': self.sets}
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname) as f:
+            return cls(**json.load(f))
+
+BGTCS = ModelSpec(
+    name = 'BGTCS',
+
+    # (name, Q, theta, rate) in state order
+    populations = [('e',   'Qe',  'thetae',  'alphagamma'),
+                   ('i',   'Qi',  'thetai',  'alphagamma'),
+                   ('d1',  'Qd1', 'thetad1', 'alphabeta'),
+                   ('d2',  'Qd2', 'thetad2', 'alphabeta'),
+                   ('p1',  'Qp1', 'thetap1', 'alphabeta'),
+                   ('p2',  'Qp2', 'thetap2', 'alphabeta'),
+                   ('STN', 'QST', 'thetaST', 'alphabeta'),
+                   ('s',   'Qs',  'thetas',  'alphabeta'),
+                   ('r',   'Qr',  'thetar',  'alphabeta')],
+
+    # (post, pre, weight, delay), in the order MFM.advance sums them
+    edges = [('e',   'phie', 'vee',   None),
+             ('e',   'i',    'vei',   None),
+             ('e',   's',    'ves',   'taues'),
+             ('i',   'i',    'vii',   None),
+             ('i',   'phie', 'vie',   None),
+             ('i',   's',    'vis',   'tauis'),
+             ('d1',  'phie', 'vd1e',  'taud1e'),
+             ('d1',  's',    'vd1s',  'taud1s'),
+             ('d1',  'd1',   'vd1d1', None),
+             ('d2',  'Ve',   'vd2e',  'taud2e'),
+             ('d2',  'd1',   'vd2d1', 'taud2d1'),
+             ('d2',  's',    'vd2s',  'taud2s'),
+             ('d2',  'd2',   'vd2d2', None),
+             ('p1',  'd1',   'vp1d1', 'taup1d1'),
+             ('p1',  'p2',   'vp1p2', 'taup1p2'),
+             ('p1',  'STN',  'vp1ST', 'taup1ST'),
+             ('p2',  'd2',   'vp2d2', 'taup2d2'),
+             ('p2',  'p2',   'vp2p2', None),
+             ('p2',  'STN',  'vp2ST', 'taup2ST'),
+             ('STN', 'p2',   'vSTp2', 'tauSTp2'),
+             ('STN', 'phie', 'vSTe',  'tauSTe'),
+             ('s',   'p1',   'vsp1',  'tausp1'),
+             ('s',   'phie', 'vse',   'tause'),
+             ('s',   'r',    'vsr',   'tausr'),
+             ('r',   'phie', 'vre',   'taure'),
+             ('r',   's',    'vrs',   'taurs')],
+
+    inputs = {'s': 'phin'},
+
+    params = {
+        'phin'     : 15,
+        'noiseAmp' : 0.03,
+        'gammae'   : 125,       # s^-1
+        'alpha'    : 160,       # s^-1
+        'beta'     : 640,       # s^-1
+
+        #Axonal delays (s): from second to first (1st population type is postsynaptic)
+        'taues'   : 0.035,
+        'tauis'   : 0.035,
+        'taud1e'  : 0.002,
+        'taud2e'  : 0.002,
+        'taud1s'  : 0.002,
+        'taud2s'  : 0.002,
+        'taup1d1' : 0.001,
+        'taup1p2' : 0.001,
+        'taup1ST' : 0.001,
+        'taup2d2' : 0.001,
+        'taup2ST' : 0.001,
+        'tauSTe'  : 0.001,
+        'tauSTp2' : 0.001,
+        'tause'   : 0.050,
+        'taure'   : 0.050,
+        'tausp1'  : 0.003,
+        'tausr'   : 0.002,
+        'taurs'   : 0.002,
+        'taud2d1' : 0.001,
+
+        #Connection strengths (mVs)
+        'vee'   :  1.6,
+        'vie'   :  1.6,
+        'vei'   : -1.9,
+        'vii'   : -1.9,
+        'ves'   :  0.4,
+        'vis'   :  0.4,
+        'vd1e'  :  1.0,
+        'vd1d1' : -0.3,
+        'vd1s'  :  0.1,
+        'vd2e'  :  0.7,
+        'vd2d2' : -0.3,
+        'vd2s'  :  0.05,
+        'vp1d1' : -0.1,
+        'vp1p2' : -0.03,
+        'vp1ST' :  0.3,
+        'vp2d2' : -0.3,
+        'vp2p2' : -0.1,
+        'vp2ST' :  0.3,
+        'vSTe'  :  0.1,
+        'vSTp2' : -0.04,
+        'vse'   :  0.8,
+        'vsp1'  : -0.03,
+        'vsr'   : -0.4,
+        'vre'   :  0.15,
+        'vrs'   :  0.03,
+        'vd2d1' :  0,
+
+        #Maximum firing rates (s^-1)
+        'Qe'  : 300,
+        'Qi'  : 300,
+        'Qd1' : 65,
+        'Qd2' : 65,
+        'Qp1' : 250,
+        'Qp2' : 300,
+        'QST' : 500,
+        'Qs'  : 300,
+        'Qr'  : 500,
+
+        #Firing thresholds (mV)
+        'thetae'  : 14,
+        'thetai'  : 14,
+        'thetad1' : 19,
+        'thetad2' : 19,
+        'thetap1' : 10,
+        'thetap2' : 9,
+        'thetaST' : 10,
+        'thetas'  : 13,
+        'thetar'  : 13},
+
+    #Parkinsonian (dopamine depleted) parameters
+    sets = {'DD': {'vee'     :  1.4,
+                   'vie'     :  1.4,
+                   'vei'     : -1.6,
+                   'vii'     : -1.6,
+                   'vd1e'    :  0.5,
+                   'vd2e'    :  1.4,
+                   'vp2d2'   : -0.5,
+                   'vp2p2'   : -0.07,
+                   'thetap2' :  8,
+                   'thetaST' :  9}})
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+
+    args = docopt(__doc__)
+    spec = ModelSpec.load(args['<spec>']) if args['<spec>'] else BGTCS
+    values = spec.values(args['--set'])
+    print(spec)
+    print()
+    print(tabulate([(name, values[Q], values[theta], rate, values.get(spec.inputs.get(name), ''))
+                    for name,Q,theta,rate in spec.populations],
+                   headers=['Population', 'Q (1/s)', 'theta (mV)', 'Rate', 'Input']))
+    print()
+    print(tabulate([(post, pre, values[weight], 1e3*values[delay] if delay else 0)
+                    for post,pre,weight,delay in spec.edges],
+                   headers=['Post', 'Pre', 'Weight (mVs)', 'Delay (ms)']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+'''
+Networks of coupled BGTCS loops.
+
+Every node is one MFM state vector. All nodes are advanced together with array
+operations over a ring buffer of the recent history, inter-node coupling is
+given as sparse matrices with delays, and each node has its own cDBS/pDBS
+controller and SWIFT tracking. Only the selected channels are recorded, so the
+cost and memory of a run grow linearly with the number of nodes.
+
+A network of one uncoupled node reproduces the state and stimulation times of
+MFM bit for bit with the same seed. Its vectorised SWIFT tracking rounds
+differently from the scalar pDBS.step, so amp and phase agree to rounding.
+
+Usage:
+  network [options] [<key>=<value>]...
+
+Options:
+  -n --nodes N        Number of nodes [default: 2]
+  -w --weight W       Strength of the cortical (phie -> e) coupling between
+                      all pairs of nodes (mVs) [default: 0.05]
+  -d --delay D        Delay of the coupling (s) [default: 0.01]
+  -m --model PATH     Model specification (JSON, see model_spec.py)
+  -h --help           Show this screen
+'''
+
+import numpy as np
+
+from mfm import MFM
+from kernel import Kernel, POPULATIONS, sigmoid
+from utils import progbar
+
+# Options that must be the same on every node
+SHARED = ['dt', 'tstop', 'seed', 'precision', 'verbose', 'state_target', 'stim_target']
+
+def _columns(struct):
+    '''State column of each recordable state channel'''
+    columns = {'phie': 0, 'phie_dot': 1}
+    for name,col in struct.items():
+        columns[name] = col
+        columns[name + '_dot'] = col + 1
+    return columns
+
+class Network(object):
+    '''
+    Network of BGTCS loops.
+
+    Parameters
+    ----------
+    nodes : int or list of dict
+        Number of identical nodes, or the MFM options of each node (e.g.
+        different DD, cDBS or pDBS settings). Options in SHARED are taken from
+        kwargs only.
+    coupling : list of tuple, optional
+        Inter-node connections (post, pre, W, delay). W is an (n,n) array or
+        scipy.sparse matrix, W[j,k] the strength (mVs) of the input from node
+        k to population post of node j. pre is 'phie' or 'Ve' (entering
+        linearly) or a population name (entering through its sigmoid), and
+        delay is in s.
+    record : list of str, optional
+        Channels to record: state channels ('phie', 'p1', 'STN_dot', ...) and
+        'amp', 'phase', 'stim'. Defaults to state_target and stim.
+    x0 : array_like (nstate,) or (n,nstate), optional
+        Initial state, also filling the delay history (defaults to the MFM
+        initial condition with a zero history, or zero for models with other
+        populations)
+    common_noise : bool
+        Drive every node with the same noise realization
+    model : model_spec.ModelSpec, optional
+        Model of the nodes (defaults to MFM's). Each node uses the model's
+        'DD' or 'healthy' parameter set according to its DD option.
+    **kwargs
+        MFM options shared by all nodes
+
+    Attributes
+    ----------
+    record : dict of numpy.array (N,n)
+        Recorded channels, after run()
+
+    Examples
+    --------
+    >>> W = scipy.sparse.csr_matrix([[0, 0.05], [0.05, 0]])
+    >>> net = Network(2, coupling=[('e', 'phie', W, 0.01)], tstop=10)
+    >>> net.run().record['p1'].shape
+    (10000, 2)
+    '''
+    def __init__(self, nodes, coupling=(), record=None, x0=None, common_noise=False, model=None, **kwargs):
+        from scipy import sparse
+
+        if isinstance(nodes, int):
+            nodes = [{}]*nodes
+        shared = {key: kwargs[key] for key in SHARED if key in kwargs}
+        options = []
+        for node in nodes:
+            o = dict(kwargs)
+            o.update({key: value for key,value in node.items() if key not in SHARED})
+            o.update(shared)
+            options.append(o)
+
+        for o in [kwargs] + list(nodes):
+            if 'schedule' in o or o.get('precision', 'double') != 'double':
+                raise ValueError('networks run in double precision without schedules')
+
+        # Parameters of each distinct node configuration (single sample
+        # shells). The targets are checked against the network's model below.
+        targets = ('state_target', 'stim_target')
+        shells, models = {}, []
+        for o in options:
+            o = {key: value for key,value in o.items() if key not in targets}
+            key = repr(sorted(o.items()))
+            if key not in shells:
+                shells[key] = MFM(**dict(o, tstop=o.get('dt', 1e-3), verbose=False))
+            models.append(shells[key])
+        template = models[0]
+
+        self.params = dict(template.params)
+        self.params.update({key: shared[key] for key in targets if key in shared})
+        self.params['tstop'] = kwargs.get('tstop', template.options['tstop'])
+        self.params['verbose'] = kwargs.get('verbose', True)
+        self.params['N'] = int(np.ceil(self.params['tstop']/self.params['dt']))
+        self.node_options = options
+        self.n = len(options)
+        self.common_noise = common_noise
+
+        dt = self.params['dt']
+        if model is None:
+            kernels = [Kernel(m) for m in models]
+        else:
+            kernels = [model.compile('DD' if m.params['DD'] else 'healthy', dt) for m in models]
+        self.kernel = Kernel.stack(kernels)
+        self.struct = self.kernel.spec.struct
+
+        # Coupling, as (post population, pre column, sigmoid, pre Q, pre theta, W, delay)
+        self.coupling = []
+        names = self.kernel.names
+        columns = {'phie': 0}
+        columns.update(self.struct)
+        columns.update({'V' + name: col for name,col in self.struct.items()})
+        for key in targets:
+            if self.params[key] not in self.struct:
+                raise ValueError('{} {!r} is not a population of the model'.format(key, self.params[key]))
+        for post,pre,W,delay in coupling:
+            if post not in names:
+                raise ValueError('coupling target {!r} is not a population of the model'.format(post))
+            if pre not in columns:
+                raise ValueError('coupling source {!r} is not a state of the model'.format(pre))
+            W = sparse.csr_matrix(W)
+            if W.shape != (self.n,self.n):
+                raise ValueError('coupling matrices must be {0}x{0}'.format(self.n))
+            sig = pre in names
+            p = names.index(pre) if sig else 0
+            self.coupling.append((names.index(post), columns[pre], sig,
+                                  self.kernel.Q[:,p], self.kernel.theta[:,p], W, int(round(delay/dt))))
+
+        delays = [self.kernel.max_delay] + [c[-1] for c in self.coupling]
+        self._L = max(delays) + 1
+
+        # State history ring buffer
+        self._H = np.zeros((self._L,self.n,self.kernel.nstate))
+        if x0 is not None:
+            self._H[:] = x0
+        elif self.kernel.names == [p[0] for p in POPULATIONS]:
+            self._H[0] = template.S[0]
+
+        # Stimulation, per node
+        p = lambda key: np.array([m.params[key] for m in models], dtype=float)
+        self._cDBS      = p('cDBS').astype(bool)
+        self._pDBS      = p('pDBS').astype(bool)
+        self._Cm        = p('Cm')
+        self._c_charge  = np.maximum(0, p('cDBS_amp')*p('cDBS_width')*1e-6)
+        self._c_steps   = np.round(1./p('cDBS_f')/dt).astype(int)
+        self._c_count   = self._c_steps.copy()
+        self._c_start   = p('stim_start')/dt
+        self._c_i       = np.zeros(self.n)
+        self._p_charge  = np.maximum(0, p('pDBS_amp')*p('pDBS_width')*1e-6)
+        self._p_phase   = p('pDBS_phase')
+        self._p_power   = p('pDBS_power_thr')
+        self._n_ref     = 1/(p('swift_f')*dt) * p('pDBS_ref_period')
+        self._i_ref     = self._n_ref.copy()
+        self._shift     = np.zeros(self.n)
+
+        # SWIFT, per node (the recursion of swift.slide)
+        tau_s, tau_f, f, fs = p('swift_tau_s'), p('swift_tau_f'), p('swift_f'), 1./dt
+        self._e_s  = np.exp(2j*np.pi*f/fs)*np.exp(-1./(tau_s*fs))
+        self._e_f  = np.exp(2j*np.pi*f/fs)*np.exp(-1./(tau_f*fs))
+        self._norm = (tau_s - tau_f) / dt
+        self._X_s  = np.zeros(self.n, dtype=complex)
+        self._X_f  = np.zeros(self.n, dtype=complex)
+
+        self._state_col = self.struct[self.params['state_target']]
+        self._stim_col  = self.struct[self.params['stim_target']]
+
+        self._columns = _columns(self.struct)
+        record = record or [self.params['state_target'], 'stim']
+        for name in record:
+            if name not in self._columns and name not in ('amp','phase','stim'):
+                raise KeyError('unknown channel {!r}'.format(name))
+        self.record = {name: np.zeros((self.params['N'],self.n)) for name in record}
+
+        if self.params['seed'] >= 0:
+            self._normal = np.random.RandomState(self.params['seed']).normal
+        else:
+            self._normal = np.random.normal
+        self.i = 0
+
+    def _record(self, i):
+        x = self._H[i % self._L]
+        for name,data in self.record.items():
+            if name in self._columns:
+                data[i] = x[:,self._columns[name]]
+
+    def advance(self):
+        '''Advance every node one step'''
+        i, L, k = self.i, self._L, self.kernel
+        dt = self.params['dt']
+        x = self._H[i % L]
+
+        xd = self._H[(i - k.delay) % L, :, k.pre].T
+        drive = None
+        if self.coupling:
+            drive = np.zeros((self.n,len(k.names)))
+            for post,col,sig,Q,theta,W,delay in self.coupling:
+                src = self._H[(i - delay) % L, :, col]
+                if sig:
+                    src = sigmoid(src, Q, theta)
+                drive[:,post] += W.dot(src)
+        dxdt = k.rhs(x, xd, drive)
+
+        #DBS
+        stim = np.zeros(self.n)
+        c = self._cDBS
+        if c.any():
+            waiting = c & (self._c_i < self._c_start)
+            self._c_i[waiting] += 1
+            running = c & ~waiting
+            fire = running & (self._c_count >= self._c_steps)
+            self._c_count[fire] = 0
+            self._c_count[running] += 1
+            stim[c] = fire[c]*self._c_charge[c]
+            x[c,self._stim_col] += stim[c]/self._Cm[c]
+
+        t = ~c
+        if t.any():
+            v = x[t,self._state_col]
+            self._X_s[t] = self._e_s[t]*self._X_s[t] + v
+            self._X_f[t] = self._e_f[t]*self._X_f[t] + v
+            X = self._X_s[t] - self._X_f[t]
+            amp, phase = np.abs(X), np.angle(X)
+            amp /= self._norm[t]
+            with np.errstate(divide='ignore'):
+                amp = 10*np.log10(amp**2)
+
+            last = self._shift[t]
+            shift = (phase - self._p_phase[t] + np.pi) % (2*np.pi) - np.pi
+            self._shift[t] = shift
+            fire = (last < 0) & (0 <= shift) & (self._i_ref[t] >= self._n_ref[t]) & (amp >= self._p_power[t])
+            i_ref = self._i_ref[t]
+            i_ref[fire] = 0
+            self._i_ref[t] = i_ref + 1
+
+            p = self._pDBS[t]
+            pulse = fire*self._p_charge[t]
+            if p.any():
+                stim[t] = np.where(p, pulse, 0)
+                x[t & self._pDBS,self._stim_col] += pulse[p]/self._Cm[t & self._pDBS]
+            if 'amp' in self.record:
+                self.record['amp'][i+1,t] = amp
+            if 'phase' in self.record:
+                self.record['phase'][i+1,t] = phase
+        if 'stim' in self.record:
+            self.record['stim'][i+1] = stim
+        # Like MFM.S, the recorded state includes the stimulus added at step i
+        self._record(i)
+
+        #Advance
+        nxt = self._H[(i+1) % L]
+        nxt[:] = x + dt*dxdt
+
+        #Noise
+        P = len(k.names)
+        z = self._normal(0, 1, P if self.common_noise else (self.n,P))
+        V0, V1 = x[:,k.col], nxt[:,k.col]
+        nxt[:,k.col] += k.noiseAmp*z*np.sqrt(dt)*k.Q*(1-sigmoid(V1,1,k.theta))*sigmoid(V0,1,k.theta)
+
+        self.i += 1
+
+    def run(self):
+        '''Run to tstop'''
+        if self.params['verbose']: self.progbar = progbar()
+        while self.i < self.params['N'] - 1:
+            self.advance()
+            if self.params['verbose'] and self.i % 100 == 0:
+                self.progbar.update(float(self.i)/(self.params['N']-2))
+        self._record(self.i)
+        if self.params['verbose']: print()
+        return self
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+    from mfm import parse_kwargs
+    from metrics import beta_peak
+
+    args = docopt(__doc__)
+    n = int(args['--nodes'])
+    W = float(args['--weight'])*(np.ones((n,n)) - np.eye(n))
+    model = None
+    if args['--model']:
+        from model_spec import ModelSpec
+        model = ModelSpec.load(args['--model'])
+    net = Network(n, coupling=[('e', 'phie', W, float(args['--delay']))], model=model,
+                  **parse_kwargs(args['<key>=<value>']))
+    net.run()
+
+    target = net.params['state_target']
+    burn = int(1./net.params['dt'])
+    rows = []
+    for j in range(n):
+        f, power = beta_peak(net.record[target][burn:,j], net.params['fs'])
+        rows.append((j, f, power, np.count_nonzero(net.record['stim'][:,j])))
+    print(tabulate(rows, headers=['Node', 'Beta peak (Hz)', 'Beta power (dB)', 'Pulses']))
+
+if __name__ == '__main__':
+    main()
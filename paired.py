@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+'''
+Paired comparisons of model conditions with common random numbers.
+
+Every condition is run with the same seeds, so replicate r of each condition
+sees the same noise in the nine noise terms of MFM.advance. Differences
+between conditions are then taken replicate by replicate, which removes most
+of the seed-to-seed variance of the metrics: far fewer or shorter runs give
+the same confidence as independent runs.
+
+Each condition is compared to the first (the baseline). The table lists the
+mean paired difference of each metric with its t confidence interval, and
+the efficiency of the pairing: the number of independent replicates each
+paired replicate is worth.
+
+Usage:
+  paired [options] <condition>...
+
+<condition> is a comma separated list of <key>=<value> options, e.g.
+  paired DD=False DD=True DD=True,cDBS=True,cDBS_amp=4.13
+
+Options:
+  -n --seeds N        Replicates (seeds) per condition [default: 8]
+  --seed-start S      First seed [default: 0]
+  -t --tstop T        Length of each run (s) [default: 20]
+  --burn T            Initial transient excluded from the metrics (s) [default: 1.0]
+  --confidence C      Confidence level of the intervals [default: 0.95]
+  --ensemble          Run each replicate as one network with a node per
+                      condition and a common noise stream
+  -c --catalog PATH   Run catalog, used by separate runs with the default
+                      burn [default: data/catalog.db]
+  --no-cache          Do not read or write the run catalog
+  -h --help           Show this screen
+'''
+
+import numpy as np
+
+METRICS = ['beta_power', 'beta_freq', 'stim_rate', 'charge']
+
+def _batch(conditions, seeds, catalog=None, burn=1.0, **kwargs):
+    '''Summaries (conditions, seeds) from MFM runs'''
+    runs = [dict(c, seed=s, verbose=False, **kwargs) for c in conditions for s in seeds]
+    if burn == 1.0:
+        from catalog import evaluate
+        summaries = evaluate(runs, catalog)
+    else:
+        # Catalogued summaries use the default burn
+        from parallel import run_batch
+        from metrics import summarize
+        summaries = [summarize(mfm, burn) for mfm in run_batch(runs)]
+    return [summaries[k*len(seeds):(k+1)*len(seeds)] for k in range(len(conditions))]
+
+def _ensemble(conditions, seeds, burn=1.0, **kwargs):
+    '''Summaries (conditions, seeds) from one common-noise network per seed'''
+    from network import Network, SHARED
+    from metrics import summarize
+
+    for c in conditions:
+        shared = [key for key in c if key in SHARED]
+        if shared:
+            raise ValueError('options {} must be the same in every condition'.format(', '.join(shared)))
+
+    summaries = [[] for _ in conditions]
+    for seed in seeds:
+        net = Network(list(conditions), common_noise=True, seed=seed, **dict(kwargs, verbose=False))
+        net.run()
+        for k in range(len(conditions)):
+            summaries[k].append(summarize(net, burn, node=k))
+    return summaries
+
+def paired_stats(a, b, confidence=0.95):
+    '''
+    Paired comparison of two samples.
+
+    Parameters
+    ----------
+    a, b : array_like (n,)
+        Metric of each replicate, baseline and condition
+
+    Returns
+    -------
+    stats : dict
+        diff       : mean of b - a
+        ci         : (low, high) t confidence interval of diff
+        sd         : standard deviation of b - a
+        efficiency : variance of the unpaired difference of means over that
+                     of the paired one; independent replicates each paired
+                     replicate is worth
+    '''
+    from scipy import stats
+
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    d = b - a
+    n = len(d)
+    sd = d.std(ddof=1) if n > 1 else np.nan
+    half = stats.t.ppf(0.5 + confidence/2., n - 1)*sd/np.sqrt(n) if n > 1 else np.nan
+    unpaired = a.var(ddof=1) + b.var(ddof=1) if n > 1 else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        efficiency = unpaired / sd**2
+    return {'diff'       : d.mean(),
+            'ci'         : (d.mean() - half, d.mean() + half),
+            'sd'         : sd,
+            'efficiency' : efficiency}
+
+def compare(conditions, seeds=8, seed_start=0, metrics=METRICS, ensemble=False, catalog=None,
+            burn=1.0, confidence=0.95, **kwargs):
+    '''
+    Paired comparison of conditions against the first one.
+
+    Parameters
+    ----------
+    conditions : list of dict
+        MFM options of each condition; the first is the baseline
+    seeds : int
+        Replicates per condition (seeds seed_start..seed_start+seeds-1)
+    metrics : list of str
+        Summary metrics to compare (see metrics.summarize)
+    ensemble : bool
+        Run each replicate as one Network with common noise, with a node per
+        condition, instead of separate MFM runs. The noise is identical
+        either way.
+    catalog : catalog.Catalog, optional
+        Cache of MFM run summaries. Catalogued summaries use a burn of 1 s,
+        so the catalog is only used by separate runs with burn=1.0; other
+        runs are always simulated.
+    burn : float (s)
+        Initial transient excluded from the spectral metrics
+    confidence : float
+        Confidence level of the intervals
+    **kwargs
+        MFM options common to all conditions (e.g. tstop)
+
+    Returns
+    -------
+    rows : list of dict
+        condition (index), metric, baseline and condition means, and the
+        paired_stats of each condition and metric
+    summaries : list of list of dict
+        Summary of each condition and replicate
+    '''
+    seeds = list(range(seed_start, seed_start + seeds))
+    if ensemble:
+        summaries = _ensemble(conditions, seeds, burn, **kwargs)
+    else:
+        summaries = _batch(conditions, seeds, catalog, burn, **kwargs)
+
+    rows = []
+    for k in range(1, len(conditions)):
+        for key in metrics:
+            a = [s[key] for s in summaries[0]]
+            b = [s[key] for s in summaries[k]]
+            row = {'condition': k, 'metric': key, 'baseline': np.mean(a), 'mean': np.mean(b)}
+            row.update(paired_stats(a, b, confidence))
+            rows.append(row)
+    return rows, summaries
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+    from mfm import parse_kwargs
+
+    args = docopt(__doc__)
+    conditions = [parse_kwargs(c.split(',')) for c in args['<condition>']]
+    catalog = None
+    if not args['--no-cache'] and not args['--ensemble'] and float(args['--burn']) == 1.0:
+        from catalog import Catalog
+        catalog = Catalog(args['--catalog'])
+
+    rows, _ = compare(conditions,
+                      seeds=int(args['--seeds']),
+                      seed_start=int(args['--seed-start']),
+                      ensemble=args['--ensemble'],
+                      catalog=catalog,
+                      burn=float(args['--burn']),
+                      confidence=float(args['--confidence']),
+                      tstop=float(args['--tstop']))
+
+    names = args['<condition>']
+    table = [(names[row['condition']], row['metric'], row['baseline'], row['mean'], row['diff'],
+              row['ci'][0], row['ci'][1], row['efficiency']) for row in rows]
+    print('Baseline: {}\n'.format(names[0]))
+    print(tabulate(table, headers=['Condition', 'Metric', 'Baseline', 'Mean', 'Difference',
+                                   'CI low', 'CI high', 'Efficiency'], floatfmt='.3g'))
+    if catalog is not None:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
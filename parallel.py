@@ -0,0 +1,203 @@
+'''
+Parallel batches of MFM runs with zero-copy result collection.
+
+The parent preallocates the result arrays of the whole batch in shared memory
+(or memory-mapped files) and every worker's MFM records directly into its own
+slice, so only the small remainder of each MFM object is pickled back.
+'''
+
+import os
+import multiprocessing
+
+import numpy as np
+
+from mfm import MFM
+from model_spec import BGTCS, ModelSpec
+
+CHANNELS = ['amp', 'phase', 'stim']
+
+class Batch(object):
+    '''
+    Results of run_batch.
+
+    Behaves as a list of MFM objects whose S and memory arrays are views of the
+    batch buffers. The buffers stay mapped while the Batch (or any of its
+    arrays) is referenced.
+
+    Attributes
+    ----------
+    runs : list of MFM
+    offsets : numpy.array of int
+        Start of each run in the batch buffers (samples)
+    '''
+    def __init__(self, runs, offsets, buffers, handles=()):
+        self.runs    = runs
+        self.offsets = offsets
+        self.buffers = buffers
+        self._handles = list(handles)
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __getitem__(self, i):
+        return self.runs[i]
+
+    def __iter__(self):
+        return iter(self.runs)
+
+class _Mapped(object):
+    '''
+    Array interface of a shared memory block. Arrays made from it keep it as
+    their base, so the block stays mapped while any of them is alive (numpy
+    does not hold on to the memoryview it was given).
+    '''
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.__array_interface__ = np.ndarray(shape, dtype=dtype, buffer=shm.buf).__array_interface__
+
+def _allocate(shapes, dtype, backend, path):
+    '''
+    Allocate the batch buffers.
+
+    Returns
+    -------
+    buffers : dict of numpy.array
+    specs : dict
+        Everything a worker needs to map the same buffers
+    handles : list
+        Objects that must outlive the buffers
+    '''
+    buffers, specs, handles = {}, {}, []
+    try:
+        for key,shape in shapes.items():
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if backend == 'shm':
+                from multiprocessing import shared_memory
+                shm = shared_memory.SharedMemory(create=True, size=max(nbytes,1))
+                handles.append(shm)
+                buffers[key] = np.asarray(_Mapped(shm, shape, dtype))
+                specs[key] = (shm.name, shape, np.dtype(dtype).str)
+            else:
+                fname = os.path.join(path, '{}.dat'.format(key))
+                buffers[key] = np.memmap(fname, dtype=dtype, mode='w+', shape=shape)
+                specs[key] = (fname, shape, np.dtype(dtype).str)
+    except BaseException:
+        _unlink(handles)
+        raise
+    return buffers, specs, handles
+
+def _unlink(handles):
+    # The names are released; the mappings live as long as the buffers
+    for shm in handles:
+        shm.unlink()
+
+def _attach(specs, backend):
+    buffers, handles = {}, []
+    for key,(name,shape,dtype) in specs.items():
+        if backend == 'shm':
+            from multiprocessing import shared_memory
+            shm = shared_memory.SharedMemory(name=name)
+            buffers[key] = np.asarray(_Mapped(shm, shape, dtype))
+            handles.append(shm)
+        else:
+            buffers[key] = np.memmap(name, dtype=dtype, mode='r+', shape=shape)
+    return buffers, handles
+
+def _worker(task):
+    kwargs, offset, N, specs, backend = task
+
+    buffers, handles = _attach(specs, backend)
+    mfm = MFM(S=buffers['S'][offset:offset+N],
+              memory={key: buffers[key][offset:offset+N] for key in CHANNELS}, **kwargs)
+    mfm.run()
+    if backend == 'memmap':
+        for buffer in buffers.values():
+            buffer.flush()
+
+    # Everything but the recordings goes back to the parent
+    state = {key: value for key,value in mfm.__dict__.items() if key not in ('S','memory')}
+    del mfm, buffers
+    for shm in handles:
+        shm.close()
+    return state
+
+def run_batch(runs, processes=None, backend='shm', path=None):
+    '''
+    Run a batch of MFMs in worker processes.
+
+    Parameters
+    ----------
+    runs : list of dict
+        MFM options of each run. Runs without a seed (or seed=-1) are given one
+        drawn from numpy's global RNG, so that workers do not share a noise
+        stream.
+    processes : int, optional
+        Number of worker processes (default: number of CPUs)
+    backend : str
+        'shm' for shared memory, or 'memmap' for memory-mapped files in path
+    path : str, optional
+        Directory of the memory-mapped files (backend='memmap')
+
+    Returns
+    -------
+    batch : Batch
+        The runs, in order. All runs must use the same precision.
+    '''
+    if backend not in ('shm','memmap'):
+        raise ValueError("backend must be 'shm' or 'memmap'")
+    if backend == 'memmap':
+        if path is None:
+            raise ValueError("path is required for backend='memmap'")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    runs = [dict(kwargs) for kwargs in runs]
+    for kwargs in runs:
+        kwargs['verbose'] = False
+        if kwargs.get('seed', -1) == -1:
+            kwargs['seed'] = np.random.randint(2**31)
+
+    # Shape the batch from the options alone, cast as MFM casts them
+    defaults = MFM(tstop=1e-3, verbose=False).options
+    option = lambda kwargs, key: type(defaults[key])(kwargs.get(key, defaults[key]))
+    precisions = set(option(kwargs, 'precision') for kwargs in runs)
+    if not precisions <= {'double', 'single'}:
+        raise ValueError("precision must be 'double' or 'single'")
+    if len(precisions) > 1:
+        raise ValueError('all runs in a batch must use the same precision')
+    dtype = np.float32 if precisions.pop() == 'single' else np.float64
+
+    lengths = np.array([int(np.ceil(option(kwargs, 'tstop')/option(kwargs, 'dt'))) for kwargs in runs])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    total = int(lengths.sum())
+
+    models = set(option(kwargs, 'model') for kwargs in runs)
+    nstate = set(ModelSpec.load(model).nstate if model else BGTCS.nstate for model in models)
+    if len(nstate) > 1:
+        raise ValueError('all runs in a batch must have the same number of state variables')
+
+    shapes = {'S': (total,nstate.pop())}
+    shapes.update({key: (total,) for key in CHANNELS})
+    buffers, specs, handles = _allocate(shapes, dtype, backend, path)
+
+    tasks = [(kwargs, int(offset), int(N), specs, backend) for kwargs,offset,N in zip(runs,offsets,lengths)]
+    try:
+        pool = multiprocessing.Pool(processes)
+        try:
+            states = pool.map(_worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        # A failed run must not leak the segments in /dev/shm
+        _unlink(handles)
+
+    results = []
+    for state,offset in zip(states,offsets):
+        mfm = MFM.__new__(MFM)
+        mfm.__dict__.update(state)
+        N = mfm.params['N']     # may be shorter than allocated after early stopping
+        mfm.S = buffers['S'][offset:offset+N]
+        mfm.memory = {key: buffers[key][offset:offset+N] for key in CHANNELS}
+        results.append(mfm)
+    return Batch(results, offsets, buffers, handles)
@@ -10,12 +10,11 @@ Options:
   -h --help    Show this screen
 '''
 
+import os
 import sys
-import pickle
 from docopt import docopt
 
 from mfm import MFM
-from mfm import *
 
 def main():
     args = docopt(__doc__)
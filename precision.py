@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+Validate single precision runs against the double precision reference.
+
+Runs the MFM in double and single precision with identical noise seeds and
+compares the beta peak frequency and power of the state target.
+
+Usage:
+  precision [options] [<key>=<value>]...
+
+Options:
+  -n --seeds N       Number of seeds to compare [default: 3]
+  --burn T           Initial transient to discard (s) [default: 1.0]
+  --df DF            Peak frequency tolerance (Hz) [default: 1.0]
+  --dP DP            Beta power tolerance (dB) [default: 0.5]
+  -h --help          Show this screen
+'''
+
+from mfm import MFM
+from metrics import beta_peak
+
+def compare(seeds=(0,1,2), burn=1.0, **kwargs):
+    '''
+    Run each seed in both precisions.
+
+    Parameters
+    ----------
+    seeds : iterable of int
+        Noise seeds
+    burn : float (s)
+        Initial transient to discard before computing the spectrum
+    **kwargs
+        MFM options shared by all runs
+
+    Returns
+    -------
+    rows : list of dict
+        Per seed beta peak frequency/power for each precision and the
+        storage used by the recordings (bytes)
+    '''
+    kwargs.setdefault('tstop', 20.)
+    kwargs['verbose'] = False
+
+    rows = []
+    for seed in seeds:
+        row = {'seed': seed}
+        for precision in ('double','single'):
+            mfm = MFM(seed=seed, precision=precision, **kwargs)
+            mfm.run()
+
+            x = mfm.S[int(burn/mfm.params['dt']):,mfm.struct[mfm.params['state_target']]]
+            f_peak, power = beta_peak(x, mfm.params['fs'])
+
+            row[precision] = {'f_peak' : f_peak,
+                              'power'  : power,
+                              'bytes'  : mfm.S.nbytes + sum(v.nbytes for v in mfm.memory.values())}
+        rows.append(row)
+    return rows
+
+def report(rows, df=1.0, dP=0.5):
+    '''
+    Tabulate a comparison made by compare(). Returns True if all seeds pass.
+    '''
+    from tabulate import tabulate
+
+    data = []
+    passed = True
+    for row in rows:
+        d,s = row['double'],row['single']
+        ok = abs(d['f_peak'] - s['f_peak']) <= df and abs(d['power'] - s['power']) <= dP
+        passed &= ok
+        data.append((row['seed'], d['f_peak'], s['f_peak'], d['power'], s['power'],
+                     s['bytes']/d['bytes'], 'pass' if ok else 'FAIL'))
+
+    headers = ['seed', 'f64 peak (Hz)', 'f32 peak (Hz)', 'f64 power (dB)', 'f32 power (dB)', 'storage ratio', '']
+    print(tabulate(data, headers=headers, floatfmt='.2f'))
+    print('\nTolerance: {} Hz, {} dB -> {}'.format(df, dP, 'PASS' if passed else 'FAIL'))
+    return passed
+
+def main():
+    import sys
+    from docopt import docopt
+    from mfm import parse_kwargs
+
+    args = docopt(__doc__)
+    kwargs = parse_kwargs(args['<key>=<value>'])
+
+    rows = compare(seeds=range(int(args['--seeds'])), burn=float(args['--burn']), **kwargs)
+    passed = report(rows, df=float(args['--df']), dP=float(args['--dP']))
+    sys.exit(0 if passed else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+'''
+Open-loop replay of DBS controllers over a recorded state_target trace.
+
+Drives the pDBS (or cDBS) logic over a saved run, or over an external trace,
+for many controller settings at once, without re-running the model.
+
+Usage:
+  replay [options] <run>
+
+<run> is a RunID, the path of a saved run, or an array file (.npy, or text
+with one sample per line) when --dt is given.
+
+Options:
+  --dt DT             Sampling interval of an array file (s)
+  --phase LIST        Comma separated pDBS phase thresholds (rad)
+  --power LIST        Comma separated pDBS power thresholds (dB)
+  --ref LIST          Comma separated pDBS refractory periods
+  -h --help           Show this screen
+
+Thresholds not given are taken from the run (or the MFM defaults).
+'''
+
+import numpy as np
+
+from mfm import MFM
+
+class Trace(object):
+    '''
+    Recorded state_target trace and the SWIFT/pDBS settings to replay it with.
+
+    Parameters
+    ----------
+    x : array_like
+        Trace, as seen by the controller at each step
+    dt : float (s)
+        Sampling interval
+    params : dict, optional
+        MFM parameters (swift_f, swift_tau_s, swift_tau_f, pDBS_* and cDBS_*).
+        Missing entries take the MFM defaults.
+    '''
+    def __init__(self, x, dt, params=None):
+        defaults = MFM(tstop=dt, dt=dt, verbose=False).params
+        defaults.update(params or {})
+
+        self.x = np.asarray(x, dtype=np.float64)
+        self.dt = dt
+        self.params = defaults
+
+    @classmethod
+    def from_run(cls, run):
+        '''
+        Trace of a saved run (RunID, path) or an MFM object.
+        '''
+        if not isinstance(run, MFM):
+            try: fname = 'data/{0:03d}.mfm'.format(int(run))
+            except (TypeError, ValueError): fname = run
+            run = MFM(verbose=False); run.load(fname)
+        N = run.params['N']
+        return cls(run.S[:N,run.struct[run.params['state_target']]], run.params['dt'], run.params)
+
+    @classmethod
+    def from_file(cls, fname, dt, params=None):
+        '''
+        Trace stored in an array file (.npy, or text readable by numpy.loadtxt).
+        '''
+        x = np.load(fname) if fname.endswith('.npy') else np.loadtxt(fname)
+        return cls(np.ravel(x), dt, params)
+
+    def track(self):
+        '''
+        SWIFT estimate of the trace, as pDBS.advance computes it at each step.
+
+        Returns
+        -------
+        amp : numpy.array (dB)
+        phase : numpy.array (rad)
+        '''
+        from scipy import signal
+
+        fs = 1./self.dt
+        f = self.params['swift_f']
+        tau_s, tau_f = self.params['swift_tau_s'], self.params['swift_tau_f']
+
+        X = 0
+        for tau,sign in ((tau_s,1), (tau_f,-1)):
+            e = np.exp(2j*np.pi*f/fs)*np.exp(-1./(tau*fs))
+            # X[n] = e*X[n-1] + x[n], the recursion of swift.slide
+            X = X + sign*signal.lfilter([1], [1,-e], self.x.astype(complex))
+
+        amp = np.abs(X) / ((tau_s - tau_f) / self.dt)
+        with np.errstate(divide='ignore'):
+            amp = 10*np.log10(amp**2)
+        return amp, np.angle(X)
+
+def _refractory(candidates, n_ref):
+    '''
+    Drop candidate steps that fall within n_ref steps of the previous
+    accepted stimulus. The first candidate is always accepted.
+    '''
+    if len(candidates) < 2 or np.all(np.diff(candidates) >= n_ref):
+        return candidates
+    accepted = [candidates[0]]
+    for j in candidates[1:]:
+        if j - accepted[-1] >= n_ref:
+            accepted.append(j)
+    return np.array(accepted, dtype=candidates.dtype)
+
+def replay_pDBS(trace, phase_thr=None, power_thr=None, ref_period=None, chunk=64):
+    '''
+    Replay pDBS over a trace for many controller settings.
+
+    phase_thr, power_thr and ref_period are broadcast against each other; each
+    element is one controller setting. Settings not given are taken from
+    trace.params.
+
+    Parameters
+    ----------
+    trace : Trace
+    phase_thr : array_like (rad), optional
+    power_thr : array_like (dB), optional
+    ref_period : array_like, optional
+        In the units of MFM's pDBS_ref_period
+    chunk : int
+        Number of settings evaluated together (bounds memory use)
+
+    Returns
+    -------
+    result : dict
+        stim   : list of numpy.array, sample indices of the stimuli of each
+                 setting, with the indexing of MFM.memory['stim']
+        times  : list of numpy.array (s), stimulus times
+        pulses : numpy.array, number of pulses of each setting
+        amp    : numpy.array (dB), tracked amplitude (shared by all settings)
+        phase  : numpy.array (rad), tracked phase (shared by all settings)
+        settings : dict of the broadcast settings
+    '''
+    p = trace.params
+    phase_thr  = p['pDBS_phase'] if phase_thr is None else phase_thr
+    power_thr  = p['pDBS_power_thr'] if power_thr is None else power_thr
+    ref_period = p['pDBS_ref_period'] if ref_period is None else ref_period
+    phase_thr, power_thr, ref_period = [np.ravel(a) for a in np.broadcast_arrays(phase_thr, power_thr, ref_period)]
+
+    amp, phase = trace.track()
+    n_ref = 1/(p['swift_f']*trace.dt) * ref_period
+
+    stim = []
+    for k0 in range(0, len(phase_thr), chunk):
+        thr = phase_thr[k0:k0+chunk]
+        shift = (phase[:,None] - thr + np.pi) % (2*np.pi) - np.pi
+        last = np.vstack([np.zeros((1,len(thr))), shift[:-1]])
+        crossing = (last < 0) & (0 <= shift) & (amp[:,None] >= power_thr[k0:k0+chunk])
+        # Like MFM.run, the last sample is not advanced (its stimulus would
+        # fall beyond the recording)
+        crossing[-1] = False
+        for k in range(len(thr)):
+            stim.append(_refractory(np.flatnonzero(crossing[:,k]), n_ref[k0+k]) + 1)
+
+    return {'stim'     : stim,
+            'times'    : [s*trace.dt for s in stim],
+            'pulses'   : np.array([len(s) for s in stim]),
+            'amp'      : amp,
+            'phase'    : phase,
+            'settings' : {'phase_thr': phase_thr, 'power_thr': power_thr, 'ref_period': ref_period}}
+
+def replay_cDBS(trace, f=None, tstart=None):
+    '''
+    Stimulus times of cDBS over the length of a trace, for one or many
+    frequencies.
+
+    Returns
+    -------
+    stim : list of numpy.array
+        Sample indices of the stimuli of each frequency, with the indexing of
+        MFM.memory['stim']
+    '''
+    f = trace.params['cDBS_f'] if f is None else f
+    tstart = trace.params['stim_start'] if tstart is None else tstart
+
+    stim = []
+    for fk in np.ravel(f):
+        steps_per_pulse = int(round(1./fk/trace.dt))
+        first = int(np.ceil(tstart/trace.dt))
+        stim.append(np.arange(first, len(trace.x)-1, steps_per_pulse) + 1)
+    return stim
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+
+    args = docopt(__doc__)
+    if args['--dt']:
+        trace = Trace.from_file(args['<run>'], float(args['--dt']))
+    else:
+        trace = Trace.from_run(args['<run>'])
+
+    def values(option):
+        return None if args[option] is None else np.array([float(v) for v in args[option].split(',')])
+
+    phase, power, ref = values('--phase'), values('--power'), values('--ref')
+    grid = np.meshgrid(*[trace.params[key] if v is None else v
+                         for key,v in (('pDBS_phase',phase), ('pDBS_power_thr',power), ('pDBS_ref_period',ref))],
+                       indexing='ij')
+    result = replay_pDBS(trace, *grid)
+
+    s = result['settings']
+    length = len(trace.x)*trace.dt
+    rows = [(s['phase_thr'][k], s['power_thr'][k], s['ref_period'][k], result['pulses'][k], result['pulses'][k]/length)
+            for k in range(len(result['pulses']))]
+    print(tabulate(rows, headers=['Phase thr', 'Power thr', 'Ref period', 'Pulses', 'Rate (Hz)']))
+
+if __name__ == '__main__':
+    main()
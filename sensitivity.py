@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+'''
+Global sensitivity analysis of the MFM connection strengths and thresholds.
+
+Morris screening (elementary effects) and Sobol indices (Saltelli sampling)
+of a summary metric with respect to the model parameters of
+MFM._set_MFM_params. Each parameter varies over a range around its nominal
+value in the configuration given by the options. The runs are evaluated in
+parallel batches, and runs already in the run catalog are reused. All runs
+share one noise seed, so differences between samples come from the
+parameters alone.
+
+Usage:
+  sensitivity morris [options] [<key>=<value>]...
+  sensitivity sobol [options] [<key>=<value>]...
+
+Options:
+  -p --params LIST        Comma separated parameters (default: all nonzero
+                          connection strengths and firing thresholds)
+  -s --spread S           Relative half-width of each parameter's range [default: 0.2]
+  -m --metric M           Summary metric (see metrics.summarize) [default: beta_power]
+  --contrast LIST         Comma separated <key>=<value> options; the output is
+                          the change of the metric when they are added, e.g.
+                          cDBS=True for the response to cDBS
+  -r --trajectories R     Morris trajectories [default: 20]
+  --levels L              Morris grid levels [default: 4]
+  -n --samples N          Sobol base samples [default: 64]
+  -b --bootstrap B        Bootstrap resamples for the confidence intervals [default: 500]
+  --seed S                Noise seed of every run [default: 0]
+  -c --catalog PATH       Run catalog [default: data/catalog.db]
+  --no-cache              Do not read or write the run catalog
+  -h --help               Show this screen
+'''
+
+import numpy as np
+
+from mfm import MFM
+from kernel import POPULATIONS, EDGES
+
+def default_params(options=None):
+    '''
+    Connection strengths that are nonzero in the given configuration, and
+    the firing thresholds.
+    '''
+    mfm = MFM(**dict(options or {}, tstop=1e-3, verbose=False))
+    weights = [e[2] for e in EDGES if getattr(mfm, e[2]) != 0]
+    return weights + [p[2] for p in POPULATIONS]
+
+class Problem(object):
+    '''
+    Parameter space and model output of a sensitivity analysis.
+
+    Parameters
+    ----------
+    params : list of str, optional
+        Model attributes to vary (see mfm.SCHEDULE_MODEL). Defaults to
+        default_params(options).
+    options : dict, optional
+        MFM options of the configuration (e.g. DD=True, tstop=10)
+    spread : float
+        Each parameter varies over nominal*(1-spread) .. nominal*(1+spread)
+    metric : str
+        Summary metric of each run
+    contrast : dict, optional
+        Options whose effect on the metric is the output: every sample is run
+        with and without them (same seed) and the difference is returned
+    seed : int
+        Noise seed of every run
+    catalog : catalog.Catalog, optional
+        Cache of run summaries
+    processes : int, optional
+        Worker processes of each batch of runs (default: number of CPUs)
+    '''
+    def __init__(self, params=None, options=None, spread=0.2, metric='beta_power', contrast=None,
+                 seed=0, catalog=None, processes=None):
+        from mfm import SCHEDULE_MODEL
+
+        self.options = dict(options or {})
+        self.options.setdefault('tstop', 10.)
+        self.params = list(params or default_params(self.options))
+        for name in self.params:
+            if name not in SCHEDULE_MODEL:
+                raise ValueError('{!r} is not a model parameter'.format(name))
+
+        mfm = MFM(**dict(self.options, tstop=1e-3, verbose=False))
+        self.nominal = np.array([float(getattr(mfm, name)) for name in self.params])
+        bounds = np.sort([self.nominal*(1-spread), self.nominal*(1+spread)], axis=0)
+        self.lower, self.upper = bounds
+
+        self.spread = spread
+        self.metric = metric
+        self.contrast = contrast
+        self.seed = seed
+        self.catalog = catalog
+        self.processes = processes
+
+    @property
+    def k(self):
+        return len(self.params)
+
+    def scale(self, U):
+        '''Map points of the unit hypercube to parameter values'''
+        return self.lower + np.asarray(U)*(self.upper - self.lower)
+
+    def runs(self, X):
+        '''MFM options of the runs of parameter sets X (n,k)'''
+        runs = []
+        for x in X:
+            values = {name: float(v) for name,v in zip(self.params, x)}
+            run = dict(self.options, seed=self.seed, verbose=False, schedule=[[0., values]])
+            runs.append(run)
+            if self.contrast:
+                runs.append(dict(run, **self.contrast))
+        return runs
+
+    def evaluate(self, U):
+        '''
+        Model output at points U (n,k) of the unit hypercube.
+        '''
+        from catalog import evaluate
+
+        summaries = evaluate(self.runs(self.scale(U)), self.catalog, self.processes)
+        y = np.array([s[self.metric] for s in summaries], dtype=float)
+        if self.contrast:
+            y = y[1::2] - y[0::2]
+        return y
+
+def morris_sample(k, r, levels=4, rng=None):
+    '''
+    Morris trajectories in the unit hypercube.
+
+    Returns
+    -------
+    U : numpy.array (r*(k+1), k)
+        r trajectories of k+1 points, each differing from the previous one
+        in a single coordinate by +-delta
+    order : numpy.array (r, k)
+        Coordinate changed at each step of each trajectory
+    delta : float
+    '''
+    rng = rng or np.random.RandomState(0)
+    delta = levels / (2.*(levels - 1))
+    grid = np.arange(levels//2) / (levels - 1.)     # starts that keep x+delta inside the cube
+
+    U = np.empty((r,k+1,k))
+    order = np.empty((r,k), dtype=int)
+    for t in range(r):
+        x = rng.choice(grid, k)
+        direction = rng.choice([-1, 1], k)
+        # Start at the upper end of the coordinates that decrease
+        x = np.where(direction < 0, x + delta, x)
+        order[t] = rng.permutation(k)
+        U[t,0] = x
+        for step,i in enumerate(order[t]):
+            x = x.copy()
+            x[i] += direction[i]*delta
+            U[t,step+1] = x
+    return U.reshape(-1,k), order, delta
+
+def morris(problem, r=20, levels=4, bootstrap=500, rng=None):
+    '''
+    Morris screening.
+
+    Returns
+    -------
+    result : dict
+        mu_star, mu_star_ci (2,k) and sigma of the elementary effects of each
+        parameter, in the units of the metric per unit of the parameter's
+        range, and the elementary effects (r,k)
+    '''
+    rng = rng or np.random.RandomState(0)
+    k = problem.k
+    U, order, delta = morris_sample(k, r, levels, rng)
+    y = problem.evaluate(U).reshape(r,k+1)
+
+    steps = U.reshape(r,k+1,k)
+    EE = np.empty((r,k))
+    for t in range(r):
+        for step,i in enumerate(order[t]):
+            dx = steps[t,step+1,i] - steps[t,step,i]
+            EE[t,i] = (y[t,step+1] - y[t,step]) / dx
+
+    mu_star = np.abs(EE).mean(0)
+    boot = np.array([np.abs(EE[rng.randint(r, size=r)]).mean(0) for _ in range(bootstrap)])
+    return {'mu_star'    : mu_star,
+            'mu_star_ci' : np.percentile(boot, [2.5, 97.5], axis=0),
+            'mu'         : EE.mean(0),
+            'sigma'      : EE.std(0, ddof=1),
+            'effects'    : EE}
+
+def sobol(problem, n=64, bootstrap=500, rng=None):
+    '''
+    First order and total Sobol indices from Saltelli sampling (n*(k+2)
+    model evaluations).
+
+    Returns
+    -------
+    result : dict
+        S1, S1_ci (2,k), ST and ST_ci (2,k) of each parameter
+    '''
+    rng = rng or np.random.RandomState(0)
+    k = problem.k
+    A, B = rng.rand(n,k), rng.rand(n,k)
+    AB = np.repeat(A[None], k, axis=0)
+    for i in range(k):
+        AB[i,:,i] = B[:,i]
+
+    y = problem.evaluate(np.vstack([A, B, AB.reshape(-1,k)]))
+    fA, fB, fAB = y[:n], y[n:2*n], y[2*n:].reshape(k,n)
+
+    def indices(rows):
+        a, b, ab = fA[rows], fB[rows], fAB[:,rows]
+        var = np.var(np.concatenate([a, b]), ddof=1)
+        S1 = np.mean(b*(ab - a), axis=1) / var        # Saltelli (2010)
+        ST = 0.5*np.mean((a - ab)**2, axis=1) / var   # Jansen (1999)
+        return S1, ST
+
+    S1, ST = indices(np.arange(n))
+    boot = [indices(rng.randint(n, size=n)) for _ in range(bootstrap)]
+    return {'S1'    : S1,
+            'S1_ci' : np.percentile([b[0] for b in boot], [2.5, 97.5], axis=0),
+            'ST'    : ST,
+            'ST_ci' : np.percentile([b[1] for b in boot], [2.5, 97.5], axis=0)}
+
+def main():
+    from docopt import docopt
+    from tabulate import tabulate
+    from mfm import parse_kwargs
+    from catalog import Catalog
+
+    args = docopt(__doc__)
+    catalog = None if args['--no-cache'] else Catalog(args['--catalog'])
+    contrast = parse_kwargs(args['--contrast'].split(',')) if args['--contrast'] else None
+    problem = Problem(params=args['--params'].split(',') if args['--params'] else None,
+                      options=parse_kwargs(args['<key>=<value>']),
+                      spread=float(args['--spread']),
+                      metric=args['--metric'],
+                      contrast=contrast,
+                      seed=int(args['--seed']),
+                      catalog=catalog)
+
+    if args['morris']:
+        result = morris(problem, int(args['--trajectories']), int(args['--levels']), int(args['--bootstrap']))
+        rows = [(name, nominal, mu, lo, hi, mu_, sigma) for name,nominal,mu,lo,hi,mu_,sigma in
+                zip(problem.params, problem.nominal, result['mu_star'], result['mu_star_ci'][0],
+                    result['mu_star_ci'][1], result['mu'], result['sigma'])]
+        rows.sort(key=lambda row: -row[2])
+        headers = ['Parameter', 'Nominal', 'mu*', 'CI low', 'CI high', 'mu', 'sigma']
+    else:
+        result = sobol(problem, int(args['--samples']), int(args['--bootstrap']))
+        rows = [(name, nominal, s1, s1lo, s1hi, st, stlo, sthi) for name,nominal,s1,s1lo,s1hi,st,stlo,sthi in
+                zip(problem.params, problem.nominal, result['S1'], result['S1_ci'][0], result['S1_ci'][1],
+                    result['ST'], result['ST_ci'][0], result['ST_ci'][1])]
+        rows.sort(key=lambda row: -row[5])
+        headers = ['Parameter', 'Nominal', 'S1', 'CI low', 'CI high', 'ST', 'CI low', 'CI high']
+
+    output = args['--metric'] + (' change with ' + args['--contrast'] if contrast else '')
+    print('Sensitivity of {} over +-{:g}% of each parameter\n'.format(output, 100*problem.spread))
+    print(tabulate(rows, headers=headers, floatfmt='.3g'))
+    if catalog is not None:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+'''
+Local MFM job server.
+
+Keeps a pool of warm worker processes with the model loaded and serves run
+requests over a Unix socket or localhost TCP. Requests and responses are JSON
+lines; a client may pipeline many requests on one connection and responses
+stream back as runs finish. When the job queue is full the server stops
+reading from clients until a worker frees up.
+
+Request:
+  {"id": 0, "params": {"DD": true, "tstop": 10}, "return": "summary"}
+  {"id": 1, "params": {...}, "return": "arrays", "channels": ["p2", "amp"]}
+
+"return" is "summary" (the default) or "arrays"; anything else is an error.
+
+Response:
+  {"id": 0, "status": "ok", "summary": {...}}
+  {"id": 1, "status": "ok", "summary": {...}, "arrays": {"p2": {"dtype": ..., "shape": ..., "data": <base64>}}}
+  {"id": 2, "status": "error", "error": "..."}
+
+Usage:
+  server [options]
+
+Options:
+  -s --socket PATH    Listen on a Unix socket
+  -p --port PORT      Listen on localhost:PORT [default: 8765]
+  -w --workers N      Number of worker processes (default: number of CPUs)
+  -q --queue N        Maximum number of queued jobs [default: 64]
+  -h --help           Show this screen
+'''
+
+import asyncio
+import base64
+import json
+import os
+import socket
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+
+# Supported values of the "return" field of a request
+RETURNS = ['summary', 'arrays']
+
+def _warm():
+    '''
+    Worker initializer: import the model and the analysis dependencies once,
+    and reseed numpy's global RNG so forked workers do not share a noise stream.
+    '''
+    import mfm, metrics         # noqa: F401 -- loaded once per worker, not per job
+    from scipy import signal    # noqa: F401 -- used by metrics.psd
+    np.random.seed()
+
+def _ready(barrier):
+    '''
+    Warm-up task. Every task waits for all the others, so each one occupies
+    a different worker and every worker is started (and warmed).
+    '''
+    barrier.wait(timeout=60)
+    return os.getpid()
+
+def _channel(mfm, name):
+    if name in mfm.memory:
+        return mfm.memory[name]
+    if name in mfm.struct:
+        return mfm.S[:,mfm.struct[name]]
+    raise KeyError('unknown channel {!r}'.format(name))
+
+def _encode(x):
+    x = np.ascontiguousarray(x)
+    return {'dtype' : x.dtype.str,
+            'shape' : x.shape,
+            'data'  : base64.b64encode(x.tobytes()).decode('ascii')}
+
+def decode(array):
+    '''Decode an array of a server response'''
+    return np.frombuffer(base64.b64decode(array['data']), dtype=array['dtype']).reshape(array['shape'])
+
+def run_job(params, ret='summary', channels=()):
+    '''
+    Run one MFM and return its summary (and arrays). Executed in the workers.
+    '''
+    from mfm import MFM
+    from metrics import summarize
+
+    params = dict(params)
+    params['verbose'] = False
+    mfm = MFM(**params)
+    mfm.run()
+
+    result = {'summary': summarize(mfm)}
+    if ret == 'arrays':
+        result['arrays'] = {name: _encode(_channel(mfm, name)) for name in channels}
+    return result
+
+class Server(object):
+    '''
+    Job server.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker processes
+    queue : int
+        Maximum number of jobs waiting for a worker
+    '''
+    def __init__(self, workers=None, queue=64):
+        self.workers = workers or os.cpu_count()
+        self.queue_size = queue
+
+    async def _handle(self, reader, writer):
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(message):
+            async with lock:
+                if writer.is_closing():
+                    return
+                try:
+                    writer.write((json.dumps(message) + '\n').encode())
+                    await writer.drain()
+                except ConnectionError:
+                    # The client went away; its remaining responses are dropped
+                    writer.close()
+
+        while True:
+            try:
+                line = await reader.readline()
+            except ConnectionError:
+                break
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                job = (request.get('params', {}), request.get('return', 'summary'), request.get('channels', []))
+            except (ValueError, AttributeError) as e:
+                await respond({'id': None, 'status': 'error', 'error': 'bad request: {}'.format(e)})
+                continue
+            if job[1] not in RETURNS:
+                await respond({'id': request.get('id'), 'status': 'error',
+                               'error': 'bad request: "return" must be one of {}'.format(', '.join(RETURNS))})
+                continue
+
+            done = asyncio.get_running_loop().create_future()
+            # Blocks (and so stops reading this client) while the queue is full
+            await self._queue.put((job, done))
+
+            async def reply(request_id, done):
+                try:
+                    message = {'id': request_id, 'status': 'ok'}
+                    message.update(await done)
+                except Exception as e:
+                    message = {'id': request_id, 'status': 'error', 'error': repr(e)}
+                await respond(message)
+
+            task = asyncio.ensure_future(reply(request.get('id'), done))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.wait(pending)
+        writer.close()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            (params, ret, channels), done = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self._pool, run_job, params, ret, channels)
+                if not done.cancelled(): done.set_result(result)
+            except Exception as e:
+                if not done.cancelled(): done.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def serve(self, path=None, port=8765):
+        '''
+        Serve forever on a Unix socket (path) or localhost:port.
+        '''
+        self._queue = asyncio.Queue(self.queue_size)
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_warm)
+        # Start and warm every worker now rather than on the first requests
+        with multiprocessing.Manager() as manager:
+            barrier = manager.Barrier(self.workers)
+            await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(self._pool, _ready, barrier)
+                                   for _ in range(self.workers)])
+        dispatchers = [asyncio.ensure_future(self._dispatch()) for _ in range(self.workers)]
+
+        if path:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, '127.0.0.1', port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+            self._pool.shutdown()
+            if path and os.path.exists(path):
+                os.remove(path)
+
+class Client(object):
+    '''
+    Blocking client of the job server.
+
+    Parameters
+    ----------
+    path : str, optional
+        Unix socket of the server
+    port : int
+        localhost port of the server, if path is not given
+
+    Examples
+    --------
+    >>> with Client(port=8765) as client:
+    ...     results = client.map([{'DD': True}, {'DD': True, 'cDBS': True}])
+    '''
+    def __init__(self, path=None, port=8765):
+        if path:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection(('127.0.0.1', port))
+        self._file = self._sock.makefile('rw')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def map(self, params, ret='summary', channels=()):
+        '''
+        Submit a list of runs and wait for all of them.
+
+        Returns
+        -------
+        results : list of dict
+            Responses in the order of params. Arrays are decoded to numpy.
+        '''
+        for k,p in enumerate(params):
+            self._file.write(json.dumps({'id': k, 'params': p, 'return': ret, 'channels': list(channels)}) + '\n')
+        self._file.flush()
+
+        results = [None]*len(params)
+        for _ in params:
+            response = json.loads(self._file.readline())
+            if response.get('id') is None:
+                # Error not tied to a request (e.g. an unparseable line)
+                raise RuntimeError('server error: {}'.format(response.get('error')))
+            if 'arrays' in response:
+                response['arrays'] = {name: decode(a) for name,a in response['arrays'].items()}
+            results[response['id']] = response
+        return results
+
+    def run(self, params, ret='summary', channels=()):
+        '''Submit one run and wait for it'''
+        return self.map([params], ret, channels)[0]
+
+def main():
+    from docopt import docopt
+
+    args = docopt(__doc__)
+    server = Server(workers=int(args['--workers']) if args['--workers'] else None,
+                    queue=int(args['--queue']))
+    where = args['--socket'] or 'localhost:{}'.format(args['--port'])
+    print('Serving MFM jobs on {} with {} workers'.format(where, server.workers))
+    try:
+        asyncio.run(server.serve(path=args['--socket'], port=int(args['--port'])))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,8 @@ class aswift():
         Center frequency(ies) of transform
     fs : float (Hz)
         Sampling frequency
+    dtype : numpy complex dtype, optional
+        Precision of the transform state (complex128 by default)
 
     See Also
     --------
@@ -30,14 +32,14 @@ class aswift():
     swift
     '''
 
-    def __init__(self, tau_s, tau_f, f, fs):
+    def __init__(self, tau_s, tau_f, f, fs, dtype=complex):
         self.__tau_s = tau_s
         self.__tau_f = tau_f
         self.__f = f
         self.__fs = fs
               
-        self.__slow = swift(self.tau_s,self.f,self.fs)
-        self.__fast = swift(self.tau_f,self.f,self.fs)
+        self.__slow = swift(self.tau_s,self.f,self.fs,dtype)
+        self.__fast = swift(self.tau_f,self.f,self.fs,dtype)
 
     def slide(self, x):
         '''
@@ -96,6 +98,8 @@ class swift():
         Center frequency(ies) of transform
     fs : float (Hz)
         Sampling frequency
+    dtype : numpy complex dtype, optional
+        Precision of the transform state (complex128 by default)
     
     See Also
     --------
@@ -103,7 +107,7 @@ class swift():
     sdft
     '''
 
-    def __init__(self,tau,f,fs):
+    def __init__(self,tau,f,fs,dtype=complex):
         tau,f,fs = self.__paramcheck(tau,f,fs)
         
         self.__tau  = tau
@@ -111,9 +115,9 @@ class swift():
         self.__fs   = fs
         self.__ntau = self.tau*self.fs
         
-        self.Xf = np.zeros(len(self.f),dtype=complex)
+        self.Xf = np.zeros(len(self.f),dtype=dtype)
         
-        self.e = np.exp(2j*np.pi*self.f/self.fs)*np.exp(-1./self.ntau)
+        self.e = (np.exp(2j*np.pi*self.f/self.fs)*np.exp(-1./self.ntau)).astype(dtype)
 
     def slide(self,x):
         '''
@@ -0,0 +1,34 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from analysis import linear_psd, stability
+
+def test_DD_beta_oscillation_is_unstable():
+    result = stability(DD=True)
+    assert not result['stable']
+    assert result['frequency'] == pytest.approx(29.58, abs=0.05)
+    assert result['growth'] == pytest.approx(0.109, abs=0.01)
+
+def test_healthy_beta_oscillation_grows_under_euler():
+    result = stability(DD=False)
+    assert not result['stable']
+    assert result['frequency'] == pytest.approx(30.53, abs=0.05)
+    assert result['growth'] == pytest.approx(13.35, abs=0.05)
+
+def test_continuous_scheme_is_stable():
+    for DD in (False, True):
+        assert stability(DD=DD, scheme='continuous')['stable']
+
+def test_linear_psd_warns_when_unstable():
+    for DD in (False, True):
+        with pytest.warns(RuntimeWarning):
+            f, Pxx = linear_psd(DD=DD)
+        assert np.all(np.isfinite(Pxx)) and np.all(Pxx > 0)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        linear_psd(DD=True, scheme='continuous')
+        f, Pxx = linear_psd(DD=True, schedule=[[0, {'vse': 0.76}]])
+    assert np.all(Pxx > 0)
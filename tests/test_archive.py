@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from archive import Archive, pack
+from mfm import MFM
+from model_spec import BGTCS, ModelSpec
+
+def _runs():
+    runs = []
+    for options in [{'DD': True}, {'DD': True, 'pDBS': True}]:
+        mfm = MFM(tstop=1, seed=7, verbose=False, **options)
+        mfm.run()
+        runs.append(mfm)
+    return runs
+
+def test_round_trip(tmp_path):
+    runs = _runs()
+    for compress in (False, True):
+        path = str(tmp_path / 'runs{}.npz'.format(int(compress)))
+        pack(path, runs, compress=compress)
+        data = Archive(path)
+        assert len(data) == len(runs)
+        for k,mfm in enumerate(runs):
+            run = data.run(k)
+            assert np.array_equal(run.S, mfm.S)
+            for key in mfm.memory:
+                assert np.array_equal(run.memory[key], mfm.memory[key])
+            assert run.params['pDBS'] == mfm.params['pDBS']
+            assert np.array_equal(data.channel('p2', [k])[0], mfm.S[:,mfm.struct['p2']])
+        data.close()
+
+def test_other_model(tmp_path):
+    # Cortex only: the state channels follow the model
+    keep = {'e', 'i', 'phie', 'Ve'}
+    spec = ModelSpec(populations=[p for p in BGTCS.populations if p[0] in keep],
+                     edges=[e for e in BGTCS.edges if e[0] in keep and e[1] in keep], params=BGTCS.params)
+    spec.save(str(tmp_path / 'ei.json'))
+    mfm = MFM(model=str(tmp_path / 'ei.json'), DD=False, state_target='e', stim_target='e',
+              tstop=1, seed=7, verbose=False)
+    mfm.run()
+
+    path = str(tmp_path / 'ei.npz')
+    pack(path, [mfm])
+    data = Archive(path)
+    assert data.channels == ['phie', 'phie_dot', 'e', 'e_dot', 'i', 'i_dot', 'amp', 'phase', 'stim']
+    assert np.array_equal(data.run(0).S, mfm.S)
+    assert np.array_equal(data.channel('i')[0], mfm.S[:,mfm.struct['i']])
+    data.close()
+
+    with pytest.raises(ValueError):
+        pack(path, [mfm] + _runs())
@@ -0,0 +1,14 @@
+from catalog import Catalog, evaluate
+
+def test_evaluate_simulates_only_missing_runs(tmp_path):
+    catalog = Catalog(str(tmp_path / 'catalog.db'))
+    runs = [{'DD': True, 'tstop': 3, 'seed': 1}, {'DD': True, 'pDBS': True, 'tstop': 3, 'seed': 1}]
+    first = evaluate(runs, catalog, processes=1)
+    assert len(catalog) == 2
+    assert runs[0] in catalog and {'DD': True, 'tstop': 3} in catalog
+
+    second = evaluate(runs + [{'DD': False, 'tstop': 3, 'seed': 1}], catalog, processes=1)
+    assert len(catalog) == 3
+    assert second[:2] == first
+    assert first[1]['pulses'] > 0
+    catalog.close()
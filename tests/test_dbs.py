@@ -0,0 +1,41 @@
+import numpy as np
+
+from dbs import pDBS
+
+def _pDBS():
+    return pDBS(f=29, tau_s=0.2397, tau_f=0.2397/5, phase_thr=2.24, power_thr=-28.57)
+
+def _signal(n=20000):
+    return 10*np.sin(2*np.pi*29*np.arange(n)*1e-3) + 5*np.random.RandomState(0).randn(n)
+
+def test_step_matches_advance():
+    a, b = _pDBS(), _pDBS()
+    for x in _signal():
+        assert a.step(float(x)) == b.advance(x)
+        assert a.amp == b.amp and a.phase == b.phase
+    assert isinstance(a.amp, float) and isinstance(a.phase, float)
+
+def test_advance_over_samples_matches_steps():
+    x = _signal(1000)
+    a, b = _pDBS(), _pDBS()
+    a.process(x[:-1])
+    assert a.step(float(x[-1])) == b.advance(x)
+    assert a.amp == b.amp and a.phase == b.phase
+
+def test_stimulates_at_the_phase_threshold():
+    stim = _pDBS().process(_signal())
+    fired = np.flatnonzero(stim)
+    assert len(fired) > 0
+    # At most one pulse per refractory period (0.3 cycles of 29 Hz)
+    assert np.diff(fired).min() >= int(1/(29*1e-3)*0.3)
+
+def test_aswift_holds_the_transform():
+    from swift import aswift
+
+    x = _signal(2000)
+    a = _pDBS()
+    a.advance(x)
+    ref = aswift(tau_s=0.2397, tau_f=0.2397/5, f=29, fs=1e3)
+    Xf = ref.slide(x)
+    assert np.allclose(a.aswift.slow.Xf - a.aswift.fast.Xf, Xf, rtol=1e-12)
+    assert a.aswift.slow.Xf[0] - a.aswift.fast.Xf[0] == a._X
@@ -0,0 +1,50 @@
+import os
+import time
+
+from jobqueue import Queue, Worker
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = Queue(str(tmp_path / 'queue'), lease=0.5, retries=3)
+    job_id, = queue.submit([{'DD': True, 'tstop': 2}])
+
+    stale = queue.claim('a')
+    assert queue.heartbeat(stale)
+    time.sleep(0.6)
+    assert queue.requeue_expired() == 1
+    assert queue.status()['pending'] == 1
+
+    job = queue.claim('b')
+    assert job['id'] == job_id and job['attempts'] == 2
+    assert 'lease expired' in job['errors'][0]
+
+    # The stale claim can neither renew nor complete the job, nor remove
+    # the running file of the new claim
+    assert not queue.heartbeat(stale)
+    assert not queue.complete(stale, {'pulses': -1})
+    assert os.path.exists(queue._path('running', job_id))
+    assert queue.heartbeat(job)
+
+    assert queue.complete(job, {'pulses': 0})
+    assert queue.results([job_id]) == [{'pulses': 0}]
+    assert queue.status() == {'pending': 0, 'running': 0, 'done': 1, 'failed': 0}
+
+def test_unreadable_running_job_fails(tmp_path):
+    queue = Queue(str(tmp_path / 'queue'), lease=0.5)
+    job_id, = queue.submit([{'DD': True, 'tstop': 2}])
+    queue.claim('a')
+    with open(queue._path('running', job_id), 'w') as f:
+        f.write('{"id": ')
+    time.sleep(0.6)
+
+    assert queue.status() == {'pending': 0, 'running': 0, 'done': 0, 'failed': 1}
+    job, = queue.failures()
+    assert job['id'] == job_id and job['raw'] == '{"id": '
+    assert 'unreadable' in job['errors'][-1]
+
+def test_worker_runs_jobs(tmp_path):
+    queue = Queue(str(tmp_path / 'queue'))
+    ids = queue.submit([{'DD': True, 'tstop': 2, 'seed': 1}, {'DD': True, 'tstop': 2, 'precision': 'half'}])
+    assert Worker(queue, poll=0.01).run(exit_idle=True) == queue.retries + 1
+    assert queue.results(ids)[0]['length'] == 2
+    failed, = queue.failures()
+    assert failed['id'] == ids[1] and len(failed['errors']) == queue.retries
@@ -0,0 +1,58 @@
+import numpy as np
+
+from analysis import fixed_point
+from mfm import MFM
+
+# Noise-free and linearly stable (see analysis.stability)
+QUIET = [[0, {'noiseAmp': 0, 'vse': 0.76}]]
+
+def test_x0_fills_history():
+    x = fixed_point(DD=True, schedule=QUIET)
+
+    mfm = MFM(DD=True, x0=x, tstop=1, schedule=QUIET, verbose=False)
+    mfm.run()
+    assert np.abs(mfm.S - x).max() < 1e-9
+
+    # Starting only S[0] at the fixed point leaves a zero history behind it
+    cold = MFM(DD=True, tstop=1, schedule=QUIET, verbose=False)
+    cold.S[0] = x
+    cold.run()
+    assert np.abs(cold.S - x).max() > 1.
+
+def _run(**kwargs):
+    mfm = MFM(tstop=2, seed=3, verbose=False, **kwargs)
+    mfm.run()
+    return mfm
+
+def test_empty_schedule_is_bit_identical():
+    for options in [{'DD': True}, {'DD': False}, {'cDBS': True}, {'pDBS': True}]:
+        a, b = _run(**options), _run(schedule=[], **options)
+        assert np.array_equal(a.S, b.S)
+        for key in a.memory:
+            assert np.array_equal(a.memory[key], b.memory[key])
+
+def test_schedule_at_start_matches_options():
+    a = _run(DD=True)
+    b = _run(DD=False, schedule=[[0, {'DD': True}]])
+    assert np.array_equal(a.S, b.S)
+
+def test_scheduled_parameter_survives_DD_toggle():
+    mfm = _run(DD=True, schedule=[[0, {'vsp1': 0.5}], [1, {'DD': False}]])
+    assert mfm.vsp1 == 0.5
+    assert not mfm.params['DD']
+
+def test_early_stop_is_a_prefix_of_the_full_run():
+    stop = dict(stop_metric='beta_power', stop_window=1, stop_min=3, stop_tol=2.)
+    mfm = MFM(tstop=30, seed=2, verbose=False, **stop)
+    mfm.run()
+    assert mfm.stop['reason'] == 'converged' and mfm.stop['ci'] < 2.
+    N = mfm.params['N']
+    assert N < 30000 and mfm.S.shape[0] == N and mfm.S.base is None
+
+    full = MFM(tstop=N*1e-3, seed=2, verbose=False)
+    full.run()
+    assert np.array_equal(mfm.S, full.S)
+
+def test_no_early_stop_without_metric():
+    mfm = _run(DD=True)
+    assert mfm.stop['reason'] == 'tstop' and mfm.params['N'] == 2000
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from mfm import MFM
+from model_spec import BGTCS
+
+FIELDS = ['col', 'Q', 'theta', 'rate', 'const', 'pre', 'post', 'w', 'delay', 'sig', 'pre_Q', 'pre_theta']
+
+@pytest.mark.parametrize('DD', [False, True])
+def test_compile_matches_mfm_kernel(DD):
+    kernel = BGTCS.compile('DD' if DD else 'healthy', dt=1e-3)
+    reference = MFM(tstop=1e-3, DD=DD, verbose=False)._kernel
+    for field in FIELDS:
+        assert np.array_equal(getattr(kernel, field), getattr(reference, field)), field
+    for field in ['damp', 'gammasq', 'gammae', 'noiseAmp']:
+        assert getattr(kernel, field) == getattr(reference, field), field
+
+def test_saved_spec_runs_like_default(tmp_path):
+    fname = str(tmp_path / 'bgtcs.json')
+    BGTCS.save(fname)
+    options = dict(tstop=0.5, DD=True, seed=3, verbose=False)
+    a = MFM(**options); a.run()
+    b = MFM(model=fname, **options); b.run()
+    assert np.array_equal(a.S, b.S)
+
+def test_variant_without_edge():
+    weight = BGTCS.edges[0][2]
+    kernel = BGTCS.variant(remove=[weight]).compile()
+    assert len(kernel.w) == len(BGTCS.edges) - 1
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from mfm import MFM
+from model_spec import BGTCS, ModelSpec
+from network import Network
+
+def test_single_node_matches_mfm():
+    for options in [{'DD': True}, {'DD': True, 'cDBS': True}, {'DD': True, 'pDBS': True}]:
+        mfm = MFM(tstop=2, seed=5, verbose=False, **options)
+        mfm.run()
+        net = Network([options], tstop=2, seed=5, verbose=False, record=['p1', 'STN', 'stim', 'amp'])
+        net.run()
+        for name in ['p1', 'STN']:
+            assert np.array_equal(net.record[name][:,0], mfm.S[:,mfm.struct[name]])
+        assert np.array_equal(net.record['stim'][:,0], mfm.memory['stim'])
+        # The vectorised transform rounds differently from pDBS.step
+        assert np.allclose(net.record['amp'][:,0], mfm.memory['amp'], rtol=1e-9, atol=0)
+
+def test_rejects_unsupported_node_options():
+    for node in [{'schedule': [[1, {'DD': True}]]}, {'precision': 'single'}]:
+        with pytest.raises(ValueError):
+            Network([{}, node], tstop=0.01, verbose=False)
+
+def test_targets_are_checked_against_the_model():
+    spec = BGTCS.to_dict()
+    rename = lambda name: 'p3' if name == 'p1' else name
+    spec['populations'] = [(rename(p[0]),) + tuple(p[1:]) for p in spec['populations']]
+    spec['edges'] = [tuple(rename(v) for v in e) for e in spec['edges']]
+    model = ModelSpec(**spec)
+
+    net = Network(1, model=model, state_target='p3', tstop=0.01, verbose=False).run()
+    assert net.record['p3'].shape == (10, 1)
+    with pytest.raises(ValueError):
+        Network(1, model=model, tstop=0.01, verbose=False)
+    with pytest.raises(ValueError):
+        Network(2, model=model, state_target='p3', coupling=[('p1', 'phie', np.zeros((2,2)), 0.01)], verbose=False)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from paired import compare, paired_stats
+
+def test_ensemble_matches_separate_runs():
+    conditions = [{'DD': True}, {'DD': True, 'pDBS': True}]
+    rows, separate = compare(conditions, seeds=2, tstop=3)
+    ensemble_rows, ensemble = compare(conditions, seeds=2, tstop=3, ensemble=True)
+    for a,b in zip(separate, ensemble):
+        for s,t in zip(a, b):
+            assert sorted(s) == sorted(t)
+            for key in s:
+                assert np.isclose(s[key], t[key], rtol=1e-9, equal_nan=True), key
+    assert all(s['pulses'] > 0 for s in separate[1])
+    assert np.allclose([r['diff'] for r in rows], [r['diff'] for r in ensemble_rows], rtol=1e-9, equal_nan=True)
+
+def test_paired_stats_of_shifted_sample():
+    a = np.array([1., 4., 2., 8., 5.])
+    stats = paired_stats(a, a + 3)
+    assert np.isclose(stats['diff'], 3)
+    assert np.isclose(stats['sd'], 0)
+    assert np.allclose(stats['ci'], 3)
+    assert stats['efficiency'] == np.inf
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from analysis import fixed_point
+from mfm import MFM
+import parallel
+from parallel import run_batch
+
+RUNS = [{'DD': True, 'seed': 1, 'tstop': 1.5},
+        {'DD': False, 'seed': 2, 'tstop': 1},
+        {'DD': True, 'pDBS': True, 'seed': 3, 'tstop': 2}]
+
+def test_batch_matches_serial_runs():
+    batch = run_batch(RUNS, processes=2)
+    for options, run in zip(RUNS, batch):
+        mfm = MFM(verbose=False, **options)
+        mfm.run()
+        assert np.array_equal(run.S, mfm.S)
+        for key in mfm.memory:
+            assert np.array_equal(run.memory[key], mfm.memory[key])
+
+def test_memmap_backend(tmp_path):
+    batch = run_batch(RUNS[:1], processes=1, backend='memmap', path=str(tmp_path))
+    mfm = MFM(verbose=False, **RUNS[0])
+    mfm.run()
+    assert np.array_equal(batch[0].S, mfm.S)
+
+def test_failed_run_releases_shared_memory(monkeypatch):
+    from multiprocessing import shared_memory
+
+    names = []
+    def allocate(*args):
+        buffers, specs, handles = allocate.original(*args)
+        names.extend(shm.name for shm in handles)
+        return buffers, specs, handles
+    allocate.original = parallel._allocate
+    monkeypatch.setattr(parallel, '_allocate', allocate)
+
+    with pytest.raises(ValueError):
+        run_batch([RUNS[0], dict(RUNS[1], state_target='nope')], processes=1)
+    assert len(names) == 4
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+def test_given_arrays_are_recorded_into():
+    x = fixed_point(DD=True)
+    S, memory = np.full((1000, 20), np.nan), {key: np.full(1000, np.nan) for key in ['amp', 'phase', 'stim']}
+    mfm = MFM(DD=True, pDBS=True, x0=x, tstop=1, seed=4, verbose=False, S=S, memory=memory)
+    mfm.run()
+    assert mfm.S is S and mfm.memory['amp'] is memory['amp']
+
+    ref = MFM(DD=True, pDBS=True, x0=x, tstop=1, seed=4, verbose=False)
+    ref.run()
+    assert np.array_equal(S, ref.S)
+    for key in memory:
+        assert np.array_equal(memory[key], ref.memory[key])
@@ -0,0 +1,19 @@
+import numpy as np
+
+from mfm import MFM
+from precision import compare
+
+def test_single_precision_matches_double():
+    for options in [{'DD': True}, {'DD': True, 'pDBS': True}]:
+        row, = compare(seeds=(0,), tstop=4, **options)
+        d, s = row['double'], row['single']
+        assert s['f_peak'] == d['f_peak']
+        assert abs(s['power'] - d['power']) < 0.01
+        assert s['bytes'] == d['bytes'] / 2
+
+def test_single_precision_arrays():
+    mfm = MFM(precision='single', pDBS=True, tstop=1, seed=0, verbose=False)
+    mfm.run()
+    assert mfm.S.dtype == np.float32
+    assert all(value.dtype == np.float32 for value in mfm.memory.values())
+    assert mfm.swift.slow.Xf.dtype == np.complex64 and isinstance(mfm.pDBS._slow, np.complex64)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from mfm import MFM
+from replay import Trace, replay_cDBS, replay_pDBS
+
+def test_pDBS_replay_reproduces_run():
+    # Open loop replay sees the stimulated trace, so only the run's own
+    # settings must reproduce its stimuli
+    mfm = MFM(DD=True, pDBS=True, tstop=3, seed=11, verbose=False)
+    mfm.run()
+    result = replay_pDBS(Trace.from_run(mfm))
+    assert result['pulses'][0] > 0
+    assert np.array_equal(result['stim'][0], np.flatnonzero(mfm.memory['stim']))
+    # The vectorised transform rounds differently from pDBS.step
+    assert np.allclose(result['amp'][:-1], mfm.memory['amp'][1:], rtol=1e-9, atol=0)
+
+def test_cDBS_replay_reproduces_run():
+    mfm = MFM(DD=True, cDBS=True, tstop=2, seed=11, verbose=False)
+    mfm.run()
+    stim = replay_cDBS(Trace.from_run(mfm))[0]
+    assert np.array_equal(stim, np.flatnonzero(mfm.memory['stim']))
@@ -0,0 +1,26 @@
+import numpy as np
+
+from sensitivity import morris, sobol
+
+class Linear(object):
+    '''Toy problem y = 4*x0 + 2*x1 (x2 has no effect)'''
+    k = 3
+    coef = np.array([4., 2., 0.])
+
+    def evaluate(self, U):
+        return np.asarray(U).dot(self.coef)
+
+def test_morris_recovers_linear_effects():
+    result = morris(Linear(), r=10, bootstrap=50)
+    assert np.allclose(result['effects'], Linear.coef)
+    assert np.allclose(result['mu_star'], Linear.coef)
+    assert np.allclose(result['sigma'], 0)
+
+def test_sobol_indices_of_linear_function():
+    # Uniform inputs: S1 = ST = c_i**2 / sum(c**2)
+    expected = Linear.coef**2 / (Linear.coef**2).sum()
+    result = sobol(Linear(), n=4096, bootstrap=50)
+    assert np.allclose(result['S1'], expected, atol=0.05)
+    assert np.allclose(result['ST'], expected, atol=0.05)
+    assert result['ST'][2] == 0
+    assert np.all(result['S1_ci'][0] <= result['S1_ci'][1])
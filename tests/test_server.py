@@ -0,0 +1,60 @@
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from metrics import summarize
+from mfm import MFM
+from server import Client, Server
+
+def _serve(loop, task):
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    loop.close()
+
+def test_round_trip():
+    # Unix socket paths are limited to about 100 characters
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'mfm.sock')
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(Server(workers=2).serve(path=path))
+    thread = threading.Thread(target=_serve, args=(loop, task))
+    thread.start()
+    try:
+        start = time.time()
+        while not os.path.exists(path):
+            assert time.time() - start < 60 and thread.is_alive()
+            time.sleep(0.05)
+
+        params = {'DD': True, 'pDBS': True, 'tstop': 2, 'seed': 3}
+        with Client(path) as client:
+            ok, arrays, error = client.map([params, params, dict(params, precision='half')])
+            arrays = client.run(params, 'arrays', ['p1', 'stim'])
+            unknown = client.run(params, 'state')
+
+        # A client that leaves before its response does not stop the server
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        sock.sendall(b'{"id": 0, "params": {"tstop": 0.5}}\n')
+        sock.close()
+        with Client(path) as client:
+            assert client.run(params)['summary'] == ok['summary']
+        mfm = MFM(verbose=False, **params)
+        mfm.run()
+
+        assert ok['status'] == 'ok' and ok['summary'] == summarize(mfm)
+        assert np.array_equal(arrays['arrays']['p1'], mfm.S[:,mfm.struct['p1']])
+        assert np.array_equal(arrays['arrays']['stim'], mfm.memory['stim'])
+        assert error['status'] == 'error' and 'precision' in error['error']
+        assert unknown['id'] == 0 and unknown['status'] == 'error' and '"return"' in unknown['error']
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join(60)
+        shutil.rmtree(tmp)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from surrogate import Surrogate, features
+
+def _data(n, seed=0):
+    rs = np.random.RandomState(seed)
+    options, summaries = [], []
+    for _ in range(n):
+        o = {'DD': True, 'pDBS': True, 'pDBS_phase': rs.uniform(0, 2*np.pi), 'pDBS_power_thr': rs.uniform(-35, -25)}
+        options.append(o)
+        summaries.append({'beta_power': -30 + np.cos(o['pDBS_phase']) + 0.1*rs.randn(),
+                          'charge': rs.uniform(0, 10), 'length': 20.})
+    return options, summaries
+
+def _exact(gp, X):
+    '''GP mean and std from scratch with gp's hyperparameters'''
+    k = lambda A, B: gp.amplitude*np.exp(-0.5*np.square(A[:,None,:] - B).sum(-1))
+    W = (X - gp.x_mean) / (gp.x_std*gp.length_scale)
+    K = k(gp.Z, gp.Z) + gp.noise*np.eye(len(gp.Z))
+    ks = k(W, gp.Z)
+    mean = ks.dot(np.linalg.solve(K, gp.t))
+    var = gp.amplitude - np.einsum('ij,ji->i', ks, np.linalg.solve(K, ks.T))
+    return gp.y_mean + gp.y_std*mean, gp.y_std*np.sqrt(var)
+
+def test_update_conditions_on_new_runs():
+    options, summaries = _data(80)
+    model = Surrogate(refit=1000).fit(options[:60], summaries[:60])
+    model.update(options[60:], summaries[60:])
+    assert len(model) == 80
+
+    X = np.array([features(o) for o in _data(20, seed=1)[0]])
+    prediction = model.predict_features(X)
+    for key,gp in zip(model.targets, model._gps):
+        mean, std = _exact(gp, X)
+        assert np.allclose(prediction[key][0], mean, rtol=1e-8, atol=1e-10)
+        assert np.allclose(prediction[key][1], std, rtol=1e-6, atol=1e-10)
+
+def test_predict_matches_predict_features():
+    options, summaries = _data(40)
+    model = Surrogate().fit(options, summaries)
+    query = {'DD': True, 'pDBS': True, 'pDBS_phase': 2.0, 'pDBS_power_thr': -29.}
+    single = model.predict(query, observed=True)
+    batch = model.predict_features(features(query)[None], observed=True)
+    for key in model.targets:
+        assert single[key] == (batch[key][0][0], batch[key][1][0])
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from utils import minmax_decimate, DecimatedLine
+
+def test_decimate_keeps_envelope():
+    y = np.random.RandomState(0).randn(10007)
+    idx, out = minmax_decimate(y, 5, 10007, 100)
+    assert len(out) <= 2*(100 + 1) and len(idx) == len(out)
+    assert out.min() == y[5:].min() and out.max() == y[5:].max()
+    assert np.all(np.diff(idx) >= 0) and idx[0] == 5 and idx[-1] < 10007
+
+def test_decimate_short_range_unchanged():
+    y = np.arange(50.)
+    idx, out = minmax_decimate(y, 10, 30, 100)
+    assert np.array_equal(idx, np.arange(10, 30)) and np.array_equal(out, y[10:30])
+
+def test_line_redecimates_on_zoom():
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    y = np.sin(np.arange(100000)*1e-3)
+    line = DecimatedLine(ax, y, 1e-3)
+    assert len(line.line.get_xdata()) < 2*ax.bbox.width + 4
+    ax.set_xlim(10, 10.2)
+    x = line.line.get_xdata()
+    assert np.array_equal(line.line.get_ydata(), y[int(x[0]/1e-3):int(x[0]/1e-3)+len(x)])
+    plt.close(fig)
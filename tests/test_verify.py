@@ -0,0 +1,19 @@
+import numpy as np
+
+from verify import ENGINES, reference, trajectory, verify
+
+def test_trajectory_errors():
+    options = [{'DD': True, 'pDBS': True, 'tstop': 3, 'seed': 4, 'verbose': False}]
+    ref, = reference(options)
+    errors, passed = trajectory(ref, dict(ref), ENGINES['network'][1])
+    assert passed and all(value == 0 for value in errors.values())
+
+    shifted = dict(ref, x=ref['x'] + np.std(ref['x']), stim=ref['stim'][1:])
+    errors, passed = trajectory(ref, shifted, ENGINES['single'][1])
+    assert not passed
+    assert np.isclose(errors['x'], 1) and errors['stim'] > 0
+
+def test_network_engine_passes():
+    rows, passed = verify(['network'], ['pDBS'], seeds=3, tstop=3)
+    assert passed == {'network': True}
+    assert any(row[2] == 'statistics' for row in rows)
@@ -2,6 +2,8 @@ import time
 import datetime
 import os
 
+import numpy as np
+
 class progbar(object):
     '''
     Command line progress bar.
@@ -63,3 +65,139 @@ class progbar(object):
 
         print(out,end='')
 
+
+def minmax_decimate(y, i0, i1, bins):
+    '''
+    Min/max envelope of y[i0:i1] in at most `bins` bins.
+
+    Parameters
+    ----------
+    y : array_like
+        Uniformly sampled signal
+    i0, i1 : int
+        Sample range
+    bins : int
+        Number of bins (e.g. the width of the axes in pixels)
+
+    Returns
+    -------
+    idx : numpy.array
+        Sample index of each output point
+    out : numpy.array
+        Alternating bin minima and maxima, or y[i0:i1] if it has no more than
+        two samples per bin
+    '''
+    n = i1 - i0
+    k = int(np.ceil(float(n) / max(bins,1)))
+    if k <= 2:
+        return np.arange(i0,i1), np.asarray(y[i0:i1])
+
+    m = n // k
+    seg = np.asarray(y[i0:i0+m*k]).reshape(m,k)
+    idx = (i0 + np.arange(m)*k)[:,None] + np.array([0,k//2])
+    out = np.column_stack([seg.min(1),seg.max(1)])
+    if i0 + m*k < i1:
+        tail = np.asarray(y[i0+m*k:i1])
+        idx = np.vstack([idx, [i0+m*k, i0+m*k+len(tail)//2]])
+        out = np.vstack([out, [tail.min(), tail.max()]])
+    return idx.ravel(), out.ravel()
+
+class _Decimated(object):
+    '''
+    Base class of artists that are recomputed for the visible x range of a
+    set of shared axes.
+    '''
+    def __init__(self, ax, dt, n):
+        self.ax = ax
+        self.dt = dt
+        self.n  = n
+        for other in ax.get_shared_x_axes().get_siblings(ax):
+            # Shared axes only emit xlim_changed on the axes being zoomed
+            other.callbacks.connect('xlim_changed', self._on_xlim)
+
+    def _range(self, ax):
+        x0,x1 = ax.get_xlim()
+        i0 = min(max(int(x0/self.dt) - 1, 0), self.n)
+        i1 = min(max(int(x1/self.dt) + 2, 0), self.n)
+        bins = max(int(self.ax.bbox.width), 1)
+        return i0, i1, bins
+
+    def _on_xlim(self, ax):
+        # Artists are marked stale; the canvas redraws after navigation
+        self.update(*self._range(ax))
+
+class DecimatedLine(_Decimated):
+    '''
+    Line plot of a uniformly sampled signal that draws the min/max envelope of
+    the visible range at the resolution of the axes, and re-decimates on zoom.
+    The x limits are left to the caller.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+    y : array_like
+        Signal, sampled at t = i*dt
+    dt : float
+        Sampling interval
+    **kwargs
+        Passed to ax.plot
+    '''
+    def __init__(self, ax, y, dt, **kwargs):
+        super(DecimatedLine,self).__init__(ax, dt, len(y))
+        self.y = y
+        self.line, = ax.plot([], [], **kwargs)
+        self.update(0, self.n, max(int(ax.bbox.width), 1))
+        if self.n:
+            y = self.line.get_ydata()
+            ax.update_datalim([[0, y.min()], [self.n*dt, y.max()]])
+            ax.autoscale_view(scalex=False)
+
+    def update(self, i0, i1, bins):
+        idx, y = minmax_decimate(self.y, i0, i1, bins)
+        self.line.set_data(idx*self.dt, y)
+
+class StimMarkers(_Decimated):
+    '''
+    Stimulation pulse markers. Pulses are drawn as individual vertical lines
+    while there are fewer than one per pixel in the visible range, and as the
+    number of pulses per pixel (relative to the densest pixel) otherwise.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+    pulses : array_like of int
+        Sample index of each pulse
+    dt : float
+        Sampling interval
+    n : int
+        Number of samples in the run
+    '''
+    def __init__(self, ax, pulses, dt, n):
+        super(StimMarkers,self).__init__(ax, dt, n)
+
+        self.pulses = np.sort(np.asarray(pulses))
+        self.artist = None
+        ax.update_datalim([[0, 0], [n*dt, 1]])
+        ax.set_ylim(0, 1.05)
+        self.update(0, n, max(int(ax.bbox.width), 1))
+
+    def update(self, i0, i1, bins):
+        from matplotlib.collections import LineCollection, PolyCollection
+
+        if self.artist is not None:
+            self.artist.remove()
+
+        a, b = np.searchsorted(self.pulses, [i0, i1])
+        visible = self.pulses[a:b]*self.dt
+        if len(visible) <= bins:
+            segments = np.zeros((len(visible),2,2))
+            segments[:,:,0] = visible[:,None]
+            segments[:,1,1] = 1
+            artist = LineCollection(segments, colors='C0')
+        else:
+            counts, edges = np.histogram(visible, bins=bins, range=(i0*self.dt, i1*self.dt))
+            x = np.repeat(edges,2)
+            y = np.concatenate([[0], np.repeat(counts/float(counts.max()),2), [0]])
+            artist = PolyCollection([np.column_stack([x,y])], facecolors='C0', linewidths=0)
+        # Leave the data limits alone so that zooming is not re-triggered
+        self.artist = self.ax.add_collection(artist, autolim=False)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+'''
+Equivalence checks of accelerated engines against the reference MFM.
+
+Each candidate engine is run on a set of model configurations and checked two
+ways against MFM in double precision:
+
+  trajectory   Same seeds, so identical noise. The state_target trajectory
+               (relative to its standard deviation), the SWIFT amplitude and
+               the stimulation times must agree within the engine's
+               tolerances (zero tolerance means bit for bit).
+  statistics   Independent seeds. Beta peak frequency, beta power, 5-50 Hz
+               power and stimulation rate across seeds are compared with
+               two-sample Kolmogorov-Smirnov and Welch t tests, at a
+               Bonferroni corrected level.
+
+Usage:
+  verify [options] [<engine>...]
+
+Engines (default: all): single, network, ensemble
+
+Options:
+  -n --seeds N        Number of seeds per configuration [default: 8]
+  -t --tstop T        Length of each run (s) [default: 10]
+  --burn T            Initial transient excluded from the metrics (s) [default: 1.0]
+  --alpha A           Family-wise significance level [default: 0.01]
+  -c --configs LIST   Comma separated configurations [default: healthy,DD,cDBS,pDBS]
+  -h --help           Show this screen
+'''
+
+import numpy as np
+
+from mfm import MFM
+
+CONFIGS = {'healthy' : {'DD': False},
+           'DD'      : {'DD': True},
+           'cDBS'    : {'DD': True, 'cDBS': True},
+           'pDBS'    : {'DD': True, 'pDBS': True}}
+
+METRICS = ['beta_freq', 'beta_power', 'broadband_power', 'stim_rate']
+
+# Offset of the seeds of the statistical comparison's candidate runs
+SEED_OFFSET = 100000
+
+def _target(options):
+    return options.get('state_target') or MFM(tstop=1e-3, verbose=False).params['state_target']
+
+def _result(x, amp, stim, dt):
+    return {'x': np.asarray(x, dtype=np.float64), 'amp': np.asarray(amp, dtype=np.float64),
+            'stim': np.flatnonzero(stim), 'dt': dt}
+
+def _mfm_runs(options, **extra):
+    from parallel import run_batch
+
+    batch = run_batch([dict(o, **extra) for o in options])
+    results = []
+    for mfm in batch:
+        target = mfm.S[:,mfm.struct[mfm.params['state_target']]]
+        results.append(_result(target, mfm.memory['amp'], mfm.memory['stim'], mfm.params['dt']))
+    return results
+
+def reference(options):
+    '''MFM in double precision'''
+    return _mfm_runs(options)
+
+def single(options):
+    '''MFM in single precision'''
+    return _mfm_runs(options, precision='single')
+
+def network(options):
+    '''One-node Network per run'''
+    from network import Network
+
+    results = []
+    for o in options:
+        target = _target(o)
+        net = Network(1, record=[target, 'amp', 'stim'], **dict(o, verbose=False)).run()
+        results.append(_result(net.record[target][:,0], net.record['amp'][:,0], net.record['stim'][:,0], net.params['dt']))
+    return results
+
+def ensemble(options):
+    '''
+    Uncoupled Network of all the runs of a configuration at once. Nodes draw
+    their noise from one stream, so only the statistics are comparable.
+    '''
+    from network import Network
+
+    groups = {}
+    for k,o in enumerate(options):
+        key = repr(sorted((key,value) for key,value in o.items() if key != 'seed'))
+        groups.setdefault(key, []).append(k)
+
+    results = [None]*len(options)
+    for members in groups.values():
+        o = dict(options[members[0]], verbose=False)
+        target = _target(o)
+        net = Network(len(members), record=[target, 'amp', 'stim'], **o).run()
+        for j,k in enumerate(members):
+            results[k] = _result(net.record[target][:,j], net.record['amp'][:,j], net.record['stim'][:,j], net.params['dt'])
+    return results
+
+# name: (run function, tolerances). Tolerances of None skip the trajectory check.
+ENGINES = {'single'   : (single,   {'x': 1e-3, 'amp': 1e-3, 'stim': 0.02}),
+           'network'  : (network,  {'x': 0, 'amp': 1e-9, 'stim': 0}),
+           'ensemble' : (ensemble, None)}
+
+def summary(result, burn=1.0):
+    '''Metrics of one result of an engine'''
+    from metrics import psd, band_power, BETA
+
+    dt = result['dt']
+    x = result['x'][int(burn/dt):]
+    f, Pxx = psd(x, 1./dt)
+    beta = (f >= BETA[0]) & (f <= BETA[1])
+    return {'beta_freq'       : f[beta][np.argmax(Pxx[beta])],
+            'beta_power'      : band_power(f, Pxx, BETA),
+            'broadband_power' : band_power(f, Pxx, (5., 50.)),
+            'stim_rate'       : len(result['stim']) / (len(result['x'])*dt)}
+
+def trajectory(ref, cand, tol, burn=1.0):
+    '''
+    Same-seed agreement of a candidate result with the reference.
+
+    Returns
+    -------
+    errors : dict
+        x    : maximum state_target error relative to the reference standard deviation
+        amp  : maximum error of the SWIFT power (the dB amplitude in linear
+               units) after burn, relative to its mean
+        stim : stimulation times in only one of the two runs, as a fraction of all pulses
+    passed : bool
+    '''
+    x = np.max(np.abs(cand['x'] - ref['x'])) / (np.std(ref['x']) or 1.)
+    a = 10**(ref['amp'][int(burn/ref['dt']):]/10)
+    b = 10**(cand['amp'][int(burn/ref['dt']):]/10)
+    amp = np.max(np.abs(b - a)) / (np.mean(a) or 1.)
+    mismatched = len(np.setxor1d(ref['stim'], cand['stim']))
+    stim = mismatched / float(max(len(ref['stim']) + len(cand['stim']), 1))
+
+    errors = {'x': x, 'amp': amp, 'stim': stim}
+    return errors, all(errors[key] <= tol[key] for key in errors)
+
+def statistics(ref, cand, metrics=METRICS):
+    '''
+    Two-sample tests of the metrics of independent reference and candidate runs.
+
+    Returns
+    -------
+    p : dict
+        Smallest of the KS and Welch t test p-values of each metric. Metrics
+        that are constant and equal in both samples get p=1.
+    '''
+    from scipy import stats
+
+    p = {}
+    for key in metrics:
+        a = np.array([s[key] for s in ref])
+        b = np.array([s[key] for s in cand])
+        if np.ptp(a) == 0 and np.ptp(b) == 0:
+            p[key] = 1. if a[0] == b[0] else 0.
+            continue
+        p_ks = stats.ks_2samp(a, b)[1]
+        p_t = stats.ttest_ind(a, b, equal_var=False)[1]
+        p[key] = float(np.nanmin([p_ks, p_t]))
+    return p
+
+def verify(engines=None, configs=None, seeds=8, tstop=10., burn=1.0, alpha=0.01, **kwargs):
+    '''
+    Run the checks.
+
+    Parameters
+    ----------
+    engines : list of str, optional
+        Names in ENGINES (default: all)
+    configs : list of str, optional
+        Names in CONFIGS (default: all)
+    seeds : int
+        Runs per configuration
+    tstop : float (s)
+        Length of each run
+    burn : float (s)
+        Transient excluded from the metrics
+    alpha : float
+        Family-wise significance level of each engine's statistical tests
+    **kwargs
+        MFM options added to every configuration
+
+    Returns
+    -------
+    rows : list of tuple
+        (engine, config, check, quantity, value, threshold, passed)
+    passed : dict
+        Overall result of each engine
+    '''
+    engines = engines or sorted(ENGINES)
+    configs = configs or list(CONFIGS)
+
+    def options(seed_offset):
+        return [dict(CONFIGS[c], tstop=tstop, seed=seed_offset + s, verbose=False, **kwargs)
+                for c in configs for s in range(seeds)]
+
+    same = options(0)
+    ref = reference(same)
+    ref_summary = [summary(r, burn) for r in ref]
+
+    rows, passed = [], {}
+    for name in engines:
+        run, tol = ENGINES[name]
+        ok = True
+        if tol is not None:
+            cand = run(same)
+            for k,(r,c) in enumerate(zip(ref, cand)):
+                errors, good = trajectory(r, c, tol, burn)
+                ok &= good
+                if not good or k % seeds == 0:
+                    for key,value in errors.items():
+                        rows.append((name, configs[k//seeds], 'trajectory (seed {})'.format(k % seeds),
+                                     key, value, tol[key], value <= tol[key]))
+
+        cand = run(options(SEED_OFFSET))
+        cand_summary = [summary(r, burn) for r in cand]
+        level = alpha / (len(configs)*len(METRICS))
+        for j,c in enumerate(configs):
+            part = slice(j*seeds, (j+1)*seeds)
+            for key,p in statistics(ref_summary[part], cand_summary[part]).items():
+                ok &= p >= level
+                rows.append((name, c, 'statistics', key, p, level, p >= level))
+        passed[name] = ok
+    return rows, passed
+
+def main():
+    import sys
+    from docopt import docopt
+    from tabulate import tabulate
+
+    args = docopt(__doc__)
+    for name in args['<engine>']:
+        if name not in ENGINES:
+            sys.exit('unknown engine {!r}'.format(name))
+    rows, passed = verify(engines=args['<engine>'] or None,
+                          configs=args['--configs'].split(','),
+                          seeds=int(args['--seeds']),
+                          tstop=float(args['--tstop']),
+                          burn=float(args['--burn']),
+                          alpha=float(args['--alpha']))
+
+    table = [row[:6] + ('pass' if row[6] else 'FAIL',) for row in rows]
+    print(tabulate(table, headers=['Engine', 'Config', 'Check', 'Quantity', 'Value', 'Threshold', ''], floatfmt='.3g'))
+    print()
+    for name,ok in passed.items():
+        print('{:<10} {}'.format(name, 'PASS' if ok else 'FAIL'))
+    sys.exit(0 if all(passed.values()) else 1)
+
+if __name__ == '__main__':
+    main()